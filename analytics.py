@@ -0,0 +1,300 @@
+"""
+Time-bucketed view analytics for business listings and professional profiles
+
+A view is counted once per visitor per VIEW_DEDUP_WINDOW (crawlers are not
+counted at all), and every visitor is added to a per-day HyperLogLog sketch
+for approximate unique-visitor counts; see visitors.py.
+
+Views are counted in memory per (entity, hour) and written in batches as
+hourly buckets. A periodic rollup (flask rollup-views) folds hourly buckets
+older than VIEW_HOURLY_RETENTION_HOURS into daily buckets and drops daily
+buckets past VIEW_DAILY_RETENTION_DAYS, so the table stays small and
+dashboard charts read at most a few dozen aggregated rows.
+"""
+import atexit
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from flask import current_app, request
+from sqlalchemy import and_, func, or_
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, ViewBucket, VisitorSketch
+from visitors import HyperLogLog, RotatingBloomFilter, is_bot, visitor_id
+
+HOUR = 'hour'
+DAY = 'day'
+
+# Rows per INSERT ... ON CONFLICT batch
+UPSERT_BATCH_SIZE = 500
+
+# 2**10 registers: 1 KB per sketch, ~3% standard error
+SKETCH_PRECISION = 10
+
+
+def truncate_hour(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def truncate_day(moment):
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class ViewAccumulator:
+    """Thread-safe in-memory view counts and visitor sketches waiting to be written"""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._counts = Counter()
+        self._sketches = {}
+        self._lock = threading.Lock()
+        self._last_flush = clock()
+
+    def __len__(self):
+        return len(self._counts) + len(self._sketches)
+
+    def add(self, entity_type, entity_id, moment=None, views=1):
+        """Count views for an entity in the hour containing moment"""
+        bucket = truncate_hour(moment or datetime.utcnow())
+        with self._lock:
+            self._counts[(entity_type, entity_id, bucket)] += views
+
+    def add_visitor(self, entity_type, entity_id, visitor, moment=None):
+        """Add a visitor to the entity's sketch for the day containing moment"""
+        key = (entity_type, entity_id, (moment or datetime.utcnow()).date())
+        with self._lock:
+            sketch = self._sketches.get(key)
+            if sketch is None:
+                sketch = self._sketches[key] = HyperLogLog(SKETCH_PRECISION)
+            sketch.add(visitor)
+
+    def due(self, interval, max_pending):
+        """Check whether it's time to write the pending counts"""
+        return (len(self) >= max_pending or
+                (len(self) > 0 and self.clock() - self._last_flush >= interval))
+
+    def drain(self):
+        """Take all pending counts and sketches, leaving the accumulator empty"""
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+            sketches, self._sketches = self._sketches, {}
+            self._last_flush = self.clock()
+        return counts, sketches
+
+    def restore(self, counts, sketches):
+        """Put back counts and sketches that could not be written"""
+        with self._lock:
+            self._counts.update(counts)
+            for key, sketch in sketches.items():
+                if key in self._sketches:
+                    self._sketches[key].merge(sketch)
+                else:
+                    self._sketches[key] = sketch
+
+
+view_accumulator = ViewAccumulator()
+
+
+def _upsert_statement():
+    """INSERT ... ON CONFLICT that adds to an existing bucket"""
+    dialect = db.engine.dialect.name
+    insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+    table = ViewBucket.__table__
+    stmt = insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.entity_type, table.c.entity_id,
+                        table.c.granularity, table.c.bucket_start],
+        set_={'views': table.c.views + stmt.excluded.views})
+
+
+def _upsert_buckets(connection, granularity, counts):
+    """Add (entity_type, entity_id, bucket_start) -> views into buckets"""
+    rows = [{'entity_type': entity_type, 'entity_id': entity_id,
+             'granularity': granularity, 'bucket_start': bucket_start, 'views': views}
+            for (entity_type, entity_id, bucket_start), views in counts.items()]
+    stmt = _upsert_statement()
+    for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+        connection.execute(stmt, rows[start:start + UPSERT_BATCH_SIZE])
+
+
+def _merge_sketches(connection, sketches):
+    """Fold pending sketches into the stored ones (register-wise max)"""
+    table = VisitorSketch.__table__
+    for (entity_type, entity_id, day), sketch in sketches.items():
+        key = and_(table.c.entity_type == entity_type, table.c.entity_id == entity_id,
+                   table.c.day == day)
+        stored = connection.execute(
+            table.select().with_only_columns(table.c.registers).where(key).with_for_update()
+        ).scalar()
+        if stored is None:
+            connection.execute(table.insert().values(
+                entity_type=entity_type, entity_id=entity_id, day=day,
+                registers=sketch.to_bytes()))
+        else:
+            sketch.merge(HyperLogLog(SKETCH_PRECISION, stored))
+            connection.execute(table.update().where(key).values(registers=sketch.to_bytes()))
+
+
+def flush_views():
+    """Write all pending view counts and sketches in one transaction"""
+    counts, sketches = view_accumulator.drain()
+    if not counts and not sketches:
+        return 0
+    try:
+        # Own connection, so the request's session and its events are untouched
+        with db.engine.begin() as connection:
+            if counts:
+                _upsert_buckets(connection, HOUR, counts)
+            _merge_sketches(connection, sketches)
+    except Exception as e:
+        view_accumulator.restore(counts, sketches)
+        current_app.logger.warning(f"Failed to write view buckets: {e}")
+        return 0
+    return len(counts) + len(sketches)
+
+
+_deduplicator = None
+_deduplicator_lock = threading.Lock()
+
+
+def _view_deduplicator():
+    global _deduplicator
+    if _deduplicator is None:
+        with _deduplicator_lock:
+            if _deduplicator is None:
+                config = current_app.config
+                _deduplicator = RotatingBloomFilter(
+                    config['VIEW_DEDUP_WINDOW'], config['VIEW_DEDUP_CAPACITY'],
+                    config['VIEW_DEDUP_ERROR_RATE'])
+    return _deduplicator
+
+
+def count_view(entity_type, entity_id):
+    """
+    Record a view of a listing/profile by the current visitor
+    Returns: True if it is a new view that should reach the view counter,
+    False for crawlers and for repeat views within the dedup window
+    """
+    if is_bot(request.headers.get('User-Agent')):
+        return False
+
+    visitor = visitor_id()
+    view_accumulator.add_visitor(entity_type, entity_id, visitor)
+    seen = _view_deduplicator().check_and_add(f'{entity_type}:{entity_id}:{visitor}')
+    if not seen:
+        view_accumulator.add(entity_type, entity_id)
+
+    # Write the batch once it is big or old enough
+    config = current_app.config
+    if view_accumulator.due(config['VIEW_FLUSH_INTERVAL'], config['VIEW_FLUSH_MAX_PENDING']):
+        flush_views()
+    return not seen
+
+
+def init_view_analytics(app):
+    """Make sure counts still in memory are written when the worker exits"""
+    def flush_at_exit():
+        with app.app_context():
+            flush_views()
+    atexit.register(flush_at_exit)
+
+
+def delete_view_history(entity_type, ids):
+    """Remove buckets and sketches of deleted listings/profiles (in the caller's transaction)"""
+    db.session.execute(ViewBucket.__table__.delete().where(
+        ViewBucket.entity_type == entity_type, ViewBucket.entity_id.in_(ids)))
+    db.session.execute(VisitorSketch.__table__.delete().where(
+        VisitorSketch.entity_type == entity_type, VisitorSketch.entity_id.in_(ids)))
+
+
+def rollup_view_buckets(now=None):
+    """
+    Fold old hourly buckets into daily ones and apply the retention policy
+    Returns: (hourly buckets rolled up, daily buckets expired)
+    """
+    now = now or datetime.utcnow()
+    config = current_app.config
+    # Only whole days are rolled up, so a day is never split across both tables
+    hourly_cutoff = truncate_day(now - timedelta(hours=config['VIEW_HOURLY_RETENTION_HOURS']))
+    daily_cutoff = truncate_day(now - timedelta(days=config['VIEW_DAILY_RETENTION_DAYS']))
+    table = ViewBucket.__table__
+
+    with db.engine.begin() as connection:
+        hourly = connection.execute(
+            table.select().with_only_columns(
+                table.c.entity_type, table.c.entity_id, table.c.bucket_start, table.c.views
+            ).where(table.c.granularity == HOUR, table.c.bucket_start < hourly_cutoff))
+
+        daily = Counter()
+        rolled_up = 0
+        for entity_type, entity_id, bucket_start, views in hourly:
+            daily[(entity_type, entity_id, truncate_day(bucket_start))] += views
+            rolled_up += 1
+
+        if daily:
+            _upsert_buckets(connection, DAY, daily)
+        connection.execute(table.delete().where(
+            table.c.granularity == HOUR, table.c.bucket_start < hourly_cutoff))
+        expired = connection.execute(table.delete().where(
+            table.c.granularity == DAY, table.c.bucket_start < daily_cutoff)).rowcount
+        connection.execute(VisitorSketch.__table__.delete().where(
+            VisitorSketch.day < daily_cutoff.date()))
+
+    return rolled_up, expired
+
+
+def views_by_day(entities, days=30, now=None):
+    """
+    Daily view totals for a set of listings/profiles, oldest day first
+    entities: iterable of (entity_type, entity_id)
+    Returns: list of (date, views) covering the last `days` days
+    """
+    now = now or datetime.utcnow()
+    first_day = truncate_day(now) - timedelta(days=days - 1)
+    totals = Counter()
+
+    ids_by_type = {}
+    for entity_type, entity_id in entities:
+        ids_by_type.setdefault(entity_type, []).append(entity_id)
+
+    if ids_by_type:
+        owned = or_(*(and_(ViewBucket.entity_type == entity_type, ViewBucket.entity_id.in_(ids))
+                      for entity_type, ids in ids_by_type.items()))
+        # Summed per bucket in SQL: at most `days` daily rows plus the
+        # hourly rows not yet rolled up
+        rows = db.session.query(
+            ViewBucket.bucket_start, func.sum(ViewBucket.views)
+        ).filter(owned, ViewBucket.bucket_start >= first_day).group_by(
+            ViewBucket.bucket_start).all()
+        for bucket_start, views in rows:
+            totals[truncate_day(bucket_start).date()] += views
+
+    return [((first_day + timedelta(days=offset)).date(),
+             totals[(first_day + timedelta(days=offset)).date()])
+            for offset in range(days)]
+
+
+def unique_visitors(entities, days=30, now=None):
+    """
+    Approximate distinct visitors across a set of listings/profiles
+    Merges at most `days` sketches per entity; a visitor of several of the
+    entities is counted once.
+    """
+    now = now or datetime.utcnow()
+    first_day = (truncate_day(now) - timedelta(days=days - 1)).date()
+
+    ids_by_type = {}
+    for entity_type, entity_id in entities:
+        ids_by_type.setdefault(entity_type, []).append(entity_id)
+    if not ids_by_type:
+        return 0
+
+    owned = or_(*(and_(VisitorSketch.entity_type == entity_type, VisitorSketch.entity_id.in_(ids))
+                  for entity_type, ids in ids_by_type.items()))
+    sketch = HyperLogLog(SKETCH_PRECISION)
+    for registers, in db.session.query(VisitorSketch.registers).filter(
+            owned, VisitorSketch.day >= first_day):
+        sketch.merge(HyperLogLog(SKETCH_PRECISION, registers))
+    return sketch.estimate()
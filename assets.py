@@ -0,0 +1,85 @@
+"""
+Fingerprinted static asset bundles
+
+build_assets.py bundles and minifies the sources below into content-hashed
+files under static/dist and precompresses them. At runtime asset_urls()
+resolves a bundle name to its hashed URL through static/dist/manifest.json,
+and /assets/ serves the files with a one-year immutable cache lifetime and
+the best precompressed variant the client accepts. Without a build (local
+development) asset_urls() falls back to the individual source files.
+"""
+import json
+import os
+
+from flask import abort, current_app, request, send_from_directory, url_for
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_NAME = 'manifest.json'
+
+# Bundle name -> source files under static/, concatenated in this order
+BUNDLES = {
+    'css/app.css': ['css/style.css'],
+    'js/app.js': ['js/main.js', 'js/navigation.js', 'js/forms.js'],
+    'js/search.js': ['js/search.js'],
+}
+
+# Preferred first; each maps to the suffix of the precompressed file
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def load_manifest():
+    """Bundle name -> hashed file, or an empty dict when assets are not built"""
+    try:
+        with open(os.path.join(DIST_DIR, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def asset_urls(name):
+    """
+    URLs to include for a bundle
+    Returns: the single fingerprinted URL when built, otherwise the source files
+    """
+    hashed = current_app.extensions['asset_manifest'].get(name)
+    if hashed:
+        return [url_for('asset', filename=hashed)]
+    return [url_for('static', filename=source) for source in BUNDLES[name]]
+
+
+def serve_asset(filename):
+    """Serve a fingerprinted file, precompressed when the client accepts it"""
+    if filename not in current_app.extensions['asset_manifest'].values():
+        abort(404)
+
+    encoding = None
+    served = filename
+    for candidate, suffix in ENCODINGS:
+        if (request.accept_encodings[candidate] and
+                os.path.isfile(os.path.join(DIST_DIR, filename + suffix))):
+            encoding = candidate
+            served = filename + suffix
+            break
+
+    # The content type is that of the uncompressed file
+    mimetype = 'text/css' if filename.endswith('.css') else 'text/javascript'
+    response = send_from_directory(DIST_DIR, served, mimetype=mimetype,
+                                   max_age=IMMUTABLE_MAX_AGE, conditional=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def init_assets(app):
+    """Load the build manifest and register asset_urls() and the /assets/ route"""
+    app.extensions['asset_manifest'] = load_manifest()
+    if not app.extensions['asset_manifest']:
+        app.logger.info('Static assets not built; serving source files (run build_assets.py)')
+    app.add_template_global(asset_urls)
+    app.add_url_rule('/assets/<path:filename>', 'asset', serve_asset)
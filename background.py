@@ -0,0 +1,79 @@
+"""
+Background work queues
+
+BackgroundQueue runs jobs that must not hold up a request (deleting images,
+refreshing recommendations) on a daemon thread per process. The worker
+takes everything queued so far in one go, so a subclass can coalesce a
+burst of jobs, and runs it in an app context. Queued jobs get a chance to
+finish when the process exits.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from contextlib import nullcontext
+
+
+class BackgroundQueue:
+    """Worker thread draining a queue; subclasses implement process(items)"""
+    name = 'background'
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._app = None
+
+    def init_app(self, app, drain_timeout=10):
+        self._app = app
+        # Give queued jobs a chance to finish when the worker exits
+        atexit.register(self.wait, drain_timeout)
+
+    def process(self, items):
+        """Handle a batch of queued items (runs on the worker thread)"""
+        raise NotImplementedError
+
+    def enqueue(self, items):
+        """Queue items for the worker; returns how many were queued"""
+        items = list(items)
+        if items:
+            self._ensure_worker()
+            for item in items:
+                self._queue.put(item)
+        return len(items)
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _take_all(self):
+        """Block for one queued item, then take whatever else is queued"""
+        items = [self._queue.get()]
+        while True:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                return items
+
+    def _run(self):
+        while True:
+            items = self._take_all()
+            try:
+                with self._app.app_context() if self._app else nullcontext():
+                    self.process(items)
+            except Exception as e:
+                logger = self._app.logger if self._app else logging.getLogger(__name__)
+                logger.warning(f"{self.name} failed: {e}")
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+
+    def wait(self, timeout):
+        """Block until queued jobs are done or timeout seconds pass"""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return self._queue.unfinished_tasks == 0
@@ -0,0 +1,109 @@
+"""
+Benchmark: deleting a user who owns many business listings
+
+Compares the previous ORM cascade (every listing loaded and deleted one
+statement at a time, all in one transaction) with remove_account() (set-based
+DELETEs in DELETE_BATCH_SIZE batches, each its own transaction). Reports
+wall time, statements sent and the longest transaction, which is how long
+write locks are held.
+
+Usage: python benchmarks/bench_delete_account.py [listings] [batch_size]
+Set BENCH_DATABASE_URL to run against PostgreSQL instead of SQLite.
+"""
+import os
+import sys
+import tempfile
+import time
+
+_db_file = os.path.join(tempfile.mkdtemp(), 'bench.db')
+os.environ['DATABASE_URL'] = os.getenv('BENCH_DATABASE_URL', f'sqlite:///{_db_file}')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event  # noqa: E402
+
+from main import app, db, User, BusinessListing  # noqa: E402
+from deletion import remove_account  # noqa: E402
+
+
+class StatementStats:
+    """Counts statements and times transactions on an engine"""
+
+    def __init__(self, engine):
+        self.statements = 0
+        self.longest_transaction = 0.0
+        self._began = None
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+        event.listen(engine, 'begin', self._on_begin)
+        event.listen(engine, 'commit', self._on_end)
+        event.listen(engine, 'rollback', self._on_end)
+
+    def reset(self):
+        self.statements = 0
+        self.longest_transaction = 0.0
+
+    def _on_execute(self, *args):
+        self.statements += 1
+
+    def _on_begin(self, connection):
+        self._began = time.perf_counter()
+
+    def _on_end(self, connection):
+        if self._began is not None:
+            self.longest_transaction = max(self.longest_transaction,
+                                           time.perf_counter() - self._began)
+            self._began = None
+
+
+def seed(count):
+    owner = User(name='Bench Owner', email='bench@circleone.local', oauth_provider='local')
+    db.session.add(owner)
+    db.session.flush()
+    db.session.execute(BusinessListing.__table__.insert(), [{
+        'user_id': owner.id,
+        'business_name': f'Listing {i}',
+        'category': 'Food',
+        'description': 'benchmark listing ' * 10,
+        'logo_url': f'https://example.com/logos/{i}.png',
+    } for i in range(count)])
+    db.session.commit()
+    user_id = owner.id
+    db.session.expunge_all()
+    return user_id
+
+
+def orm_cascade_delete(user_id):
+    """The previous behavior: load every child and delete it through the ORM"""
+    user = db.session.get(User, user_id)
+    # Without passive_deletes the cascade loaded both relationships first
+    user.businesses, user.professional_profile
+    db.session.delete(user)
+    db.session.commit()
+
+
+def main():
+    listings = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        stats = StatementStats(db.engine)
+        batch_size = batch_size or app.config['DELETE_BATCH_SIZE']
+
+        print(f'deleting a user with {listings} listings (batch size {batch_size})')
+        print(f'{"path":<16}{"seconds":>10}{"statements":>12}{"longest txn s":>16}')
+        for name, delete in (('orm cascade', orm_cascade_delete),
+                             ('remove_account', lambda user_id: remove_account(user_id, batch_size))):
+            user_id = seed(listings)
+            stats.reset()
+            start = time.perf_counter()
+            delete(user_id)
+            elapsed = time.perf_counter() - start
+            assert BusinessListing.query.filter_by(user_id=user_id).count() == 0
+            print(f'{name:<16}{elapsed:>10.2f}{stats.statements:>12}{stats.longest_transaction:>16.3f}')
+
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Benchmark: typo-tolerant search vs the ILIKE path
+
+Seeds a throwaway database with synthetic business listings, then queries
+them with exact words and with misspelled words (swapped, dropped or
+replaced letters). Reports recall@20 (is the listing the word came from in
+the first 20 results?) and latency for both search paths.
+
+Usage: python benchmarks/bench_fuzzy_search.py [listings] [queries]
+Set BENCH_DATABASE_URL to run against PostgreSQL (pg_trgm) instead of SQLite.
+"""
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+_db_file = os.path.join(tempfile.mkdtemp(), 'bench.db')
+os.environ['DATABASE_URL'] = os.getenv('BENCH_DATABASE_URL', f'sqlite:///{_db_file}')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import app, db, User, BusinessListing  # noqa: E402
+from search_index import fuzzy_search_businesses, rebuild_search_indexes, use_pg_trgm  # noqa: E402
+
+SYLLABLES = ['ka', 'ra', 'chi', 'lo', 'pe', 'tan', 'mar', 'sol', 'vi', 'den', 'qu', 'es',
+             'tra', 'bel', 'on', 'ix', 'mon', 'ger', 'pho', 'lin', 'ard', 'cen', 'tu', 'ry']
+CATEGORIES = ['Food', 'Retail', 'Services', 'Technology', 'Health', 'Education']
+
+
+def make_word(rnd):
+    return ''.join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 4)))
+
+
+def misspell(word, rnd):
+    """Apply one random edit: swap, drop or replace a letter"""
+    i = rnd.randrange(1, len(word) - 1)
+    edit = rnd.choice(('swap', 'drop', 'replace'))
+    if edit == 'swap':
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    if edit == 'drop':
+        return word[:i] + word[i + 1:]
+    return word[:i] + rnd.choice('aeiou') + word[i + 1:]
+
+
+def seed(count, rnd, vocabulary):
+    owner = User(name='Bench Owner', email='bench@circleone.local', oauth_provider='local')
+    db.session.add(owner)
+    db.session.flush()
+    rows = []
+    for _ in range(count):
+        rows.append({
+            'user_id': owner.id,
+            'business_name': ' '.join(rnd.choice(vocabulary) for _ in range(2)).title(),
+            'category': rnd.choice(CATEGORIES),
+            'description': ' '.join(rnd.choice(vocabulary) for _ in range(25)),
+            'location': rnd.choice(vocabulary).title(),
+            'view_count': rnd.randint(0, 500),
+        })
+    db.session.execute(BusinessListing.__table__.insert(), rows)
+    db.session.commit()
+
+
+def ilike_search(search):
+    return BusinessListing.query.filter(
+        (BusinessListing.business_name.ilike(f'%{search}%')) |
+        (BusinessListing.description.ilike(f'%{search}%'))
+    ).order_by(BusinessListing.view_count.desc(), BusinessListing.created_at.desc()).all()
+
+
+def fuzzy_search(search):
+    return fuzzy_search_businesses(BusinessListing.query, search).order_by(
+        BusinessListing.view_count.desc(), BusinessListing.created_at.desc()
+    ).limit(app.config['FUZZY_SEARCH_LIMIT']).all()
+
+
+def run(path, queries):
+    hits = 0
+    timings = []
+    for text, target_id in queries:
+        start = time.perf_counter()
+        results = path(text)
+        timings.append((time.perf_counter() - start) * 1000)
+        if target_id in [row.id for row in results[:20]]:
+            hits += 1
+    timings.sort()
+    return {
+        'recall@20': hits / len(queries),
+        'p50_ms': statistics.median(timings),
+        'p95_ms': timings[int(len(timings) * 0.95) - 1],
+    }
+
+
+def main():
+    listings = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    query_count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    rnd = random.Random(42)
+    vocabulary = sorted({make_word(rnd) for _ in range(5000)})
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(listings, rnd, vocabulary)
+
+        start = time.perf_counter()
+        rebuild_search_indexes()
+        build_s = time.perf_counter() - start
+
+        # Queries are words taken from business names, so each has a known target
+        sample = db.session.query(BusinessListing.id, BusinessListing.business_name).order_by(
+            db.func.random()).limit(query_count).all()
+        exact = [(name.split()[0].lower(), id) for id, name in sample]
+        typos = [(misspell(word, rnd), id) for word, id in exact]
+
+        backend = 'pg_trgm' if use_pg_trgm() else 'in-process trigram index'
+        print(f'{listings} listings, {query_count} queries per set, fuzzy backend: {backend}')
+        print(f'index build: {build_s:.2f}s')
+        print(f'{"path":<8}{"queries":<10}{"recall@20":>10}{"p50 ms":>10}{"p95 ms":>10}')
+        for label, queries in (('exact', exact), ('typo', typos)):
+            for name, path in (('ilike', ilike_search), ('fuzzy', fuzzy_search)):
+                result = run(path, queries)
+                print(f'{name:<8}{label:<10}{result["recall@20"]:>10.2f}'
+                      f'{result["p50_ms"]:>10.2f}{result["p95_ms"]:>10.2f}')
+
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+Benchmark: radius and k-nearest listing search at 1M listings
+
+Listings are scattered around the gazetteer's cities (denser around bigger
+ones). Each query point is searched through nearby_businesses() - the
+geohash index on SQLite, PostGIS/earthdistance on PostgreSQL if installed -
+and through a scan of the table (bounding box on the unindexed
+latitude/longitude columns for radius queries, every point for k-nearest).
+Both return the same listings; latency p50/p95 in milliseconds is reported.
+
+Usage: python benchmarks/bench_geo_search.py [listings] [queries]
+Set BENCH_DATABASE_URL to run against PostgreSQL instead of SQLite.
+"""
+import csv
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+_db_file = os.path.join(tempfile.mkdtemp(), 'bench.db')
+os.environ['DATABASE_URL'] = os.getenv('BENCH_DATABASE_URL', f'sqlite:///{_db_file}')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import app, db, User, BusinessListing  # noqa: E402
+from geo import (KM_PER_DEGREE, create_spatial_index, geohash_encode,  # noqa: E402
+                 haversine_km, nearby_businesses)
+
+SEED_BATCH_SIZE = 20000
+RADII_KM = (5, 10, 25)
+NEAREST_K = 20
+
+
+def load_cities():
+    with open(app.config['GAZETTEER_PATH'], encoding='utf-8') as f:
+        return [(float(row['latitude']), float(row['longitude']), int(row['population']) or 50000)
+                for row in csv.DictReader(f)]
+
+
+def random_point(rng, cities, weights):
+    """A point within a few tens of km of a city picked by population"""
+    latitude, longitude, _ = rng.choices(cities, weights)[0]
+    spread = rng.expovariate(1 / 8) / KM_PER_DEGREE
+    angle = rng.uniform(0, 2 * math.pi)
+    latitude = max(-89.9, min(89.9, latitude + spread * math.sin(angle)))
+    longitude += spread * math.cos(angle) / math.cos(math.radians(latitude))
+    return latitude, (longitude + 180) % 360 - 180
+
+
+def seed(count, cities, weights, rng):
+    owner = User(name='Bench Owner', email='bench@circleone.local', oauth_provider='local')
+    db.session.add(owner)
+    db.session.flush()
+    for start in range(0, count, SEED_BATCH_SIZE):
+        rows = []
+        for i in range(start, min(count, start + SEED_BATCH_SIZE)):
+            latitude, longitude = random_point(rng, cities, weights)
+            rows.append({
+                'user_id': owner.id,
+                'business_name': f'Listing {i}',
+                'category': 'Food',
+                'latitude': latitude,
+                'longitude': longitude,
+                'geohash': geohash_encode(latitude, longitude),
+            })
+        db.session.execute(BusinessListing.__table__.insert(), rows)
+        db.session.commit()
+
+
+def scan_radius(latitude, longitude, radius_km):
+    """Radius search without the spatial index"""
+    dlat = radius_km / KM_PER_DEGREE
+    dlon = radius_km / (KM_PER_DEGREE * math.cos(math.radians(min(89.9, abs(latitude) + dlat))))
+    listings = BusinessListing.query.filter(
+        BusinessListing.latitude.between(latitude - dlat, latitude + dlat),
+        BusinessListing.longitude.between(longitude - dlon, longitude + dlon)).all()
+    return sorted(listing.id for listing in listings
+                  if haversine_km(latitude, longitude, listing.latitude, listing.longitude) <= radius_km)
+
+
+def scan_nearest(latitude, longitude, k):
+    """k-nearest search without the spatial index"""
+    rows = db.session.query(BusinessListing.id, BusinessListing.latitude, BusinessListing.longitude).filter(
+        BusinessListing.latitude.isnot(None)).all()
+    nearest = sorted((haversine_km(latitude, longitude, lat, lon), id) for id, lat, lon in rows)[:k]
+    listings = {listing.id: listing for listing in
+                BusinessListing.query.filter(BusinessListing.id.in_([id for _, id in nearest]))}
+    return [listings[id] for _, id in nearest]
+
+
+def timed(function, points):
+    """Latencies in ms of function over the query points, and its results"""
+    latencies, results = [], []
+    for point in points:
+        start = time.perf_counter()
+        results.append(function(*point))
+        latencies.append((time.perf_counter() - start) * 1000)
+        db.session.expunge_all()
+    return latencies, results
+
+
+def report(name, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f'{name:<28}{statistics.median(latencies):>10.1f}{p95:>10.1f}')
+
+
+def main():
+    listings = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    queries = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    rng = random.Random(42)
+    cities = load_cities()
+    weights = [population ** 0.5 for _, _, population in cities]
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        start = time.perf_counter()
+        seed(listings, cities, weights, rng)
+        backend = create_spatial_index()
+        print(f'seeded {listings} listings in {time.perf_counter() - start:.0f}s; backend: {backend}')
+
+        points = [random_point(rng, cities, weights) for _ in range(queries)]
+        # The table scan for k-nearest reads every row; a few queries are enough
+        scan_points = points[:max(1, queries // 10)]
+
+        print(f'{"query":<28}{"p50 ms":>10}{"p95 ms":>10}')
+        for radius in RADII_KM:
+            latencies, indexed = timed(lambda lat, lon: sorted(
+                listing.id for listing, _ in nearby_businesses(
+                    BusinessListing.query, lat, lon, radius_km=radius, limit=listings)), points)
+            report(f'radius {radius} km (index)', latencies)
+            latencies, scanned = timed(lambda lat, lon: scan_radius(lat, lon, radius), points)
+            report(f'radius {radius} km (scan)', latencies)
+            assert indexed == scanned
+            print(f'{"":<4}avg {statistics.mean(map(len, indexed)):.0f} listings per query')
+
+        latencies, indexed = timed(lambda lat, lon: [
+            listing.id for listing, _ in nearby_businesses(
+                BusinessListing.query, lat, lon, limit=NEAREST_K)], points)
+        report(f'{NEAREST_K} nearest (index)', latencies)
+        latencies, scanned = timed(lambda lat, lon: [
+            listing.id for listing in scan_nearest(lat, lon, NEAREST_K)], scan_points)
+        report(f'{NEAREST_K} nearest (scan)', latencies)
+        assert indexed[:len(scanned)] == scanned
+
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
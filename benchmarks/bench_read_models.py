@@ -0,0 +1,154 @@
+"""
+Benchmark: directory card read models vs full ORM entities
+
+Seeds a throwaway database with synthetic listings and profiles, then loads
+the directory's card rows two ways: the previous path (query.all() of full
+BusinessListing/ProfessionalProfile entities, users eager-loaded) and the
+read-model path (business_cards()/professional_cards() over column
+projections). For each it reports, per 10k cards, the load time, the time
+to load and render every card through its partial (fragment cache bypassed),
+and the peak Python memory while loading (tracemalloc).
+
+Usage: python benchmarks/bench_read_models.py [cards] [repeats]
+Set BENCH_DATABASE_URL to run against PostgreSQL instead of SQLite.
+"""
+import gc
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+_db_file = os.path.join(tempfile.mkdtemp(), 'bench.db')
+os.environ['DATABASE_URL'] = os.getenv('BENCH_DATABASE_URL', f'sqlite:///{_db_file}')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.orm import joinedload  # noqa: E402
+
+from main import app, db, User, BusinessListing, ProfessionalProfile  # noqa: E402
+from fragments import BUSINESS_CARD_TEMPLATE, PROFESSIONAL_CARD_TEMPLATE  # noqa: E402
+from ranking import business_ordering, professional_ordering  # noqa: E402
+from read_models import business_cards, professional_cards  # noqa: E402
+
+SYLLABLES = ['ka', 'ra', 'chi', 'lo', 'pe', 'tan', 'mar', 'sol', 'vi', 'den', 'qu', 'es',
+             'tra', 'bel', 'on', 'ix', 'mon', 'ger', 'pho', 'lin', 'ard', 'cen', 'tu', 'ry']
+CATEGORIES = ['Food', 'Retail', 'Services', 'Technology', 'Health', 'Education']
+SKILLS = ['Python', 'Flask', 'SQL', 'React', 'Design', 'Marketing', 'Sales', 'Go', 'Figma', 'Excel']
+SEED_BATCH_SIZE = 5000
+
+
+def make_words(rnd, count):
+    return ' '.join(''.join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 4)))
+                    for _ in range(count))
+
+
+def seed(count):
+    rnd = random.Random(42)
+    db.drop_all()
+    db.create_all()
+    for start in range(0, count, SEED_BATCH_SIZE):
+        size = min(SEED_BATCH_SIZE, count - start)
+        users = db.session.execute(User.__table__.insert().returning(User.__table__.c.id), [{
+            'name': make_words(rnd, 2).title(),
+            'email': f'bench{start + i}@circleone.local',
+            'oauth_provider': 'local',
+            'profile_photo': f'/avatar/{start + i + 1}.svg',
+        } for i in range(size)]).scalars().all()
+        db.session.execute(BusinessListing.__table__.insert(), [{
+            'user_id': user_id,
+            'business_name': make_words(rnd, 2).title(),
+            'category': rnd.choice(CATEGORIES),
+            'description': make_words(rnd, 120),
+            'location': make_words(rnd, 1).title(),
+            'view_count': rnd.randint(0, 500),
+        } for user_id in users])
+        db.session.execute(ProfessionalProfile.__table__.insert(), [{
+            'user_id': user_id,
+            'job_title': make_words(rnd, 2).title(),
+            'summary': make_words(rnd, 120),
+            'how_i_help': make_words(rnd, 80),
+            'skills_json': rnd.sample(SKILLS, rnd.randint(1, 6)),
+            'consent_given': True,
+            'view_count': rnd.randint(0, 500),
+        } for user_id in users])
+        db.session.commit()
+
+
+def entity_businesses():
+    return BusinessListing.query.order_by(*business_ordering()).all()
+
+
+def card_businesses():
+    return list(business_cards(BusinessListing.query.order_by(*business_ordering())))
+
+
+def entity_professionals():
+    return ProfessionalProfile.query.filter_by(consent_given=True).options(
+        joinedload(ProfessionalProfile.user)).order_by(*professional_ordering()).all()
+
+
+def card_professionals():
+    return list(professional_cards(ProfessionalProfile.query.join(User).filter(
+        ProfessionalProfile.consent_given.is_(True)).order_by(*professional_ordering())))
+
+
+def render_all(template_name, name, rows):
+    template = app.jinja_env.get_template(template_name)
+    return sum(len(template.render(**{name: row, 'distance': None})) for row in rows)
+
+
+def measure(load, template_name, name, repeats):
+    """(load seconds, load+render seconds, peak MB, cards) medians over repeats"""
+    loads, totals = [], []
+    for _ in range(repeats):
+        db.session.expunge_all()
+        gc.collect()
+        start = time.perf_counter()
+        rows = load()
+        loaded = time.perf_counter()
+        render_all(template_name, name, rows)
+        loads.append(loaded - start)
+        totals.append(time.perf_counter() - start)
+        count = len(rows)
+        del rows
+
+    db.session.expunge_all()
+    gc.collect()
+    tracemalloc.start()
+    rows = load()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del rows
+    db.session.expunge_all()
+    return statistics.median(loads), statistics.median(totals), peak / 1e6, count
+
+
+def report(name, load_s, total_s, peak_mb, count):
+    per_10k = 10000 / count
+    print(f'{name:<26}{load_s * per_10k * 1000:>12.0f}{total_s * per_10k * 1000:>16.0f}'
+          f'{peak_mb * per_10k:>12.1f}{count / total_s:>14.0f}')
+
+
+def main():
+    cards = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    # Cards build URLs, which needs a request
+    with app.test_request_context():
+        start = time.perf_counter()
+        seed(cards)
+        print(f'seeded {cards} listings and profiles in {time.perf_counter() - start:.0f}s')
+        print(f'{"per 10k cards":<26}{"load ms":>12}{"load+render ms":>16}{"peak MB":>12}{"cards/s":>14}')
+        for name, load, template_name, variable in (
+                ('businesses: entities', entity_businesses, BUSINESS_CARD_TEMPLATE, 'business'),
+                ('businesses: read models', card_businesses, BUSINESS_CARD_TEMPLATE, 'business'),
+                ('professionals: entities', entity_professionals, PROFESSIONAL_CARD_TEMPLATE, 'profile'),
+                ('professionals: read models', card_professionals, PROFESSIONAL_CARD_TEMPLATE, 'profile')):
+            report(name, *measure(load, template_name, variable, repeats))
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+Benchmark: streamed vs fully rendered directory page
+
+Seeds a throwaway database with synthetic business listings, then requests
+the business directory rendered two ways: the streamed route (stream_page
+over a server-side cursor) and the previous approach (render_template over
+query.all()). Reports time-to-first-byte, total time, response size and the
+worker's peak RSS growth, with and without gzip.
+
+Each variant runs in a fresh interpreter so peak RSS (a high-water mark)
+is not inherited from the previous one.
+
+Usage: python benchmarks/bench_streaming.py [listings] [repeats]
+Set BENCH_DATABASE_URL to run against PostgreSQL instead of SQLite.
+"""
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SYLLABLES = ['ka', 'ra', 'chi', 'lo', 'pe', 'tan', 'mar', 'sol', 'vi', 'den', 'qu', 'es',
+             'tra', 'bel', 'on', 'ix', 'mon', 'ger', 'pho', 'lin', 'ard', 'cen', 'tu', 'ry']
+CATEGORIES = ['Food', 'Retail', 'Services', 'Technology', 'Health', 'Education']
+
+
+def make_words(rnd, count):
+    return ' '.join(''.join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 4)))
+                    for _ in range(count))
+
+
+def seed(count):
+    from main import app, db, User, BusinessListing
+
+    rnd = random.Random(42)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        owner = User(name='Bench Owner', email='bench@circleone.local', oauth_provider='local')
+        db.session.add(owner)
+        db.session.flush()
+        rows = [{
+            'user_id': owner.id,
+            'business_name': make_words(rnd, 2).title(),
+            'category': rnd.choice(CATEGORIES),
+            'description': make_words(rnd, 40),
+            'location': make_words(rnd, 1).title(),
+            'view_count': rnd.randint(0, 500),
+        } for _ in range(count)]
+        db.session.execute(BusinessListing.__table__.insert(), rows)
+        db.session.commit()
+
+
+def peak_rss_kb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(mode, encoding, repeats):
+    """Run one variant in this process and print its results as JSON"""
+    from flask import render_template
+    from main import app, db, BusinessListing
+    from ranking import business_ordering
+
+    @app.route('/bench/buffered')
+    def buffered_directory():
+        # The directory route before streaming: every card rendered in memory
+        listings = BusinessListing.query.order_by(*business_ordering()).all()
+        categories = [c[0] for c in db.session.query(BusinessListing.category).distinct()]
+        return render_template('businesses.html', listings=listings, total=len(listings),
+                               categories=categories, search='', fuzzy=False,
+                               selected_category='', selected_location='')
+
+    url = '/businesses' if mode == 'streamed' else '/bench/buffered'
+    headers = {'Accept-Encoding': encoding, 'User-Agent': 'Mozilla/5.0 (bench)'}
+    client = app.test_client()
+
+    # Warm up templates, the engine and the in-memory indexes on an empty page
+    client.get('/businesses?search=zzzzzzzzzz&fuzzy=1', headers=headers).close()
+
+    baseline = peak_rss_kb()
+    ttfb, total, size = [], [], 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        response = client.get(url, headers=headers, buffered=False)
+        chunks = iter(response.response)
+        first = next(chunks)
+        ttfb.append((time.perf_counter() - start) * 1000)
+        size = len(first) + sum(len(chunk) for chunk in chunks)
+        total.append((time.perf_counter() - start) * 1000)
+        response.close()
+
+    print(json.dumps({
+        'ttfb_ms': statistics.median(ttfb),
+        'total_ms': statistics.median(total),
+        'bytes': size,
+        'rss_growth_mb': (peak_rss_kb() - baseline) / 1024,
+    }))
+
+
+def main():
+    listings = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    db_file = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    env = dict(os.environ, DATABASE_URL=os.getenv('BENCH_DATABASE_URL', f'sqlite:///{db_file}'))
+
+    os.environ.update(env)
+    seed(listings)
+
+    print(f'{listings} listings, median of {repeats} requests')
+    print(f'{"render":<10}{"encoding":<10}{"TTFB ms":>10}{"total ms":>10}'
+          f'{"KB":>10}{"RSS +MB":>10}')
+    for mode in ('buffered', 'streamed'):
+        for encoding in ('identity', 'gzip'):
+            output = subprocess.run(
+                [sys.executable, __file__, '--measure', mode, encoding, str(repeats)],
+                env=env, cwd=ROOT, capture_output=True, text=True, check=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f'{mode:<10}{encoding:<10}{result["ttfb_ms"]:>10.1f}{result["total_ms"]:>10.1f}'
+                  f'{result["bytes"] / 1024:>10.0f}{result["rss_growth_mb"]:>10.1f}')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--measure':
+        measure(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+    else:
+        main()
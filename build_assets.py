@@ -0,0 +1,292 @@
+"""
+Build fingerprinted, minified and precompressed static assets
+
+Bundles the sources listed in assets.BUNDLES, minifies them, names each
+output after a hash of its content (static/dist/js/app.3f9c2a1b.js) and
+writes .gz and .br variants next to it. static/dist/manifest.json maps
+bundle names to the hashed files; the app picks it up at start-up.
+
+Usage: python build_assets.py
+Brotli variants are only written when the optional `brotli` package is installed.
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+
+from assets import BUNDLES, DIST_DIR, MANIFEST_NAME, STATIC_DIR
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Characters that can continue an identifier, number or keyword
+WORD_CHARS = re.compile(r'[\w$]')
+
+# After these a `/` starts a regex literal rather than a division
+REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^')
+REGEX_KEYWORDS = {'return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'new',
+                  'delete', 'void', 'throw', 'yield', 'await'}
+
+
+def minify_css(source):
+    """Strip comments and insignificant whitespace from a stylesheet"""
+    # Strings are kept as they are; everything between them is compacted
+    parts = re.split(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')', source)
+    out = []
+    for index, part in enumerate(parts):
+        if index % 2:
+            out.append(part)
+            continue
+        part = re.sub(r'/\*.*?\*/', '', part, flags=re.S)
+        part = re.sub(r'\s+', ' ', part)
+        part = re.sub(r'\s*([{};,>])\s*', r'\1', part)
+        part = part.replace(';}', '}')
+        out.append(part)
+    return _compact_declarations(''.join(out).strip())
+
+
+def _compact_declarations(css):
+    """
+    Drop the space after `:` in declarations (`color: red`)
+    Selectors keep theirs: `div :hover` and `div:hover` match different elements.
+    A declaration is a run ending in `;` or `}`; a selector or at-rule prelude ends in `{`.
+    """
+    out = []
+    pieces = []  # (text, is_string) of the current run
+    start = i = 0
+    while i < len(css):
+        char = css[i]
+        if char in '"\'':
+            end = _skip_string(css, i)
+            pieces += [(css[start:i], False), (css[i:end], True)]
+            start = i = end
+            continue
+        if char in '{};':
+            pieces.append((css[start:i], False))
+            declaration = char != '{'
+            out.extend(re.sub(r': ', ':', text) if declaration and not is_string else text
+                       for text, is_string in pieces)
+            out.append(char)
+            pieces = []
+            start = i + 1
+        i += 1
+    out.extend(text for text, _ in pieces)
+    out.append(css[start:])
+    return ''.join(out)
+
+
+def _skip_string(source, i):
+    """Index just past the quoted string starting at i"""
+    quote = source[i]
+    i += 1
+    while i < len(source) and source[i] != quote:
+        i += 2 if source[i] == '\\' else 1
+    return i + 1
+
+
+def _skip_template(source, i):
+    """Index just past the template literal starting at i, including ${...} parts"""
+    i += 1
+    while i < len(source):
+        char = source[i]
+        if char == '\\':
+            i += 2
+        elif char == '`':
+            return i + 1
+        elif source.startswith('${', i):
+            i = _skip_expression(source, i + 2)
+        else:
+            i += 1
+    return i
+
+
+def _skip_expression(source, i):
+    """Index just past the `}` closing a template expression"""
+    depth = 1
+    while i < len(source):
+        char = source[i]
+        if char in '\'"':
+            i = _skip_string(source, i)
+            continue
+        if char == '`':
+            i = _skip_template(source, i)
+            continue
+        if char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return i
+
+
+def _skip_regex(source, i):
+    """Index just past the regex literal (and flags) starting at i"""
+    i += 1
+    in_class = False
+    while i < len(source):
+        char = source[i]
+        if char == '\\':
+            i += 2
+            continue
+        if char == '[':
+            in_class = True
+        elif char == ']':
+            in_class = False
+        elif char == '/' and not in_class:
+            break
+        i += 1
+    i += 1
+    while i < len(source) and WORD_CHARS.match(source[i]):
+        i += 1
+    return i
+
+
+def _needs_space(before, after):
+    """Whether two tokens would merge into one without a space between them"""
+    if WORD_CHARS.match(before) and WORD_CHARS.match(after):
+        return True
+    # `a + +b`, `a - -b` and `a / /re/` must not become `++`, `--` or a comment
+    return (before in '+-' and after in '+-') or (before == '/' and after in '/*')
+
+
+def minify_js(source):
+    """
+    Strip comments, indentation and blank lines from a script
+    Conservative by design: line breaks are kept so automatic semicolon
+    insertion behaves exactly as in the source, and strings, template
+    literals and regex literals are copied untouched. Names are not mangled.
+    """
+    out = []
+    last_char = ''
+    last_word = ''
+    pending = ''  # '', ' ' or '\n': whitespace seen since the last token
+    i = 0
+    n = len(source)
+
+    while i < n:
+        char = source[i]
+        if char in ' \t\r\f\v':
+            pending = pending or ' '
+            i += 1
+            continue
+        if char == '\n':
+            pending = '\n'
+            i += 1
+            continue
+        if source.startswith('//', i):
+            end = source.find('\n', i)
+            i = n if end == -1 else end
+            continue
+        if source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            end = n if end == -1 else end + 2
+            pending = '\n' if '\n' in source[i:end] else (pending or ' ')
+            i = end
+            continue
+
+        if char in '\'"':
+            end = _skip_string(source, i)
+        elif char == '`':
+            end = _skip_template(source, i)
+        elif char == '/' and (last_char in REGEX_PRECEDERS or last_char == ''
+                              or last_word in REGEX_KEYWORDS):
+            end = _skip_regex(source, i)
+        elif WORD_CHARS.match(char):
+            end = i + 1
+            while end < n and WORD_CHARS.match(source[end]):
+                end += 1
+        else:
+            end = i + 1
+        token = source[i:end]
+
+        if out and pending == '\n':
+            out.append('\n')
+        elif out and pending and _needs_space(last_char, token[0]):
+            out.append(' ')
+        pending = ''
+
+        out.append(token)
+        last_char = token[-1]
+        last_word = token if WORD_CHARS.match(token[0]) else ''
+        i = end
+
+    return ''.join(out) + '\n'
+
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+
+def bundle(sources):
+    """Concatenate source files under static/, in order"""
+    contents = []
+    for source in sources:
+        with open(os.path.join(STATIC_DIR, source), encoding='utf-8') as f:
+            contents.append(f.read())
+    # A leading `;` guards against a file that ends without one
+    separator = '\n;\n' if sources[0].endswith('.js') else '\n'
+    return separator.join(contents)
+
+
+def fingerprinted_name(name, content):
+    """js/app.js -> js/app.<hash>.js"""
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    base, extension = os.path.splitext(name)
+    return f'{base}.{digest}{extension}'
+
+
+def write_variants(path, content):
+    """Write the asset and its precompressed variants"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+    # mtime=0 keeps the gzip output byte-identical across builds
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(content, compresslevel=9, mtime=0))
+    if brotli is not None:
+        with open(path + '.br', 'wb') as f:
+            f.write(brotli.compress(content, quality=11))
+
+
+def remove_stale(keep):
+    """Delete outputs of earlier builds that are no longer in the manifest"""
+    for root, _, files in os.walk(DIST_DIR):
+        for filename in files:
+            path = os.path.join(root, filename)
+            relative = os.path.relpath(path, DIST_DIR).replace(os.sep, '/')
+            if relative == MANIFEST_NAME:
+                continue
+            if re.sub(r'\.(gz|br)$', '', relative) not in keep:
+                os.remove(path)
+
+
+def build():
+    """
+    Build every bundle and write the manifest
+    Returns: the manifest (bundle name -> hashed file under static/dist)
+    """
+    manifest = {}
+    for name, sources in BUNDLES.items():
+        minify = MINIFIERS[os.path.splitext(name)[1]]
+        content = minify(bundle(sources)).encode('utf-8')
+        hashed = fingerprinted_name(name, content)
+        write_variants(os.path.join(DIST_DIR, hashed), content)
+        manifest[name] = hashed
+
+        original = sum(os.path.getsize(os.path.join(STATIC_DIR, s)) for s in sources)
+        print(f'{name:<14} {original:>8} -> {len(content):>8} bytes  {hashed}')
+
+    remove_stale(set(manifest.values()))
+    with open(os.path.join(DIST_DIR, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    if brotli is None:
+        print('brotli not installed: only gzip variants written')
+    return manifest
+
+
+if __name__ == '__main__':
+    build()
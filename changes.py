@@ -0,0 +1,63 @@
+"""
+Change-aware writes for listing and profile edits
+
+Edit forms assign through apply_changes(), which only touches the attributes
+whose submitted value differs from the loaded one and reports those fields.
+A submit that changes nothing is never flushed or committed, so nothing
+downstream (fragment cache, search indexes, recommendations) hears of it.
+
+Listings and profiles carry a version column (version_id_col): every ORM
+UPDATE runs as UPDATE ... WHERE id = ? AND version = ? and bumps it, so of
+two concurrent edits the second matches no row and raises StaleDataError
+instead of overwriting the first. Edit forms also submit the version they
+were rendered from; is_stale() rejects them before any work is done when the
+row has moved on since. Counters and batch jobs write with Core UPDATEs and
+leave the version alone, so a view or a rank recompute never conflicts.
+
+After a commit, publish_changes() sends record_changed with the changed
+fields so consumers can update incrementally:
+
+    @record_changed.connect
+    def on_change(kind, id, changes):
+        ...  # changes: {field: (old value, new value)}
+
+Receivers run in the request after the commit and may use the session.
+"""
+from flask.signals import Namespace
+
+_signals = Namespace()
+
+# Sent with sender=kind ('business' or 'professional'), id= and changes=
+record_changed = _signals.signal('record-changed')
+
+
+def _same(old, new):
+    # Forms submit '' for empty fields that were stored as NULL
+    if old in (None, '') and new in (None, ''):
+        return True
+    return old == new
+
+
+def apply_changes(obj, values):
+    """
+    Assign the values that differ from what obj holds
+    Returns: {field: (old value, new value)} of the fields that changed
+    """
+    changes = {}
+    for field, value in values.items():
+        old = getattr(obj, field)
+        if not _same(old, value):
+            setattr(obj, field, value)
+            changes[field] = (old, value)
+    return changes
+
+
+def is_stale(obj, submitted_version):
+    """Check whether a form was rendered from an older version of the row"""
+    return submitted_version is not None and submitted_version != obj.version
+
+
+def publish_changes(kind, id, changes):
+    """Tell record_changed receivers which fields of a committed row changed"""
+    if changes:
+        record_changed.send(kind, id=id, changes=changes)
@@ -1,6 +1,8 @@
 import os
 from dotenv import load_dotenv
 
+from db_routing import replica_binds
+
 load_dotenv()
 
 class Config:
@@ -13,6 +15,9 @@ class Config:
         database_url = database_url.replace('postgres://', 'postgresql://', 1)
     SQLALCHEMY_DATABASE_URI = database_url
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Read replicas: comma-separated URLs; GET reads are spread across them (see db_routing.py)
+    SQLALCHEMY_BINDS = replica_binds(os.getenv('DATABASE_REPLICA_URLS'))
+    READ_YOUR_WRITES_WINDOW = int(os.getenv('READ_YOUR_WRITES_WINDOW', 5))  # Seconds on the primary after a write
     
     # OAuth Configuration
     GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID')
@@ -31,6 +36,71 @@ class Config:
     CLOUDINARY_CLOUD_NAME = os.getenv('CLOUDINARY_CLOUD_NAME')
     CLOUDINARY_API_KEY = os.getenv('CLOUDINARY_API_KEY')
     CLOUDINARY_API_SECRET = os.getenv('CLOUDINARY_API_SECRET')
+    CLOUDINARY_UPLOAD_PREFIX = os.getenv('CLOUDINARY_UPLOAD_PREFIX')  # API base URL override, e.g. the local stub
+    
+    # Image uploads: per-call deadline, circuit breaker and database fallback (see storage.py)
+    UPLOAD_DEADLINE = float(os.getenv('UPLOAD_DEADLINE', 10))  # Seconds for a whole Cloudinary upload
+    UPLOAD_BREAKER_THRESHOLD = int(os.getenv('UPLOAD_BREAKER_THRESHOLD', 5))  # Consecutive failures to open
+    UPLOAD_BREAKER_RESET = float(os.getenv('UPLOAD_BREAKER_RESET', 30))  # Seconds open before a trial upload
+    
+    # Outbound HTTP (Cloudinary, Google OAuth) connection pooling
+    HTTP_POOL_CONNECTIONS = int(os.getenv('HTTP_POOL_CONNECTIONS', 10))  # Hosts kept in the pool
+    HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', 10))  # Keep-alive connections per host
+    HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 3.05))
+    HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 30))
+    HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', 2))  # Idempotent requests only
+    HTTP_RETRY_BACKOFF = float(os.getenv('HTTP_RETRY_BACKOFF', 0.3))
+    OAUTH_DOCUMENT_TTL = int(os.getenv('OAUTH_DOCUMENT_TTL', 3600))  # Seconds to keep JWKS/metadata sent without max-age
+    
+    # In-memory search indexes (rebuilt after this many seconds to pick up other workers' writes)
+    SEARCH_INDEX_MAX_AGE = int(os.getenv('SEARCH_INDEX_MAX_AGE', 300))
+    
+    # Typo-tolerant search (pg_trgm on PostgreSQL, in-process trigram index otherwise)
+    FUZZY_SEARCH_THRESHOLD = float(os.getenv('FUZZY_SEARCH_THRESHOLD', 0.4))  # Minimum word similarity
+    FUZZY_SEARCH_LIMIT = int(os.getenv('FUZZY_SEARCH_LIMIT', 200))  # Max ranked results
+    
+    # Directory ordering: 'views' (view_count, created_at) or 'rank_score' (see ranking.py)
+    DIRECTORY_RANKING = os.getenv('DIRECTORY_RANKING', 'views')
+    RANK_HALF_LIFE_DAYS = float(os.getenv('RANK_HALF_LIFE_DAYS', 7))  # Recency worth doubling the views
+    
+    # View analytics: batched hourly buckets, rolled up to daily by `flask rollup-views`
+    VIEW_FLUSH_INTERVAL = int(os.getenv('VIEW_FLUSH_INTERVAL', 30))  # Seconds between batch writes
+    VIEW_FLUSH_MAX_PENDING = int(os.getenv('VIEW_FLUSH_MAX_PENDING', 500))  # Buckets held before forcing a write
+    VIEW_HOURLY_RETENTION_HOURS = int(os.getenv('VIEW_HOURLY_RETENTION_HOURS', 48))
+    VIEW_DAILY_RETENTION_DAYS = int(os.getenv('VIEW_DAILY_RETENTION_DAYS', 400))
+    # A visitor's repeat views of a listing within this window count once
+    VIEW_DEDUP_WINDOW = int(os.getenv('VIEW_DEDUP_WINDOW', 1800))  # Seconds
+    VIEW_DEDUP_CAPACITY = int(os.getenv('VIEW_DEDUP_CAPACITY', 1000000))  # (visitor, listing) pairs per window
+    VIEW_DEDUP_ERROR_RATE = float(os.getenv('VIEW_DEDUP_ERROR_RATE', 0.001))  # Bloom filter false positives
+    
+    # Streamed directory pages and on-the-fly compression
+    STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', 200))  # Rows per cursor fetch
+    STREAM_BUFFER_SIZE = int(os.getenv('STREAM_BUFFER_SIZE', 8192))  # Characters per streamed chunk
+    COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 500))  # Smaller bodies are sent as-is
+    COMPRESS_GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', 6))
+    COMPRESS_BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', 4))  # 11 is too slow per request
+    
+    # Browser cache lifetime for /avatar/<id>.svg (revalidated by ETag afterwards)
+    AVATAR_MAX_AGE = int(os.getenv('AVATAR_MAX_AGE', 7 * 24 * 3600))
+    
+    # Listings deleted per transaction when removing an account
+    DELETE_BATCH_SIZE = int(os.getenv('DELETE_BATCH_SIZE', 500))
+    
+    # Geocoding and "near me" search
+    GAZETTEER_PATH = os.getenv('GAZETTEER_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'gazetteer.csv'))  # CSV or GeoNames .txt dump
+    GAZETTEER_DEFAULT_COUNTRY = os.getenv('GAZETTEER_DEFAULT_COUNTRY', 'PK')  # Preferred for ambiguous place names
+    GEO_RESULT_LIMIT = int(os.getenv('GEO_RESULT_LIMIT', 200))  # Max listings for a radius search
+    GEO_NEAREST_LIMIT = int(os.getenv('GEO_NEAREST_LIMIT', 20))  # Listings shown for "near me" without a radius
+    GEO_MAX_RADIUS_KM = float(os.getenv('GEO_MAX_RADIUS_KM', 500))  # Larger (or invalid) radii are ignored
+    
+    # Template caches (see fragments.py)
+    TEMPLATE_BYTECODE_DIR = os.getenv('TEMPLATE_BYTECODE_DIR')  # Shared by workers; defaults to instance/jinja-bytecode
+    FRAGMENT_CACHE_SIZE = int(os.getenv('FRAGMENT_CACHE_SIZE', 5000))  # Rendered directory cards kept per worker
+    
+    # "Similar professionals" / "related businesses" (see recommendations.py)
+    RECOMMENDATION_COUNT = int(os.getenv('RECOMMENDATION_COUNT', 6))  # Neighbors stored per listing/profile
+    RECOMMENDATION_BATCH_SIZE = int(os.getenv('RECOMMENDATION_BATCH_SIZE', 1000))  # Rows per similarity block
+    RECOMMENDATION_CANDIDATES_PER_FEATURE = int(os.getenv('RECOMMENDATION_CANDIDATES_PER_FEATURE', 500))  # Rows scored per shared feature after an edit
     
     # File Upload Configuration
     MAX_CONTENT_LENGTH = 5 * 1024 * 1024  # 5MB max file size
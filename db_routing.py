@@ -0,0 +1,150 @@
+"""
+Read-replica routing for the database session
+
+RoutingSession sends plain SELECTs issued while handling a GET/HEAD request
+to a read replica (SQLALCHEMY_BINDS keys starting with REPLICA_BIND_PREFIX,
+configured through DATABASE_REPLICA_URLS) and everything else to the
+primary: flushes, INSERT/UPDATE/DELETE, SELECT ... FOR UPDATE, raw SQL,
+requests with side effects and work outside a request (CLI jobs, migrations).
+
+Read-your-writes: when a request flushes ORM changes, the visitor's reads
+stick to the primary for READ_YOUR_WRITES_WINDOW seconds (tracked in their
+session cookie), which covers the redirect after a create/edit form. Writes
+that bypass the flush (set-based Core DELETE/UPDATE) call
+mark_primary_write() to get the same treatment.
+
+The window only covers lag shorter than it, so views that read a row to
+decide how to write it are decorated with @primary_reads: the edit forms
+(the version they render is checked on submit) and the login callbacks
+(which create the user unless they find one).
+
+Counters (view increments) are single UPDATE statements, so they always
+run on the primary and never start the stickiness window.
+
+To try it locally, point DATABASE_REPLICA_URLS at a second SQLite file and
+run `flask --app main simulate-replica --lag 5`, which copies the primary
+into the replicas every few seconds (replication lag). For PostgreSQL use a
+streaming standby; recovery_min_apply_delay simulates lag there.
+"""
+import random
+import sqlite3
+import time
+from functools import wraps
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql import Select
+
+REPLICA_BIND_PREFIX = 'replica_'
+
+# Requests that only read; anything else is served from the primary throughout
+SAFE_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+
+def replica_binds(urls):
+    """SQLALCHEMY_BINDS entries for a comma-separated list of replica URLs"""
+    binds = {}
+    for index, url in enumerate(u.strip() for u in (urls or '').split(',') if u.strip()):
+        if url.startswith('postgres://'):
+            url = url.replace('postgres://', 'postgresql://', 1)
+        binds[f'{REPLICA_BIND_PREFIX}{index}'] = url
+    return binds
+
+
+def _is_plain_read(clause):
+    """SELECT statements that are safe to answer from a lagging copy"""
+    return isinstance(clause, Select) and clause._for_update_arg is None
+
+
+def _reads_from_primary():
+    """Whether the current request must read from the primary"""
+    if not has_request_context():
+        return True
+    if 'use_primary' not in g:
+        g.use_primary = (request.method not in SAFE_METHODS or
+                         session.get('read_primary_until', 0) > time.time())
+    return g.use_primary
+
+
+def mark_primary_write():
+    """Make this request, and the visitor's next ones, read from the primary after a write"""
+    if has_request_context():
+        g.wrote_primary = g.use_primary = True
+
+
+def primary_reads(view):
+    """Serve every read of a view from the primary (read-before-write views)"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.use_primary = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that reads from replicas when it is safe to"""
+
+    def __init__(self, db, **kwargs):
+        super().__init__(db, **kwargs)
+        self._replica = None
+
+    def _pick_replica(self):
+        """One replica per session, so a request sees a single snapshot"""
+        if self._replica is None:
+            replicas = [engine for key, engine in self._db.engines.items()
+                        if key and key.startswith(REPLICA_BIND_PREFIX)]
+            self._replica = random.choice(replicas) if replicas else False
+        return self._replica
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        # Only the default database is replicated
+        if bind is not None or engine is not self._db.engines.get(None):
+            return engine
+
+        if self._flushing:
+            # Later reads in this request must see the write too
+            mark_primary_write()
+            return engine
+        if not _is_plain_read(clause) or _reads_from_primary():
+            return engine
+        return self._pick_replica() or engine
+
+
+def stick_to_primary(response):
+    """after_request hook: start the read-your-writes window after a write"""
+    if g.get('wrote_primary'):
+        session['read_primary_until'] = time.time() + current_app.config['READ_YOUR_WRITES_WINDOW']
+    return response
+
+
+def init_read_replicas(app):
+    """Register the read-your-writes hook (replicas come from SQLALCHEMY_BINDS)"""
+    app.after_request(stick_to_primary)
+
+
+def copy_sqlite(source_path, target_path):
+    """Consistent snapshot of one SQLite database into another"""
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        with target:
+            source.backup(target)
+    finally:
+        source.close()
+        target.close()
+
+
+def simulate_replication(primary_path, replica_paths, lag, rounds=None):
+    """
+    Copy a SQLite primary into replica files every `lag` seconds
+    Replicas therefore trail the primary by up to `lag` seconds.
+    Runs forever unless `rounds` is given.
+    """
+    done = 0
+    while rounds is None or done < rounds:
+        for replica_path in replica_paths:
+            copy_sqlite(primary_path, replica_path)
+        done += 1
+        if rounds is None or done < rounds:
+            time.sleep(lag)
@@ -0,0 +1,135 @@
+"""
+Deleting listings, profiles and whole accounts without loading them
+
+Rows are removed with set-based DELETEs by id instead of loading each ORM
+object, and account removal works through the user's listings in batches of
+DELETE_BATCH_SIZE, each in its own short transaction, so no lock is held for
+the whole removal. ON DELETE CASCADE on the foreign keys covers anything
+that slips in between (e.g. a listing created mid-removal).
+
+Uploaded logos of deleted listings are queued for a background thread that
+deletes them from Cloudinary after the transaction has committed. Only
+images this app uploaded (our cloud, our upload folder) that no remaining
+listing uses are cleaned up: a logo URL can be pasted into any listing; logos
+still pending (see storage.py) are deleted with the listing.
+"""
+from flask import current_app
+from sqlalchemy import select
+
+from analytics import delete_view_history
+from background import BackgroundQueue
+from db_routing import mark_primary_write
+from models import db, User, BusinessListing, ProfessionalProfile
+from recommendations import BUSINESS, PROFESSIONAL, forget_neighbors
+from search_index import forget_documents
+from storage import image_storage
+from utils import delete_image_from_cloudinary, extract_public_id_from_url, is_own_upload
+
+
+class ImageCleanupQueue(BackgroundQueue):
+    """Background worker deleting uploaded images that are no longer referenced"""
+    name = 'image-cleanup'
+
+    def put(self, urls):
+        """Queue the images this app uploaded to Cloudinary behind these URLs (others are ignored)"""
+        return self.enqueue(extract_public_id_from_url(url) for url in urls if is_own_upload(url))
+
+    def process(self, public_ids):
+        for public_id in public_ids:
+            success, message = delete_image_from_cloudinary(public_id)
+            if not success:
+                current_app.logger.warning(f"Failed to delete image {public_id}: {message}")
+
+
+image_cleanup = ImageCleanupQueue()
+
+
+def _delete_listings(rows):
+    """Delete (id, logo_url) listings in the current transaction; returns logo URLs to clean up"""
+    ids = [id for id, _ in rows]
+    table = BusinessListing.__table__
+    db.session.execute(table.delete().where(table.c.id.in_(ids)))
+    # No flush happens, so tell the router the visitor's reads must see this
+    mark_primary_write()
+    delete_view_history('business', ids)
+    forget_documents(db.session, 'business', ids)
+    forget_neighbors(BUSINESS, ids)
+    return _unused_logos(logo_url for _, logo_url in rows if logo_url)
+
+
+def _unused_logos(urls):
+    """The logo URLs no remaining listing uses, with their pending uploads deleted"""
+    urls = set(urls)
+    if not urls:
+        return []
+    table = BusinessListing.__table__
+    in_use = set(db.session.execute(
+        select(table.c.logo_url).where(table.c.logo_url.in_(list(urls)))).scalars())
+    unused = sorted(urls - in_use)
+    image_storage.pending.discard(unused)
+    return unused
+
+
+def _delete_profiles(ids):
+    table = ProfessionalProfile.__table__
+    db.session.execute(table.delete().where(table.c.id.in_(ids)))
+    mark_primary_write()
+    delete_view_history('professional', ids)
+    forget_documents(db.session, 'professional', ids)
+    forget_neighbors(PROFESSIONAL, ids)
+
+
+def delete_business_listings(ids):
+    """
+    Delete listings by id without loading them
+    Returns: number of listings deleted
+    """
+    table = BusinessListing.__table__
+    rows = db.session.execute(
+        select(table.c.id, table.c.logo_url).where(table.c.id.in_(list(ids)))).all()
+    if not rows:
+        return 0
+    logos = _delete_listings(rows)
+    db.session.commit()
+    image_cleanup.put(logos)
+    return len(rows)
+
+
+def delete_professional_profiles(ids):
+    """Delete professional profiles by id without loading them"""
+    ids = list(ids)
+    if ids:
+        _delete_profiles(ids)
+        db.session.commit()
+    return len(ids)
+
+
+def remove_account(user_id, batch_size=None):
+    """
+    Delete a user and everything they own in bounded batches
+    Returns: (listings deleted, profiles deleted)
+    """
+    batch_size = batch_size or current_app.config['DELETE_BATCH_SIZE']
+    table = BusinessListing.__table__
+
+    listings = 0
+    while True:
+        # Always the first batch left: earlier batches are already gone
+        rows = db.session.execute(
+            select(table.c.id, table.c.logo_url).where(table.c.user_id == user_id)
+            .order_by(table.c.id).limit(batch_size)).all()
+        if not rows:
+            break
+        logos = _delete_listings(rows)
+        db.session.commit()
+        image_cleanup.put(logos)
+        listings += len(rows)
+
+    profile_ids = db.session.execute(
+        select(ProfessionalProfile.id).where(ProfessionalProfile.user_id == user_id)).scalars().all()
+    if profile_ids:
+        _delete_profiles(profile_ids)
+    db.session.execute(User.__table__.delete().where(User.__table__.c.id == user_id))
+    mark_primary_write()
+    db.session.commit()
+    return listings, len(profile_ids)
@@ -0,0 +1,105 @@
+"""
+Template bytecode cache and per-card fragment cache
+
+init_template_caches() points Jinja at a FileSystemBytecodeCache shared by
+every gunicorn worker on the host: the first process to load a template
+writes its compiled bytecode, the others (and later restarts) load it
+instead of compiling. Entries are keyed by template source, so a deploy
+with edited templates recompiles them.
+
+Directory pages render their cards through business_card() and
+professional_card(). A card's markup depends only on its row (and, for
+professionals, the owning user's name and photo), so it is rendered once
+per (id, updated_at) and reused from a bounded in-process LRU until the
+row changes. A page then mostly joins pre-rendered fragments.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+
+BUSINESS_CARD_TEMPLATE = 'partials/business_card.html'
+PROFESSIONAL_CARD_TEMPLATE = 'partials/professional_card.html'
+
+
+class FragmentCache:
+    """Thread-safe LRU of rendered HTML fragments, bounded by entry count"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._fragments = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            fragment = self._fragments.get(key)
+            if fragment is None:
+                self.misses += 1
+                return None
+            self._fragments.move_to_end(key)
+            self.hits += 1
+            return fragment
+
+    def put(self, key, fragment):
+        with self._lock:
+            self._fragments[key] = fragment
+            self._fragments.move_to_end(key)
+            while len(self._fragments) > self.max_entries:
+                self._fragments.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._fragments.clear()
+
+    def __len__(self):
+        return len(self._fragments)
+
+
+def render_fragment(template_name, key, **context):
+    """
+    Rendered template for a cache key, rendering it on a miss
+    The key must change whenever anything the fragment shows changes.
+    """
+    cache = current_app.extensions['fragment_cache']
+    key = (template_name,) + key
+    fragment = cache.get(key)
+    if fragment is None:
+        # Cards only use their row and url_for, not the request context
+        fragment = Markup(current_app.jinja_env.get_template(template_name).render(**context))
+        cache.put(key, fragment)
+    return fragment
+
+
+def business_card(business, distance=None):
+    """Card for the business directory; distance (km) is shown for "near me" results"""
+    distance = None if distance is None else f'{distance:.1f}'
+    return render_fragment(BUSINESS_CARD_TEMPLATE, (business.id, business.updated_at, distance),
+                           business=business, distance=distance)
+
+
+def professional_card(profile):
+    """Card for the professional directory"""
+    user = profile.user
+    return render_fragment(PROFESSIONAL_CARD_TEMPLATE,
+                           (profile.id, profile.updated_at, user.id, user.updated_at),
+                           profile=profile)
+
+
+def init_template_caches(app):
+    """Share compiled templates across workers and register the card helpers"""
+    directory = app.config['TEMPLATE_BYTECODE_DIR'] or os.path.join(app.instance_path, 'jinja-bytecode')
+    os.makedirs(directory, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+    app.extensions['fragment_cache'] = FragmentCache(app.config['FRAGMENT_CACHE_SIZE'])
+    app.add_template_global(business_card)
+    app.add_template_global(professional_card)
+
+    # Load every template at boot: compiled by the first worker, read back by the rest
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(name)
@@ -0,0 +1,444 @@
+"""
+Geocoding and "near me" search for business listings
+
+Listings get latitude/longitude from an offline gazetteer when their free-text
+location is saved (data/gazetteer.csv by default, or a GeoNames dump such as
+cities15000.txt via GAZETTEER_PATH), plus a geohash of the point.
+
+Radius and k-nearest queries are answered from an index, never a table scan:
+
+- PostGIS (if installed): GiST index on the geography of the point
+- earthdistance (if installed): GiST index on ll_to_earth(latitude, longitude)
+- anything else (SQLite): the B-tree index on geohash. A search circle is
+  covered by a few geohash cells, each of which is a key range in the index;
+  the rows in those ranges are then filtered by exact distance.
+
+The PostgreSQL indexes are created by migrate_db.py when the extension is
+available.
+"""
+import csv
+import math
+import threading
+import unicodedata
+
+from flask import current_app
+from sqlalchemy import and_, event, func, inspect, or_, text
+
+from models import db, BusinessListing
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Precision stored on each listing: cells of roughly 5 x 5 m
+GEOHASH_PRECISION = 9
+
+# Most geohash ranges a radius query is split into
+MAX_COVER_CELLS = 32
+
+EARTH_RADIUS_KM = 6371.0088
+# Length of a degree of latitude on the same sphere haversine_km uses
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+BACKFILL_BATCH_SIZE = 1000
+
+# Country names accepted as a qualifier in a location ("Hyderabad, Pakistan")
+COUNTRY_NAMES = {
+    'pakistan': 'PK', 'india': 'IN', 'united kingdom': 'GB', 'uk': 'GB', 'england': 'GB',
+    'scotland': 'GB', 'ireland': 'IE', 'united states': 'US', 'usa': 'US', 'us': 'US',
+    'canada': 'CA', 'uae': 'AE', 'united arab emirates': 'AE', 'saudi arabia': 'SA',
+    'qatar': 'QA', 'kuwait': 'KW', 'oman': 'OM', 'bahrain': 'BH', 'turkey': 'TR',
+    'germany': 'DE', 'france': 'FR', 'spain': 'ES', 'italy': 'IT', 'netherlands': 'NL',
+    'china': 'CN', 'japan': 'JP', 'australia': 'AU', 'bangladesh': 'BD', 'afghanistan': 'AF',
+    'iran': 'IR', 'egypt': 'EG', 'malaysia': 'MY', 'singapore': 'SG',
+}
+
+
+# Geohash math
+
+def geohash_encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Geohash of a point: interleaved longitude/latitude bisection bits in base32"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        interval, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = 0
+            value = 0
+    return ''.join(chars)
+
+
+def geohash_cell_size(precision):
+    """(height, width) of a geohash cell in degrees"""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _cells_in_box(lat_min, lat_max, lon_min, lon_max, precision, max_cells=None):
+    """
+    Geohashes of the cells at a precision that overlap a lat/lon box (lon may wrap)
+    Returns: set of geohashes, or None if there would be more than max_cells
+    """
+    height, width = geohash_cell_size(precision)
+    columns_total = round(360.0 / width)
+    row_first = math.floor((max(lat_min, -90.0) + 90) / height)
+    row_last = min(math.floor((min(lat_max, 90.0) + 90) / height), round(180.0 / height) - 1)
+    column_first = math.floor((lon_min + 180) / width)
+    columns = min(math.floor((lon_max + 180) / width) - column_first + 1, columns_total)
+    if max_cells is not None and (row_last - row_first + 1) * columns > max_cells:
+        return None
+
+    cells = set()
+    for row in range(row_first, row_last + 1):
+        center_lat = -90 + (row + 0.5) * height
+        for offset in range(columns):
+            column = (column_first + offset) % columns_total
+            cells.add(geohash_encode(center_lat, -180 + (column + 0.5) * width, precision))
+    return cells
+
+
+def _bounding_box(latitude, longitude, radius_km):
+    """Box around a circle; longitude spans everything near the poles"""
+    dlat = radius_km / KM_PER_DEGREE
+    widest = math.cos(math.radians(min(89.9, abs(latitude) + dlat)))
+    dlon = radius_km / (KM_PER_DEGREE * widest)
+    if dlon >= 180:
+        return latitude - dlat, latitude + dlat, -180.0, 180.0 - 1e-9
+    return latitude - dlat, latitude + dlat, longitude - dlon, longitude + dlon
+
+
+def _next_prefix(prefix):
+    """Smallest string greater than every geohash starting with prefix, or None"""
+    while prefix:
+        index = BASE32.index(prefix[-1])
+        if index + 1 < len(BASE32):
+            return prefix[:-1] + BASE32[index + 1]
+        prefix = prefix[:-1]
+    return None
+
+
+def covering_ranges(latitude, longitude, radius_km):
+    """
+    Geohash key ranges that together contain every point within radius_km
+    Uses the finest precision that needs at most MAX_COVER_CELLS cells, and
+    merges adjacent cells into one range.
+    Returns: list of (start, end) with end exclusive (None = unbounded)
+    """
+    box = _bounding_box(latitude, longitude, radius_km)
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        cells = _cells_in_box(*box, precision, MAX_COVER_CELLS)
+        if cells is not None:
+            break
+
+    ranges = []
+    for cell in sorted(cells):
+        if ranges and ranges[-1][1] == cell:
+            ranges[-1][1] = _next_prefix(cell)
+        else:
+            ranges.append([cell, _next_prefix(cell)])
+    return [tuple(r) for r in ranges]
+
+
+# Offline gazetteer
+
+def _normalize_place(name):
+    """Case-, accent- and punctuation-insensitive lookup key"""
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode()
+    return ' '.join(''.join(c if c.isalnum() else ' ' for c in name.lower()).split())
+
+
+class Gazetteer:
+    """Place name -> coordinates, loaded once from CSV or a GeoNames dump"""
+
+    def __init__(self):
+        self._places = None
+        self._lock = threading.Lock()
+
+    def _rows(self, path):
+        """(names, country, latitude, longitude, population) from either format"""
+        with open(path, encoding='utf-8') as f:
+            if path.endswith('.csv'):
+                for row in csv.DictReader(f):
+                    names = [row['name']] + [n for n in row['alternate_names'].split('|') if n]
+                    yield (names, row['country'], float(row['latitude']),
+                           float(row['longitude']), int(row['population'] or 0))
+            else:
+                # GeoNames: tab-separated, see https://download.geonames.org/export/dump/
+                for line in f:
+                    fields = line.rstrip('\n').split('\t')
+                    names = [fields[1], fields[2]] + [n for n in fields[3].split(',') if n]
+                    yield (names, fields[8], float(fields[4]), float(fields[5]),
+                           int(fields[14] or 0))
+
+    def load(self, path):
+        places = {}
+        for names, country, latitude, longitude, population in self._rows(path):
+            for name in {_normalize_place(n) for n in names}:
+                if name:
+                    places.setdefault(name, []).append((country, latitude, longitude, population))
+        self._places = places
+        return len(places)
+
+    def _ensure_loaded(self):
+        if self._places is None:
+            with self._lock:
+                if self._places is None:
+                    self.load(current_app.config['GAZETTEER_PATH'])
+
+    def lookup(self, location, default_country=None):
+        """
+        Coordinates for a free-text location like "Gulberg, Lahore, Pakistan"
+        The most specific part that names a known place wins; a country part
+        and then default_country break ties, then population.
+        Returns: (latitude, longitude) or None
+        """
+        self._ensure_loaded()
+        parts = [_normalize_place(part) for part in (location or '').split(',')]
+        parts = [part for part in parts if part]
+        country = next((COUNTRY_NAMES[p] for p in parts if p in COUNTRY_NAMES), default_country)
+
+        # The whole string first ("Bahria Town Lahore"), then each part
+        for candidate in [' '.join(parts)] + parts:
+            matches = self._places.get(candidate)
+            if matches:
+                best = max(matches, key=lambda m: (m[0] == country, m[3]))
+                return best[1], best[2]
+        return None
+
+
+gazetteer = Gazetteer()
+
+
+def geocode(location):
+    """Coordinates for a listing's location text, or None if it isn't a known place"""
+    return gazetteer.lookup(location, current_app.config['GAZETTEER_DEFAULT_COUNTRY'])
+
+
+def _set_coordinates(target, coordinates):
+    if coordinates:
+        target.latitude, target.longitude = coordinates
+        target.geohash = geohash_encode(*coordinates)
+    else:
+        target.latitude = target.longitude = target.geohash = None
+
+
+@event.listens_for(BusinessListing, 'before_insert')
+def _geocode_new_listing(mapper, connection, target):
+    """Fill coordinates from the gazetteer unless they were set explicitly"""
+    if target.latitude is None and target.location:
+        _set_coordinates(target, geocode(target.location))
+    elif target.latitude is not None and target.geohash is None:
+        target.geohash = geohash_encode(target.latitude, target.longitude)
+
+
+@event.listens_for(BusinessListing, 'before_update')
+def _geocode_changed_location(mapper, connection, target):
+    """Re-geocode when the location text is edited"""
+    if inspect(target).attrs.location.history.has_changes():
+        _set_coordinates(target, geocode(target.location) if target.location else None)
+
+
+def backfill_coordinates():
+    """
+    Geocode listings that have a location but no coordinates yet
+    Returns: (listings geocoded, listings whose location is not in the gazetteer)
+    """
+    table = BusinessListing.__table__
+    geocoded = unknown = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            table.select().with_only_columns(table.c.id, table.c.location).where(
+                table.c.id > last_id, table.c.latitude.is_(None), table.c.location.isnot(None)
+            ).order_by(table.c.id).limit(BACKFILL_BATCH_SIZE)).all()
+        if not rows:
+            break
+        for id, location in rows:
+            coordinates = geocode(location)
+            if coordinates:
+                db.session.execute(table.update().where(table.c.id == id).values(
+                    latitude=coordinates[0], longitude=coordinates[1],
+                    geohash=geohash_encode(*coordinates)))
+                geocoded += 1
+            else:
+                unknown += 1
+        db.session.commit()
+        last_id = rows[-1][0]
+    return geocoded, unknown
+
+
+# Spatial backends
+
+_geo_backend = None
+
+
+def geo_backend():
+    """'postgis', 'earthdistance' or 'geohash', depending on what the database offers"""
+    global _geo_backend
+    if _geo_backend is None:
+        _geo_backend = 'geohash'
+        if db.engine.dialect.name == 'postgresql':
+            installed = set(db.session.execute(text(
+                "SELECT extname FROM pg_extension WHERE extname IN ('postgis', 'earthdistance')"
+            )).scalars())
+            if 'postgis' in installed:
+                _geo_backend = 'postgis'
+            elif 'earthdistance' in installed:
+                _geo_backend = 'earthdistance'
+    return _geo_backend
+
+
+def create_spatial_index():
+    """
+    Create the PostgreSQL spatial index for the best available extension
+    Returns: the backend that will be used
+    """
+    global _geo_backend
+    _geo_backend = None
+    if db.engine.dialect.name != 'postgresql':
+        return geo_backend()
+
+    for statements in (
+            ["CREATE EXTENSION IF NOT EXISTS postgis",
+             "CREATE INDEX IF NOT EXISTS ix_business_listings_geography ON business_listings "
+             "USING gist (geography(ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)))"],
+            ["CREATE EXTENSION IF NOT EXISTS cube",
+             "CREATE EXTENSION IF NOT EXISTS earthdistance",
+             "CREATE INDEX IF NOT EXISTS ix_business_listings_earth ON business_listings "
+             "USING gist (ll_to_earth(latitude, longitude))"]):
+        try:
+            for statement in statements:
+                db.session.execute(text(statement))
+            db.session.commit()
+            break
+        except Exception:
+            # Extension not available on this server; try the next one
+            db.session.rollback()
+    _geo_backend = None
+    return geo_backend()
+
+
+def _nearby_postgres(query, latitude, longitude, radius_km, limit, backend):
+    if backend == 'postgis':
+        point = func.geography(func.ST_SetSRID(
+            func.ST_MakePoint(BusinessListing.longitude, BusinessListing.latitude), 4326))
+        center = func.geography(func.ST_SetSRID(func.ST_MakePoint(longitude, latitude), 4326))
+        distance = func.ST_Distance(point, center)
+        within = lambda meters: func.ST_DWithin(point, center, meters)  # noqa: E731
+    else:
+        point = func.ll_to_earth(BusinessListing.latitude, BusinessListing.longitude)
+        center = func.ll_to_earth(latitude, longitude)
+        distance = func.earth_distance(point, center)
+        # earth_box is the index-searchable part, earth_distance the exact check
+        within = lambda meters: and_(func.earth_box(center, meters).op('@>')(point),  # noqa: E731
+                                     distance <= meters)
+
+    query = query.filter(BusinessListing.latitude.isnot(None)).order_by(None)
+    if radius_km is not None:
+        query = query.filter(within(radius_km * 1000)).order_by(distance)
+    else:
+        # k-nearest: index-ordered scan by the <-> distance operator
+        query = query.order_by(point.op('<->')(center))
+    return [(listing, meters / 1000)
+            for listing, meters in query.add_columns(distance).limit(limit).all()]
+
+
+def _candidates(query, ranges):
+    """(id, latitude, longitude) of listings in the given geohash ranges"""
+    column = BusinessListing.geohash
+    conditions = [and_(column >= start, column < end) if end else column >= start
+                  for start, end in ranges]
+    return query.with_entities(
+        BusinessListing.id, BusinessListing.latitude, BusinessListing.longitude
+    ).filter(or_(*conditions)).order_by(None).all()
+
+
+def _kth_distance(query, latitude, longitude, k):
+    """
+    Distance within which at least k listings lie (or all of them)
+    Looks at a growing block of cells around the point until it holds k
+    listings; their k-th distance bounds the exact k-nearest search.
+    """
+    for precision in range(GEOHASH_PRECISION - 1, 0, -1):
+        height, width = geohash_cell_size(precision)
+        cells = _cells_in_box(latitude - height, latitude + height,
+                              longitude - width, longitude + width, precision)
+        rows = _candidates(query, [(cell, _next_prefix(cell)) for cell in cells])
+        if len(rows) >= k:
+            distances = sorted(haversine_km(latitude, longitude, lat, lon) for _, lat, lon in rows)
+            return distances[k - 1]
+
+    # Fewer than k listings nearby: take all geocoded ones
+    rows = query.with_entities(BusinessListing.latitude, BusinessListing.longitude).filter(
+        BusinessListing.geohash.isnot(None)).order_by(None).all()
+    if not rows:
+        return None
+    return max(haversine_km(latitude, longitude, lat, lon) for lat, lon in rows)
+
+
+def _nearby_geohash(query, latitude, longitude, radius_km, limit):
+    if radius_km is None:
+        radius_km = _kth_distance(query, latitude, longitude, limit)
+        if radius_km is None:
+            return []
+        # Floating-point slack so the k-th listing itself is inside
+        radius_km *= 1 + 1e-9
+
+    hits = []
+    for id, lat, lon in _candidates(query, covering_ranges(latitude, longitude, radius_km)):
+        distance = haversine_km(latitude, longitude, lat, lon)
+        if distance <= radius_km:
+            hits.append((distance, id))
+    hits = sorted(hits)[:limit]
+
+    listings = {listing.id: listing for listing in query.filter(
+        BusinessListing.id.in_([id for _, id in hits])).order_by(None)}
+    return [(listings[id], distance) for distance, id in hits if id in listings]
+
+
+def valid_point(latitude, longitude):
+    """Check request coordinates: finite, -90..90 and -180..180"""
+    return (latitude is not None and longitude is not None and
+            math.isfinite(latitude) and math.isfinite(longitude) and
+            -90 <= latitude <= 90 and -180 <= longitude <= 180)
+
+
+def valid_radius(radius_km):
+    """Check a requested radius: finite, positive and at most GEO_MAX_RADIUS_KM"""
+    return (radius_km is not None and math.isfinite(radius_km) and
+            0 < radius_km <= current_app.config['GEO_MAX_RADIUS_KM'])
+
+
+def nearby_businesses(query, latitude, longitude, radius_km=None, limit=20):
+    """
+    Listings from a (filtered) BusinessListing query near a point, nearest first
+    With radius_km: everything within the radius (up to limit).
+    Without: the `limit` nearest listings.
+    Returns: list of (listing, distance in km)
+    """
+    backend = geo_backend()
+    if backend == 'geohash':
+        return _nearby_geohash(query, latitude, longitude, radius_km, limit)
+    return _nearby_postgres(query, latitude, longitude, radius_km, limit, backend)
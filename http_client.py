@@ -0,0 +1,255 @@
+"""
+Shared outbound HTTP layer
+
+All calls leaving the app (Cloudinary uploads, Google OAuth token/userinfo/JWKS)
+go through one process-wide set of keep-alive connection pools instead of
+opening a fresh TCP + TLS connection per request.
+"""
+import re
+import threading
+import time
+
+import cloudinary
+import cloudinary.uploader
+import cloudinary.utils
+import requests
+from authlib.integrations.flask_client import FlaskOAuth2App
+from authlib.integrations.requests_client import OAuth2Session
+from flask import current_app
+from requests.adapters import HTTPAdapter
+from urllib3 import Timeout
+from urllib3.util.retry import Retry
+
+_adapter = None
+_session = None
+_document_cache = None
+_lock = threading.Lock()
+_last_status = threading.local()
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter shared by every session, with a default timeout"""
+
+    def __init__(self, timeout=None, **kwargs):
+        self.default_timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.default_timeout
+        return super().send(request, timeout=timeout, **kwargs)
+
+    def close(self):
+        # Sessions call close() on their adapters when they exit; the pools
+        # belong to the process, so keep them open for the next session.
+        pass
+
+    def shutdown(self):
+        """Really close all pooled connections"""
+        super().close()
+
+
+def _retry_policy(config):
+    """Build the urllib3 retry policy from config (idempotent methods only)"""
+    return Retry(
+        total=config['HTTP_MAX_RETRIES'],
+        connect=config['HTTP_MAX_RETRIES'],
+        read=config['HTTP_MAX_RETRIES'],
+        backoff_factor=config['HTTP_RETRY_BACKOFF'],
+        status_forcelist=(502, 503, 504),
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+        raise_on_status=False
+    )
+
+
+def init_http_client():
+    """Create the shared connection pools and hand them to Cloudinary"""
+    global _adapter, _session, _document_cache
+    config = current_app.config
+
+    with _lock:
+        if _adapter is not None:
+            _adapter.shutdown()
+
+        timeout = (config['HTTP_CONNECT_TIMEOUT'], config['HTTP_READ_TIMEOUT'])
+        _adapter = PooledHTTPAdapter(
+            timeout=timeout,
+            pool_connections=config['HTTP_POOL_CONNECTIONS'],
+            pool_maxsize=config['HTTP_POOL_MAXSIZE'],
+            max_retries=_retry_policy(config)
+        )
+        _session = requests.Session()
+        mount_pooled_adapter(_session)
+        _document_cache = DocumentCache(_session, default_ttl=config['OAUTH_DOCUMENT_TTL'])
+
+        # Cloudinary talks urllib3 directly through a module-level pool manager;
+        # swap it for one with our pool sizes, deadlines and retry policy.
+        # POST is not in the retry allow-list, so uploads are never replayed.
+        options = dict(cloudinary.CERT_KWARGS)
+        options.update(
+            num_pools=config['HTTP_POOL_CONNECTIONS'],
+            maxsize=config['HTTP_POOL_MAXSIZE'],
+            timeout=Timeout(connect=timeout[0], read=timeout[1]),
+            retries=_retry_policy(config)
+        )
+        cloudinary.uploader._http = StatusRecordingPool(cloudinary.utils.get_http_connector(
+            cloudinary.config(), options))
+
+
+class StatusRecordingPool:
+    """
+    Pool manager that remembers the HTTP status of the thread's last response
+    Cloudinary raises a bare Error for JSON error replies, dropping the status.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def request(self, *args, **kwargs):
+        response = self.pool.request(*args, **kwargs)
+        _last_status.value = response.status
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.pool, name)
+
+
+def reset_response_status():
+    """Forget the thread's last response status before a call"""
+    _last_status.value = None
+
+
+def last_response_status():
+    """HTTP status of the thread's last response through Cloudinary's pool, or None"""
+    return getattr(_last_status, 'value', None)
+
+
+def get_http_adapter():
+    """Return the process-wide adapter, creating a default one if needed"""
+    global _adapter
+    if _adapter is None:
+        with _lock:
+            if _adapter is None:
+                _adapter = PooledHTTPAdapter()
+    return _adapter
+
+
+def mount_pooled_adapter(session):
+    """Route a requests session through the shared connection pools"""
+    adapter = get_http_adapter()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session():
+    """Return the shared requests session for plain outbound calls"""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = mount_pooled_adapter(requests.Session())
+    return _session
+
+
+def get_document_cache():
+    """Return the in-memory cache for JWKS / discovery documents"""
+    global _document_cache
+    if _document_cache is None:
+        with _lock:
+            if _document_cache is None:
+                _document_cache = DocumentCache(get_session())
+    return _document_cache
+
+
+_MAX_AGE_RE = re.compile(r'(?:^|,)\s*(?:s-maxage|max-age)\s*=\s*"?(\d+)"?', re.I)
+
+
+def parse_cache_lifetime(headers, default=0):
+    """
+    Work out how long a response may be reused from its Cache-Control header
+    Returns: lifetime in seconds (0 means do not reuse)
+    """
+    cache_control = headers.get('Cache-Control', '')
+    directives = cache_control.lower()
+    if 'no-store' in directives or 'no-cache' in directives:
+        return 0
+
+    matches = _MAX_AGE_RE.findall(cache_control)
+    if not matches:
+        return default
+
+    lifetime = min(int(m) for m in matches)
+    try:
+        lifetime -= int(headers.get('Age', 0))
+    except ValueError:
+        pass
+    return max(lifetime, 0)
+
+
+class DocumentCache:
+    """
+    In-memory cache of JSON documents that honors Cache-Control max-age
+    Documents without a max-age are kept for default_ttl seconds, like the
+    JWKS authlib caches for the life of the app (a new signing key is fetched
+    with force=True when a token names an unknown kid).
+    """
+
+    def __init__(self, session, clock=time.monotonic, default_ttl=3600):
+        self.session = session
+        self.clock = clock
+        self.default_ttl = default_ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get_json(self, url, force=False):
+        """Return the decoded document, fetching it only when stale"""
+        now = self.clock()
+        if not force:
+            entry = self._entries.get(url)
+            if entry and entry[0] > now:
+                return entry[1]
+
+        resp = self.session.get(url)
+        resp.raise_for_status()
+        document = resp.json()
+
+        lifetime = parse_cache_lifetime(resp.headers, self.default_ttl)
+        with self._lock:
+            if lifetime > 0:
+                self._entries[url] = (now + lifetime, document)
+            else:
+                self._entries.pop(url, None)
+        return document
+
+    def clear(self):
+        """Drop every cached document"""
+        with self._lock:
+            self._entries.clear()
+
+
+class PooledOAuth2Session(OAuth2Session):
+    """Authlib session that reuses the shared keep-alive pools"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        mount_pooled_adapter(self)
+
+
+class PooledFlaskOAuth2App(FlaskOAuth2App):
+    """Flask OAuth client with pooled sessions and cached JWKS / metadata"""
+    client_cls = PooledOAuth2Session
+
+    def load_server_metadata(self):
+        if self._server_metadata_url:
+            metadata = get_document_cache().get_json(self._server_metadata_url)
+            self.server_metadata.update(metadata)
+        return self.server_metadata
+
+    def fetch_jwk_set(self, force=False):
+        metadata = self.load_server_metadata()
+        uri = metadata.get('jwks_uri')
+        if not uri:
+            raise RuntimeError('Missing "jwks_uri" in metadata')
+        # authlib's parse_id_token() forces a refetch only when the token's kid is not in the set
+        return get_document_cache().get_json(uri, force=force)
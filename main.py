@@ -5,9 +5,31 @@ from flask_wtf.csrf import CSRFProtect
 from authlib.integrations.flask_client import OAuth
 from config import Config
 from models import db, User, BusinessListing, ProfessionalProfile
-from utils import init_cloudinary, upload_image_to_cloudinary, validate_image
+from utils import init_cloudinary, validate_image
+from http_client import init_http_client, PooledFlaskOAuth2App
+from search_index import (ensure_suggest_index, fuzzy_search_businesses,
+                          fuzzy_search_professionals, parse_skills, SUGGEST_SCOPES)
+from ranking import business_ordering, professional_ordering, recompute_rank_scores
+from analytics import (count_view, init_view_analytics, rollup_view_buckets,
+                       unique_visitors, views_by_day)
+from assets import init_assets
+from avatars import avatar_for
+from db_routing import REPLICA_BIND_PREFIX, init_read_replicas, primary_reads, simulate_replication
+from streaming import init_compression, stream_page
+from geo import (backfill_coordinates, create_spatial_index, geocode, nearby_businesses,
+                 valid_point, valid_radius)
+from fragments import init_template_caches
+from read_models import business_cards, professional_cards
+from recommendations import (BUSINESS, PROFESSIONAL, neighbor_refresh, recompute_neighbors,
+                             related_businesses, similar_professionals)
+from changes import apply_changes, is_stale, publish_changes
+from storage import image_storage, init_storage, run_cloudinary_stub, upload_image
+from deletion import (delete_business_listings, delete_professional_profiles,
+                      image_cleanup, remove_account)
+from sqlalchemy.orm.exc import StaleDataError
 import os
 import json
+import click
 
 app = Flask(__name__)
 app.config.from_object(Config)
@@ -19,15 +41,45 @@ login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+# Keep a visitor's reads on the primary for a while after they write
+init_read_replicas(app)
+
 # Initialize CSRF Protection
 csrf = CSRFProtect(app)
 
 # Initialize Cloudinary
 with app.app_context():
     init_cloudinary()
+    # Shared keep-alive pools for Cloudinary and OAuth calls
+    init_http_client()
+
+# Write batched view counts on shutdown
+init_view_analytics(app)
+
+# Background deletion of logos left behind by deleted listings
+image_cleanup.init_app(app)
+
+# Background refresh of recommendations after listing/profile edits
+neighbor_refresh.init_app(app)
+
+# Upload deadlines and circuit breaker; /uploads/ served from the database while Cloudinary is down
+init_storage(app)
+
+# Fingerprinted, precompressed CSS/JS bundles (see build_assets.py)
+init_assets(app)
+
+# gzip/brotli for dynamic responses, including streamed pages
+init_compression(app)
+
+# Compiled templates shared across workers; directory cards cached per row version
+init_template_caches(app)
 
-# Initialize OAuth
+STALE_EDIT_MESSAGE = ('This was changed in another window or tab while you were editing. '
+                      'Review the latest version and make your changes again.')
+
+# Initialize OAuth (pooled sessions, JWKS cached per Cache-Control)
 oauth = OAuth(app)
+oauth.oauth2_client_cls = PooledFlaskOAuth2App
 
 # Google OAuth Configuration
 google = oauth.register(
@@ -174,13 +226,15 @@ def signup():
             name=name,
             email=user_email,
             oauth_provider='local',
-            profile_photo=f'https://ui-avatars.com/api/?name={name.replace(" ", "+")}&background=4285f4&color=fff',
             theme_preference='light'
         )
         new_user.set_password(password)
 
         try:
             db.session.add(new_user)
+            db.session.flush()
+            # Initials avatar served by this app (needs the new user's id)
+            new_user.profile_photo = url_for('avatar', user_id=new_user.id)
             db.session.commit()
             login_user(new_user)
             flash(
@@ -195,6 +249,7 @@ def signup():
 
 
 @app.route('/auth/test-login', methods=['GET', 'POST'])
+@primary_reads
 def test_login():
     """Development test login (bypasses OAuth)"""
     # If already logged in, redirect to dashboard
@@ -208,10 +263,11 @@ def test_login():
             email='test@example.com',
             name='Test User',
             oauth_provider='test',
-            profile_photo='https://ui-avatars.com/api/?name=Test+User&background=4285f4&color=fff',
             theme_preference='light'
         )
         db.session.add(test_user)
+        db.session.flush()
+        test_user.profile_photo = url_for('avatar', user_id=test_user.id)
         db.session.commit()
 
     login_user(test_user)
@@ -223,7 +279,17 @@ def test_login():
 @login_required
 def dashboard():
     """User dashboard - requires authentication"""
-    return render_template('dashboard.html', user=current_user)
+    # Views over the last 30 days across the user's listings and profile
+    entities = [('business', business.id) for business in current_user.businesses]
+    if current_user.professional_profile:
+        entities.append(('professional', current_user.professional_profile.id))
+    daily_views = views_by_day(entities, days=30)
+
+    return render_template('dashboard.html', user=current_user,
+                           daily_views=daily_views,
+                           unique_visitors=unique_visitors(entities, days=30),
+                           recent_views=sum(views for _, views in daily_views),
+                           max_daily_views=max(views for _, views in daily_views))
 
 
 @app.route('/logout')
@@ -249,6 +315,7 @@ def google_login():
 
 
 @app.route('/auth/google/callback')
+@primary_reads
 def google_callback():
     """Handle Google OAuth callback"""
     try:
@@ -315,6 +382,37 @@ def update_theme():
     return {'success': False, 'error': 'Invalid theme'}, 400
 
 
+@app.route('/api/suggest')
+def suggest():
+    """Search-as-you-type suggestions from the in-memory prefix index"""
+    query = request.args.get('q', '').strip()
+    scope = request.args.get('scope', '')
+    limit = max(1, min(request.args.get('limit', 8, type=int), 20))
+
+    if scope and scope not in SUGGEST_SCOPES:
+        return {'success': False, 'error': 'Invalid scope'}, 400
+
+    suggestions = []
+    if query:
+        suggestions = ensure_suggest_index().suggest(
+            query, kinds=SUGGEST_SCOPES.get(scope), limit=limit)
+
+    return jsonify({'query': query, 'suggestions': suggestions})
+
+
+@app.route('/avatar/<int:user_id>.svg')
+def avatar(user_id):
+    """Initials avatar for a user, rendered locally and cached"""
+    name = db.one_or_404(db.select(User.name).filter_by(id=user_id))
+    svg, etag = avatar_for(user_id, name)
+    response = app.response_class(svg, mimetype='image/svg+xml')
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['AVATAR_MAX_AGE']
+    # Renames are picked up on revalidation, which is a 304 otherwise
+    return response.make_conditional(request)
+
+
 @app.route('/profile')
 @login_required
 def profile():
@@ -326,41 +424,88 @@ def profile():
 
 @app.route('/businesses')
 def businesses():
-    """Business directory with search and filter"""
+    """Business directory with search, filter and "near me" search"""
     # Get query parameters
     search = request.args.get('search', '')
     category = request.args.get('category', '')
     location = request.args.get('location', '')
+    fuzzy = request.args.get('fuzzy') == '1'
+    latitude = request.args.get('lat', type=float)
+    longitude = request.args.get('lon', type=float)
+    radius = request.args.get('radius', type=float)
+    # NaN, infinite and out-of-range values are ignored rather than searched with
+    if not valid_radius(radius):
+        radius = None
+
+    # Search around the visitor's position, or around the typed place if a radius is chosen
+    center = None
+    if valid_point(latitude, longitude):
+        center = (latitude, longitude)
+    elif location and radius:
+        center = geocode(location)
 
     # Build query
     query = BusinessListing.query
 
-    if search:
-        query = query.filter(
-            (BusinessListing.business_name.ilike(f'%{search}%')) |
-            (BusinessListing.description.ilike(f'%{search}%'))
-        )
-
     if category:
         query = query.filter(BusinessListing.category == category)
 
-    if location:
+    if location and center is None:
         query = query.filter(BusinessListing.location.ilike(f'%{location}%'))
 
-    # Order by view count and created date
-    listings = query.order_by(
-        BusinessListing.view_count.desc(), BusinessListing.created_at.desc()).all()
+    # Order by popularity (view count and created date, or precomputed rank)
+    ordering = business_ordering()
+    distances = {}
+
+    if center is not None:
+        if search:
+            query = query.filter(
+                (BusinessListing.business_name.ilike(f'%{search}%')) |
+                (BusinessListing.description.ilike(f'%{search}%')))
+        # Served from the spatial index, nearest first
+        nearby = nearby_businesses(query, *center, radius_km=radius,
+                                   limit=app.config['GEO_RESULT_LIMIT'] if radius
+                                   else app.config['GEO_NEAREST_LIMIT'])
+        listings = [listing for listing, _ in nearby]
+        distances = {listing.id: km for listing, km in nearby}
+        total = len(listings)
+        fuzzy = False
+    else:
+        if search and not fuzzy:
+            exact = query.filter(
+                (BusinessListing.business_name.ilike(f'%{search}%')) |
+                (BusinessListing.description.ilike(f'%{search}%')))
+            total = exact.count()
+            # Nothing matched exactly - fall back to typo-tolerant matching
+            fuzzy = total == 0
+        elif not search:
+            total = query.count()
+
+        # Card columns only, as compact read models instead of entities
+        if search and fuzzy:
+            listings = list(business_cards(fuzzy_search_businesses(query, search).order_by(
+                *ordering).limit(app.config['FUZZY_SEARCH_LIMIT'])))
+            total = len(listings)
+        else:
+            # Cards are rendered as rows arrive from the cursor
+            listings = business_cards((exact if search else query).order_by(*ordering))
 
     # Get all unique categories for filter
     categories = db.session.query(BusinessListing.category).distinct().all()
     categories = [c[0] for c in categories]
 
-    return render_template('businesses.html',
-                           listings=listings,
-                           categories=categories,
-                           search=search,
-                           selected_category=category,
-                           selected_location=location)
+    return stream_page('businesses.html',
+                       listings=listings,
+                       total=total,
+                       categories=categories,
+                       search=search,
+                       fuzzy=fuzzy and bool(search),
+                       selected_category=category,
+                       selected_location=location,
+                       selected_radius=radius,
+                       unknown_place=bool(location and radius) and center is None,
+                       near=(latitude, longitude) if latitude is not None and longitude is not None else None,
+                       distances=distances)
 
 
 @app.route('/business/<int:id>')
@@ -368,13 +513,15 @@ def business_detail(id):
     """Business detail page with view counter"""
     business = BusinessListing.query.get_or_404(id)
 
-    # Increment view count
-    business.increment_views()
+    # Increment view count (once per visitor per window, crawlers excluded)
+    if count_view('business', business.id):
+        business.increment_views()
 
     # Check if current user is the owner
     is_owner = current_user.is_authenticated and business.user_id == current_user.id
 
-    return render_template('business_detail.html', business=business, is_owner=is_owner)
+    return render_template('business_detail.html', business=business, is_owner=is_owner,
+                           related=related_businesses(business.id))
 
 
 @app.route('/dashboard/business/new', methods=['GET', 'POST'])
@@ -400,8 +547,8 @@ def create_business():
             if 'logo_file' in request.files:
                 file = request.files['logo_file']
                 if file and file.filename != '':
-                    # Upload to Cloudinary
-                    success, result = upload_image_to_cloudinary(file)
+                    # Upload to Cloudinary (or the local store while it's failing)
+                    success, result = upload_image(file)
                     if success:
                         logo_url = result
                     else:
@@ -423,22 +570,23 @@ def create_business():
             social_links = {k: v for k, v in social_links.items() if v}
 
             # Create business listing
-            business = BusinessListing(
-                user_id=current_user.id,
-                business_name=business_name,
-                category=category,
-                description=description,
-                contact_email=contact_email,
-                phone=phone,
-                website=website,
-                location=location,
-                logo_url=logo_url,
-                hours=hours
-            )
-            business.set_social_links(social_links)
+            business = BusinessListing(user_id=current_user.id)
+            changes = apply_changes(business, {
+                'business_name': business_name,
+                'category': category,
+                'description': description,
+                'contact_email': contact_email,
+                'phone': phone,
+                'website': website,
+                'location': location,
+                'logo_url': logo_url,
+                'hours': hours,
+                'social_links': social_links or None,
+            })
 
             db.session.add(business)
             db.session.commit()
+            publish_changes(BUSINESS, business.id, changes)
 
             flash('Business listing created successfully!', 'success')
             return redirect(url_for('business_detail', id=business.id))
@@ -452,6 +600,7 @@ def create_business():
 
 
 @app.route('/dashboard/business/edit/<int:id>', methods=['GET', 'POST'])
+@primary_reads
 @login_required
 def edit_business(id):
     """Edit existing business listing"""
@@ -463,26 +612,32 @@ def edit_business(id):
         return redirect(url_for('businesses'))
 
     if request.method == 'POST':
+        # Edited from an older version: don't overwrite what was saved since
+        if is_stale(business, request.form.get('version', type=int)):
+            flash(STALE_EDIT_MESSAGE, 'error')
+            return redirect(url_for('edit_business', id=id))
+
         try:
-            # Update business data
-            business.business_name = request.form.get('business_name')
-            business.category = request.form.get('category')
-            business.description = request.form.get('description')
-            business.contact_email = request.form.get('contact_email')
-            business.phone = request.form.get('phone')
-            business.website = request.form.get('website')
-            business.location = request.form.get('location')
-            business.hours = request.form.get('hours')
+            values = {
+                'business_name': request.form.get('business_name'),
+                'category': request.form.get('category'),
+                'description': request.form.get('description'),
+                'contact_email': request.form.get('contact_email'),
+                'phone': request.form.get('phone'),
+                'website': request.form.get('website'),
+                'location': request.form.get('location'),
+                'hours': request.form.get('hours'),
+            }
 
             # Handle logo upload or URL
             # Check if file was uploaded
             if 'logo_file' in request.files:
                 file = request.files['logo_file']
                 if file and file.filename != '':
-                    # Upload new image to Cloudinary
-                    success, result = upload_image_to_cloudinary(file)
+                    # Upload new image to Cloudinary (or the local store while it's failing)
+                    success, result = upload_image(file)
                     if success:
-                        business.logo_url = result
+                        values['logo_url'] = result
                     else:
                         flash(f'Image upload failed: {result}', 'error')
                         return redirect(url_for('edit_business', id=id))
@@ -491,7 +646,7 @@ def edit_business(id):
             if 'logo_file' not in request.files or not request.files['logo_file'].filename:
                 url_input = request.form.get('logo_url')
                 if url_input:
-                    business.logo_url = url_input
+                    values['logo_url'] = url_input
 
             # Handle social links
             social_links = {
@@ -502,13 +657,26 @@ def edit_business(id):
             }
             # Remove empty social links
             social_links = {k: v for k, v in social_links.items() if v}
-            business.set_social_links(social_links)
+            values['social_links'] = social_links or None
+
+            # Only the fields that differ are written (nothing at all if none do)
+            changes = apply_changes(business, values)
+            if not changes:
+                flash('No changes to save.', 'success')
+                return redirect(url_for('business_detail', id=business.id))
 
             db.session.commit()
+            publish_changes(BUSINESS, business.id, changes)
 
             flash('Business listing updated successfully!', 'success')
             return redirect(url_for('business_detail', id=business.id))
 
+        except StaleDataError:
+            # Saved by a concurrent edit between loading the row and writing it
+            db.session.rollback()
+            flash(STALE_EDIT_MESSAGE, 'error')
+            return redirect(url_for('edit_business', id=id))
+
         except Exception as e:
             db.session.rollback()
             flash(f'Error updating business listing: {str(e)}', 'error')
@@ -521,16 +689,16 @@ def edit_business(id):
 @login_required
 def delete_business(id):
     """Delete business listing"""
-    business = BusinessListing.query.get_or_404(id)
+    # Only the owner is needed, not the whole row
+    owner_id = db.one_or_404(db.select(BusinessListing.user_id).filter_by(id=id))
 
     # Check if user owns this business
-    if business.user_id != current_user.id:
+    if owner_id != current_user.id:
         flash('You do not have permission to delete this business.', 'error')
         return redirect(url_for('businesses'))
 
     try:
-        db.session.delete(business)
-        db.session.commit()
+        delete_business_listings([id])
         flash('Business listing deleted successfully!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -547,39 +715,52 @@ def professionals():
     # Get query parameters
     search = request.args.get('search', '')
     skill = request.args.get('skill', '')
+    fuzzy = request.args.get('fuzzy') == '1'
 
-    # Build query - only show profiles with consent
-    query = ProfessionalProfile.query.filter_by(consent_given=True)
-
-    if search:
-        query = query.join(User).filter(
-            (User.name.ilike(f'%{search}%')) |
-            (ProfessionalProfile.job_title.ilike(f'%{search}%')) |
-            (ProfessionalProfile.summary.ilike(f'%{search}%'))
-        )
+    # Build query - only show profiles with consent (cards also show the user's name)
+    query = ProfessionalProfile.query.join(User).filter(ProfessionalProfile.consent_given.is_(True))
 
     if skill:
-        # Search for skill in JSON array
-        query = query.filter(
-            ProfessionalProfile.skills_json.ilike(f'%{skill}%'))
+        # Containment in the skills JSON array
+        query = query.filter(ProfessionalProfile.has_skill(skill))
 
-    # Order by view count and created date
-    profiles = query.order_by(ProfessionalProfile.view_count.desc(),
-                              ProfessionalProfile.created_at.desc()).all()
+    # Order by popularity (view count and created date, or precomputed rank)
+    ordering = professional_ordering()
 
-    # Get all unique skills for filter
-    all_profiles = ProfessionalProfile.query.filter_by(
-        consent_given=True).all()
+    if search and not fuzzy:
+        exact = query.filter(
+            (User.name.ilike(f'%{search}%')) |
+            (ProfessionalProfile.job_title.ilike(f'%{search}%')) |
+            (ProfessionalProfile.summary.ilike(f'%{search}%')))
+        total = exact.count()
+        # Nothing matched exactly - fall back to typo-tolerant matching
+        fuzzy = total == 0
+    elif not search:
+        total = query.count()
+
+    # Card columns only, as compact read models instead of entities
+    if search and fuzzy:
+        profiles = list(professional_cards(fuzzy_search_professionals(query, search).order_by(
+            *ordering).limit(app.config['FUZZY_SEARCH_LIMIT'])))
+        total = len(profiles)
+    else:
+        # Cards are rendered as rows arrive from the cursor
+        profiles = professional_cards((exact if search else query).order_by(*ordering))
+
+    # Get all unique skills for filter (the skills column alone)
     skills_set = set()
-    for profile in all_profiles:
-        skills_set.update(profile.get_skills())
+    for (skills_json,) in db.session.query(ProfessionalProfile.skills_json).filter(
+            ProfessionalProfile.consent_given.is_(True)):
+        skills_set.update(parse_skills(skills_json))
     skills = sorted(list(skills_set))
 
-    return render_template('professionals.html',
-                           profiles=profiles,
-                           skills=skills,
-                           search=search,
-                           selected_skill=skill)
+    return stream_page('professionals.html',
+                       profiles=profiles,
+                       total=total,
+                       skills=skills,
+                       search=search,
+                       fuzzy=fuzzy and bool(search),
+                       selected_skill=skill)
 
 
 @app.route('/profile/<int:id>')
@@ -594,19 +775,20 @@ def professional_profile(id):
             flash('This profile is not publicly visible.', 'error')
             return redirect(url_for('professionals'))
 
-    # Increment view count (only if not owner and profile is visible)
-    if current_user.is_authenticated and profile.user_id != current_user.id:
-        profile.increment_views()
-    elif not current_user.is_authenticated and profile.is_visible():
-        profile.increment_views()
-
     # Check if current user is the owner
     is_owner = current_user.is_authenticated and profile.user_id == current_user.id
 
-    return render_template('professional_detail.html', profile=profile, is_owner=is_owner)
+    # Increment view count (only if not owner and profile is visible),
+    # once per visitor per window, crawlers excluded
+    if not is_owner and profile.is_visible() and count_view('professional', profile.id):
+        profile.increment_views()
+
+    return render_template('professional_detail.html', profile=profile, is_owner=is_owner,
+                           similar=similar_professionals(profile.id))
 
 
 @app.route('/dashboard/profile/edit', methods=['GET', 'POST'])
+@primary_reads
 @login_required
 def edit_professional_profile():
     """Edit professional profile"""
@@ -615,6 +797,11 @@ def edit_professional_profile():
         user_id=current_user.id).first()
 
     if request.method == 'POST':
+        # Edited from an older version: don't overwrite what was saved since
+        if profile and is_stale(profile, request.form.get('version', type=int)):
+            flash(STALE_EDIT_MESSAGE, 'error')
+            return redirect(url_for('edit_professional_profile'))
+
         try:
             job_title = request.form.get('job_title')
             summary = request.form.get('summary')
@@ -628,34 +815,37 @@ def edit_professional_profile():
             skills_list = [s.strip()
                            for s in skills_input.split(',') if s.strip()]
 
-            if profile:
-                # Update existing profile
-                profile.job_title = job_title
-                profile.summary = summary
-                profile.how_i_help = how_i_help
-                profile.linkedin_url = linkedin_url
-                profile.consent_given = consent_given
-                profile.contact_visible = contact_visible
-                profile.set_skills(skills_list)
-            else:
+            if not profile:
                 # Create new profile
-                profile = ProfessionalProfile(
-                    user_id=current_user.id,
-                    job_title=job_title,
-                    summary=summary,
-                    how_i_help=how_i_help,
-                    linkedin_url=linkedin_url,
-                    consent_given=consent_given,
-                    contact_visible=contact_visible
-                )
-                profile.set_skills(skills_list)
+                profile = ProfessionalProfile(user_id=current_user.id)
                 db.session.add(profile)
 
+            # Only the fields that differ are written (nothing at all if none do)
+            changes = apply_changes(profile, {
+                'job_title': job_title,
+                'summary': summary,
+                'how_i_help': how_i_help,
+                'linkedin_url': linkedin_url,
+                'consent_given': consent_given,
+                'contact_visible': contact_visible,
+                'skills_json': skills_list or None,
+            })
+            if not changes:
+                flash('No changes to save.', 'success')
+                return redirect(url_for('professional_profile', id=profile.id))
+
             db.session.commit()
+            publish_changes(PROFESSIONAL, profile.id, changes)
 
             flash('Professional profile updated successfully!', 'success')
             return redirect(url_for('professional_profile', id=profile.id))
 
+        except StaleDataError:
+            # Saved by a concurrent edit between loading the row and writing it
+            db.session.rollback()
+            flash(STALE_EDIT_MESSAGE, 'error')
+            return redirect(url_for('edit_professional_profile'))
+
         except Exception as e:
             db.session.rollback()
             flash(f'Error updating professional profile: {str(e)}', 'error')
@@ -668,16 +858,15 @@ def edit_professional_profile():
 @login_required
 def delete_professional_profile():
     """Delete professional profile"""
-    profile = ProfessionalProfile.query.filter_by(
-        user_id=current_user.id).first()
+    profile_id = db.session.query(ProfessionalProfile.id).filter_by(
+        user_id=current_user.id).scalar()
 
-    if not profile:
+    if not profile_id:
         flash('No profile to delete.', 'error')
         return redirect(url_for('dashboard'))
 
     try:
-        db.session.delete(profile)
-        db.session.commit()
+        delete_professional_profiles([profile_id])
         flash('Professional profile deleted successfully!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -686,6 +875,97 @@ def delete_professional_profile():
     return redirect(url_for('dashboard'))
 
 
+@app.route('/dashboard/account/delete', methods=['POST'])
+@login_required
+def delete_account():
+    """Delete the current user's account, listings and profile"""
+    try:
+        listings, _ = remove_account(current_user.id)
+    except Exception as e:
+        # The account still exists (maybe with fewer listings): stay logged in to retry
+        db.session.rollback()
+        flash(f'Error deleting account: {str(e)}', 'error')
+        return redirect(url_for('dashboard'))
+
+    logout_user()
+    flash(f'Your account and {listings} business listing(s) have been deleted.', 'success')
+    return redirect(url_for('index'))
+
+
+@app.cli.command('delete-account')
+@click.argument('user_id', type=int)
+def delete_account_command(user_id):
+    """Delete a user and everything they own in batches"""
+    listings, profiles = remove_account(user_id)
+    image_cleanup.wait(60)
+    print(f"[OK] Deleted user {user_id} with {listings} listings and {profiles} profile(s)")
+
+
+@app.cli.command('geocode-listings')
+def geocode_listings_command():
+    """Fill in coordinates for listings saved before geocoding existed"""
+    geocoded, unknown = backfill_coordinates()
+    backend = create_spatial_index()
+    print(f"[OK] Geocoded {geocoded} listings ({unknown} locations not in the gazetteer); spatial search uses {backend}")
+
+
+@app.cli.command('recompute-ranks')
+def recompute_ranks_command():
+    """Refresh precomputed rank scores (run periodically, e.g. hourly cron)"""
+    businesses_updated, profiles_updated = recompute_rank_scores()
+    print(f"[OK] Updated rank_score for {businesses_updated} businesses "
+          f"and {profiles_updated} professional profiles")
+
+
+@app.cli.command('recompute-neighbors')
+def recompute_neighbors_command():
+    """Recompute similar professionals and related businesses (run periodically, e.g. nightly)"""
+    businesses_updated, profiles_updated = recompute_neighbors()
+    print(f"[OK] Recomputed neighbors for {businesses_updated} businesses "
+          f"and {profiles_updated} professional profiles")
+
+
+@app.cli.command('rollup-views')
+def rollup_views_command():
+    """Roll hourly view buckets up to daily ones and expire old buckets"""
+    rolled_up, expired = rollup_view_buckets()
+    print(f"[OK] Rolled up {rolled_up} hourly buckets, expired {expired} daily buckets")
+
+
+@app.cli.command('resync-uploads')
+def resync_uploads_command():
+    """Move logos stored in the database during a Cloudinary outage to Cloudinary"""
+    moved, remaining = image_storage.resync()
+    print(f"[OK] Moved {moved} logos to Cloudinary, {remaining} still pending")
+
+
+@app.cli.command('cloudinary-stub')
+@click.option('--port', default=8765, help='Port on 127.0.0.1')
+@click.option('--latency', default=0.0, help='Seconds per call (randomized +-50%)')
+@click.option('--error-rate', default=0.0, help='Share of calls failing')
+@click.option('--down', is_flag=True, help='Fail every call')
+@click.option('--error-status', default=503, help='HTTP status of failing calls')
+@click.option('--json-errors', is_flag=True, help='Fail with a Cloudinary JSON error instead of a gateway page')
+def cloudinary_stub_command(port, latency, error_rate, down, error_status, json_errors):
+    """Fake Cloudinary upload API for testing timeouts and outages (local testing)"""
+    print(f"[OK] Set CLOUDINARY_UPLOAD_PREFIX=http://127.0.0.1:{port}, Ctrl+C to stop")
+    run_cloudinary_stub(port, latency, error_rate, down, error_status, json_errors)
+
+
+@app.cli.command('simulate-replica')
+@click.option('--lag', default=5.0, help='Seconds between copies (replication lag)')
+def simulate_replica_command(lag):
+    """Copy the SQLite primary into the SQLite replicas every --lag seconds (local testing)"""
+    engines = db.engines
+    replicas = [engine.url.database for key, engine in engines.items()
+                if key and key.startswith(REPLICA_BIND_PREFIX)]
+    if engines[None].dialect.name != 'sqlite' or not replicas:
+        print("[ERROR] Needs a SQLite primary and SQLite DATABASE_REPLICA_URLS")
+        return
+    print(f"[OK] Replicating to {len(replicas)} replica(s) every {lag}s, Ctrl+C to stop")
+    simulate_replication(engines[None].url.database, replicas, lag)
+
+
 # Create database tables
 with app.app_context():
     db.create_all()
@@ -1,15 +1,21 @@
 """
-Database migration script to add username and password_hash columns
+Database migration script to bring an existing database up to date
+(username/password_hash columns, fuzzy search extension, ranking columns and indexes,
+local avatars, cascading user foreign keys, listing coordinates and spatial index,
+row versions for cached cards and optimistic concurrency, JSONB social_links/skills_json, recommendations)
 Run this once to update your existing database
 """
 from main import app, db
-from sqlalchemy import text
+from ranking import recompute_rank_scores
+from geo import backfill_coordinates, create_spatial_index
+from recommendations import recompute_neighbors
+from sqlalchemy import text, inspect
+import json
 
 with app.app_context():
     try:
         # Check if columns already exist
-        result = db.session.execute(text("PRAGMA table_info(users)"))
-        columns = [row[1] for row in result.fetchall()]
+        columns = [col['name'] for col in inspect(db.engine).get_columns('users')]
         
         # Add username column if it doesn't exist
         if 'username' not in columns:
@@ -39,7 +45,108 @@ with app.app_context():
         print("Note: Email column remains non-nullable due to SQLite limitations")
         print("New users created via signup can have NULL email")
         
+        # Add precomputed rank_score columns used for "popular" ordering
+        for table in ('business_listings', 'professional_profiles'):
+            table_columns = [col['name'] for col in inspect(db.engine).get_columns(table)]
+            if 'rank_score' not in table_columns:
+                db.session.execute(text(f"ALTER TABLE {table} ADD COLUMN rank_score FLOAT NOT NULL DEFAULT 0"))
+                print(f"[OK] Added {table}.rank_score column")
+            else:
+                print(f"[OK] {table}.rank_score column already exists")
+        
+        # Coordinates for "near me" search, geocoded from the location text
+        listing_columns = [col['name'] for col in inspect(db.engine).get_columns('business_listings')]
+        for column, column_type in (('latitude', 'FLOAT'), ('longitude', 'FLOAT'), ('geohash', 'VARCHAR(12)')):
+            if column not in listing_columns:
+                db.session.execute(text(f"ALTER TABLE business_listings ADD COLUMN {column} {column_type}"))
+                print(f"[OK] Added business_listings.{column} column")
+        
+        # Row versions that key the cached directory cards
+        for table in ('users', 'business_listings', 'professional_profiles'):
+            table_columns = [col['name'] for col in inspect(db.engine).get_columns(table)]
+            if 'updated_at' not in table_columns:
+                db.session.execute(text(f"ALTER TABLE {table} ADD COLUMN updated_at TIMESTAMP"))
+                db.session.execute(text(f"UPDATE {table} SET updated_at = created_at"))
+                print(f"[OK] Added {table}.updated_at column")
+            else:
+                print(f"[OK] {table}.updated_at column already exists")
+        
+        # Edit versions that reject stale concurrent edits (version_id_col)
+        for table in ('business_listings', 'professional_profiles'):
+            table_columns = [col['name'] for col in inspect(db.engine).get_columns(table)]
+            if 'version' not in table_columns:
+                db.session.execute(text(f"ALTER TABLE {table} ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
+                print(f"[OK] Added {table}.version column")
+            else:
+                print(f"[OK] {table}.version column already exists")
+        
+        # Point avatars hot-linked from ui-avatars.com at the local /avatar/<id>.svg endpoint
+        result = db.session.execute(text(
+            "UPDATE users SET profile_photo = '/avatar/' || CAST(id AS VARCHAR) || '.svg' "
+            "WHERE profile_photo LIKE 'https://ui-avatars.com/%'"))
+        print(f"[OK] Migrated {result.rowcount} ui-avatars.com avatars to local avatars")
+        
+        # Fuzzy search runs on pg_trgm when the database is PostgreSQL
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            print("[OK] pg_trgm extension available")
+        
+        # social_links/skills_json become JSONB; rows that don't parse are cleared first
+        if db.engine.dialect.name == 'postgresql':
+            for table, column in (('business_listings', 'social_links'), ('professional_profiles', 'skills_json')):
+                column_type = next(col['type'] for col in inspect(db.engine).get_columns(table)
+                                   if col['name'] == column)
+                if column_type.__visit_name__ == 'JSONB':
+                    print(f"[OK] {table}.{column} is already JSONB")
+                    continue
+                corrupt = []
+                for id, value in db.session.execute(text(f"SELECT id, {column} FROM {table} WHERE {column} IS NOT NULL")):
+                    try:
+                        json.loads(value)
+                    except ValueError:
+                        corrupt.append(id)
+                if corrupt:
+                    db.session.execute(text(f"UPDATE {table} SET {column} = NULL WHERE id = ANY(:ids)"), {'ids': corrupt})
+                db.session.execute(text(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE JSONB USING {column}::jsonb"))
+                print(f"[OK] Converted {table}.{column} to JSONB ({len(corrupt)} corrupt values cleared)")
+        
+        # User foreign keys cascade on delete so removing a user never loads its listings
+        for table in ('business_listings', 'professional_profiles'):
+            for fk in inspect(db.engine).get_foreign_keys(table):
+                if fk['referred_table'] != 'users' or fk['options'].get('ondelete', '').upper() == 'CASCADE':
+                    continue
+                if db.engine.dialect.name == 'postgresql':
+                    db.session.execute(text(
+                        f"ALTER TABLE {table} DROP CONSTRAINT {fk['name']}, "
+                        f"ADD CONSTRAINT {fk['name']} FOREIGN KEY (user_id) "
+                        f"REFERENCES users (id) ON DELETE CASCADE"))
+                    print(f"[OK] {table}.user_id now cascades on delete")
+                else:
+                    # SQLite can't alter constraints; account removal deletes children itself
+                    print(f"Note: {table}.user_id keeps its foreign key without ON DELETE CASCADE")
+        
         db.session.commit()
+        
+        # Create indexes declared on the models that an older database is missing
+        # (dialect-specific ones, like the trigram GIN indexes, are skipped elsewhere)
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(db.engine, checkfirst=True)
+        print("[OK] Indexes up to date")
+        
+        # Fill in rank scores for existing rows
+        businesses_updated, profiles_updated = recompute_rank_scores()
+        print(f"[OK] Computed rank_score for {businesses_updated} businesses and {profiles_updated} profiles")
+        
+        # Geocode existing listings; PostgreSQL also gets a PostGIS/earthdistance index if available
+        geocoded, unknown = backfill_coordinates()
+        print(f"[OK] Geocoded {geocoded} listings ({unknown} locations not in the gazetteer)")
+        print(f"[OK] Spatial search uses {create_spatial_index()}")
+        
+        # Similar professionals / related businesses for detail pages
+        businesses_updated, profiles_updated = recompute_neighbors()
+        print(f"[OK] Computed neighbors for {businesses_updated} businesses and {profiles_updated} profiles")
+        
         print("\n[SUCCESS] Database migration completed successfully!")
         
     except Exception as e:
@@ -1,14 +1,126 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import DDL, Text, event, type_coerce
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.types import TypeDecorator
+from collections import Counter
 from datetime import datetime
 import json
+import logging
+import sqlite3
+
+from db_routing import RoutingSession
+
+# Reads may be served by replicas; see db_routing.py
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+# Fuzzy search indexes use pg_trgm's operator classes; the extension must exist
+# before the tables (and their GIN indexes) are created. No-op on SQLite.
+event.listen(db.metadata, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+
+
+@event.listens_for(Engine, 'connect')
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """SQLite only enforces foreign keys (and ON DELETE CASCADE) when asked to"""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
+
+def trigram_index(name, column):
+    """GIN trigram index for fuzzy search, only created on PostgreSQL"""
+    return db.Index(name, column, postgresql_using='gin',
+                    postgresql_ops={column: 'gin_trgm_ops'}).ddl_if(dialect='postgresql')
+
+
+def jsonb_index(name, column):
+    """GIN index for JSONB containment (@>) queries, only created on PostgreSQL"""
+    return db.Index(name, column, postgresql_using='gin',
+                    postgresql_ops={column: 'jsonb_path_ops'}).ddl_if(dialect='postgresql')
+
+
+logger = logging.getLogger(__name__)
+
+# Stored JSON values that didn't decode or had the wrong shape, by column
+json_decode_errors = Counter()
+
+
+def record_corrupt_json(column, value):
+    """
+    Count a stored JSON value that can't be used (it loads as None)
+    The first one per column is logged as a warning, then the running total
+    at 10, 100, 1000... so a spreading problem stays visible without a log
+    line per row read.
+    """
+    json_decode_errors[column] += 1
+    count = json_decode_errors[column]
+    if count == 1:
+        logger.warning(f"Corrupt JSON in {column}, read as empty: {str(value)[:100]!r}")
+    elif count == 10 ** (len(str(count)) - 1):
+        logger.warning(f"{count} corrupt JSON values read from {column} in this process")
+    else:
+        logger.debug(f"Corrupt JSON in {column}: {str(value)[:100]!r}")
+
+
+class JSONDocument(TypeDecorator):
+    """
+    JSONB on PostgreSQL, JSON text elsewhere (SQLite)
+    Values are decoded once when the row loads, so the attribute holds the
+    Python object. Undecodable legacy text loads as None and is counted in
+    json_decode_errors instead of failing the whole query.
+    """
+    impl = Text
+    cache_ok = True
+    
+    def __init__(self, column):
+        super().__init__()
+        self.column = column
+    
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(JSONB(none_as_null=True))
+        return dialect.type_descriptor(Text())
+    
+    def process_bind_param(self, value, dialect):
+        if value is None or dialect.name == 'postgresql':
+            return value
+        return json.dumps(value)
+    
+    def process_result_value(self, value, dialect):
+        if value is None or dialect.name == 'postgresql':
+            return value
+        try:
+            return json.loads(value)
+        except ValueError:
+            record_corrupt_json(self.column, value)
+            return None
+
+
+def increment_counter(obj, column):
+    """
+    Atomically add one to a counter column of a loaded row
+    Runs as a single UPDATE on the primary in its own transaction, so it
+    never reads a stale value from a replica and leaves the request's
+    session alone; the loaded object is updated in place without a reload.
+    """
+    table = type(obj).__table__
+    with db.engine.begin() as connection:
+        connection.execute(table.update().where(table.c.id == obj.id).values(
+            {column: table.c[column] + 1}))
+    set_committed_value(obj, column, (getattr(obj, column) or 0) + 1)
 
-db = SQLAlchemy()
 
 class User(UserMixin, db.Model):
     """User model for storing user information"""
     __tablename__ = 'users'
+    __table_args__ = (
+        trigram_index('ix_users_name_trgm', 'name'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(255), unique=True, nullable=True, index=True)  # Nullable for username login
@@ -19,10 +131,14 @@ class User(UserMixin, db.Model):
     profile_photo = db.Column(db.String(500), nullable=True)
     theme_preference = db.Column(db.String(20), default='light')  # 'light' or 'dark'
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)  # Row version for cached cards
     
     # Relationships
-    businesses = db.relationship('BusinessListing', backref='owner', lazy=True, cascade='all, delete-orphan')
-    professional_profile = db.relationship('ProfessionalProfile', backref='user', uselist=False, cascade='all, delete-orphan')
+    # Children are removed by ON DELETE CASCADE; the ORM doesn't load them to delete them
+    businesses = db.relationship('BusinessListing', backref='owner', lazy=True,
+                                 cascade='all, delete-orphan', passive_deletes=True)
+    professional_profile = db.relationship('ProfessionalProfile', backref='user', uselist=False,
+                                           cascade='all, delete-orphan', passive_deletes=True)
     
     def set_password(self, password):
         """Hash and set password"""
@@ -54,9 +170,21 @@ class User(UserMixin, db.Model):
 class BusinessListing(db.Model):
     """Business listing model for directory"""
     __tablename__ = 'business_listings'
+    __table_args__ = (
+        trigram_index('ix_business_listings_business_name_trgm', 'business_name'),
+        trigram_index('ix_business_listings_description_trgm', 'description'),
+        # Directory ordering, with and without the category filter
+        db.Index('ix_business_listings_popular', 'view_count', 'created_at'),
+        db.Index('ix_business_listings_category_popular', 'category', 'view_count', 'created_at'),
+        db.Index('ix_business_listings_rank', 'rank_score'),
+        db.Index('ix_business_listings_category_rank', 'category', 'rank_score'),
+        # Radius / nearest-listing search (see geo.py); covers the candidate lookup
+        db.Index('ix_business_listings_geohash', 'geohash', 'latitude', 'longitude'),
+        jsonb_index('ix_business_listings_social_links_gin', 'social_links'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
     business_name = db.Column(db.String(255), nullable=False, index=True)
     category = db.Column(db.String(100), nullable=False, index=True)
     description = db.Column(db.Text, nullable=True)
@@ -64,35 +192,40 @@ class BusinessListing(db.Model):
     phone = db.Column(db.String(50), nullable=True)
     website = db.Column(db.String(500), nullable=True)
     location = db.Column(db.String(500), nullable=True)
+    latitude = db.Column(db.Float, nullable=True)  # Geocoded from location by geo.py
+    longitude = db.Column(db.Float, nullable=True)
+    geohash = db.Column(db.String(12), nullable=True)
     logo_url = db.Column(db.String(500), nullable=True)
     hours = db.Column(db.String(500), nullable=True)
-    social_links = db.Column(db.Text, nullable=True)  # JSON stored as text
+    social_links = db.Column(JSONDocument('business_listings.social_links'), nullable=True)  # {network: url}
     view_count = db.Column(db.Integer, default=0, nullable=False)
+    rank_score = db.Column(db.Float, nullable=False, server_default='0')  # Maintained by ranking.py
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)  # Row version for cached cards
+    version = db.Column(db.Integer, nullable=False, server_default='1')  # Bumped by every ORM update, see changes.py
+    
+    __mapper_args__ = {'version_id_col': version}
     
     def __repr__(self):
         return f'<BusinessListing {self.business_name}>'
     
     def get_social_links(self):
-        """Parse social_links JSON string to dictionary"""
-        if self.social_links:
-            try:
-                return json.loads(self.social_links)
-            except:
-                return {}
-        return {}
+        """Social links as a dictionary (decoded once, when the row loads)"""
+        links = self.social_links
+        if links is None:
+            return {}
+        if not isinstance(links, dict):
+            record_corrupt_json('business_listings.social_links', links)
+            return {}
+        return links
     
     def set_social_links(self, links_dict):
-        """Convert dictionary to JSON string for storage"""
-        if links_dict:
-            self.social_links = json.dumps(links_dict)
-        else:
-            self.social_links = None
+        """Store social links; assigning a new dict marks the column changed"""
+        self.social_links = dict(links_dict) if links_dict else None
     
     def increment_views(self):
         """Increment view counter"""
-        self.view_count += 1
-        db.session.commit()
+        increment_counter(self, 'view_count')
     
     def to_dict(self):
         """Convert business listing to dictionary"""
@@ -118,42 +251,61 @@ class BusinessListing(db.Model):
 class ProfessionalProfile(db.Model):
     """Professional profile model for directory"""
     __tablename__ = 'professional_profiles'
+    __table_args__ = (
+        trigram_index('ix_professional_profiles_job_title_trgm', 'job_title'),
+        trigram_index('ix_professional_profiles_summary_trgm', 'summary'),
+        # Directory ordering over consented profiles
+        db.Index('ix_professional_profiles_consent_popular', 'consent_given', 'view_count', 'created_at'),
+        db.Index('ix_professional_profiles_consent_rank', 'consent_given', 'rank_score'),
+        jsonb_index('ix_professional_profiles_skills_gin', 'skills_json'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, unique=True, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, unique=True, index=True)
     job_title = db.Column(db.String(255), nullable=False, index=True)
     summary = db.Column(db.Text, nullable=True)
     how_i_help = db.Column(db.Text, nullable=True)
     linkedin_url = db.Column(db.String(500), nullable=True)
-    skills_json = db.Column(db.Text, nullable=True)  # JSON array of skills
+    skills_json = db.Column(JSONDocument('professional_profiles.skills_json'), nullable=True)  # JSON array of skills
     consent_given = db.Column(db.Boolean, default=False, nullable=False)
     contact_visible = db.Column(db.Boolean, default=False, nullable=False)
     view_count = db.Column(db.Integer, default=0, nullable=False)
+    rank_score = db.Column(db.Float, nullable=False, server_default='0')  # Maintained by ranking.py
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)  # Row version for cached cards
+    version = db.Column(db.Integer, nullable=False, server_default='1')  # Bumped by every ORM update, see changes.py
+    
+    __mapper_args__ = {'version_id_col': version}
     
     def __repr__(self):
         return f'<ProfessionalProfile {self.user.name if self.user else "Unknown"}>'
     
     def get_skills(self):
-        """Parse skills JSON string to list"""
-        if self.skills_json:
-            try:
-                return json.loads(self.skills_json)
-            except:
-                return []
-        return []
+        """Skills as a list (decoded once, when the row loads)"""
+        skills = self.skills_json
+        if skills is None:
+            return []
+        if not isinstance(skills, list):
+            record_corrupt_json('professional_profiles.skills_json', skills)
+            return []
+        return skills
     
     def set_skills(self, skills_list):
-        """Convert list to JSON string for storage"""
-        if skills_list:
-            self.skills_json = json.dumps(skills_list)
-        else:
-            self.skills_json = None
+        """Store skills; assigning a new list marks the column changed"""
+        self.skills_json = list(skills_list) if skills_list else None
+    
+    @staticmethod
+    def has_skill(skill):
+        """Filter for profiles listing exactly this skill (GIN-indexed on PostgreSQL)"""
+        if db.engine.dialect.name == 'postgresql':
+            return type_coerce(ProfessionalProfile.skills_json, JSONB).contains([skill])
+        # SQLite keeps the JSON text; match the encoded element
+        return type_coerce(ProfessionalProfile.skills_json, Text).contains(
+            json.dumps(skill), autoescape=True)
     
     def increment_views(self):
         """Increment view counter"""
-        self.view_count += 1
-        db.session.commit()
+        increment_counter(self, 'view_count')
     
     def is_visible(self):
         """Check if profile should be visible in directory"""
@@ -177,3 +329,82 @@ class ProfessionalProfile(db.Model):
             'view_count': self.view_count,
             'created_at': self.created_at.isoformat()
         }
+
+
+class ViewBucket(db.Model):
+    """Views of a listing or profile aggregated per hour or per day"""
+    __tablename__ = 'view_buckets'
+    __table_args__ = (
+        # Rollup and retention scan buckets by age
+        db.Index('ix_view_buckets_granularity_start', 'granularity', 'bucket_start'),
+    )
+    
+    entity_type = db.Column(db.String(20), primary_key=True)  # 'business' or 'professional'
+    entity_id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String(10), primary_key=True)  # 'hour' or 'day'
+    bucket_start = db.Column(db.DateTime, primary_key=True)  # UTC, truncated to the hour/day
+    views = db.Column(db.Integer, default=0, nullable=False)
+    
+    def __repr__(self):
+        return f'<ViewBucket {self.entity_type}:{self.entity_id} {self.granularity} {self.bucket_start}>'
+
+
+class VisitorSketch(db.Model):
+    """HyperLogLog sketch of the distinct visitors to a listing or profile on one day"""
+    __tablename__ = 'visitor_sketches'
+    
+    entity_type = db.Column(db.String(20), primary_key=True)  # 'business' or 'professional'
+    entity_id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, primary_key=True)  # UTC
+    registers = db.Column(db.LargeBinary, nullable=False)  # See visitors.HyperLogLog
+    
+    def __repr__(self):
+        return f'<VisitorSketch {self.entity_type}:{self.entity_id} {self.day}>'
+
+
+class PendingUpload(db.Model):
+    """An image uploaded while Cloudinary was unavailable, served from here until moved (see storage.py)"""
+    __tablename__ = 'pending_uploads'
+    
+    path = db.Column(db.String(255), primary_key=True)  # folder/name.ext, served at /uploads/<path>
+    content_type = db.Column(db.String(100), nullable=True)
+    data = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f'<PendingUpload {self.path}>'
+
+
+class Neighbor(db.Model):
+    """One of the most similar listings/profiles to a listing/profile, see recommendations.py"""
+    __tablename__ = 'neighbors'
+    __table_args__ = (
+        # Incremental updates find the rows that list an edited entity
+        db.Index('ix_neighbors_type_neighbor', 'entity_type', 'neighbor_id'),
+    )
+    
+    entity_type = db.Column(db.String(20), primary_key=True)  # 'business' or 'professional'
+    entity_id = db.Column(db.Integer, primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)  # 0 = most similar
+    neighbor_id = db.Column(db.Integer, nullable=False)
+    score = db.Column(db.Float, nullable=False)  # Cosine similarity
+    
+    def __repr__(self):
+        return f'<Neighbor {self.entity_type}:{self.entity_id} #{self.rank} -> {self.neighbor_id}>'
+
+
+class NeighborFeature(db.Model):
+    """One weighted feature of a listing/profile's normalized vector, see recommendations.py"""
+    __tablename__ = 'neighbor_features'
+    __table_args__ = (
+        # Rows sharing a feature, heaviest first: one row's candidates (see recommendations.py)
+        db.Index('ix_neighbor_features_lookup', 'entity_type', 'feature', 'weight', 'entity_id'),
+    )
+    
+    entity_type = db.Column(db.String(20), primary_key=True)  # 'business' or 'professional'
+    entity_id = db.Column(db.Integer, primary_key=True)
+    feature = db.Column(db.String(255), primary_key=True)  # e.g. 'category:food', 'skill:python'
+    weight = db.Column(db.Float, nullable=False)  # L2-normalized over the row's features
+    
+    def __repr__(self):
+        return f'<NeighborFeature {self.entity_type}:{self.entity_id} {self.feature}>'
@@ -0,0 +1,134 @@
+"""
+Popularity ranking for the business and professional directories
+
+rank_score is time-decayed popularity: every view, and the listing's
+creation (counted as one view), is worth half as much per half-life of age.
+Weights are taken relative to RANK_EPOCH rather than to now,
+
+    rank_score = log2(sum of views * 2 ** ((viewed_at - RANK_EPOCH) / half_life))
+
+which orders rows exactly like their decayed view counts do today, but a
+score only changes when the row gets new views - old spikes fade as newer
+views outweigh them, with no need to rewrite every score as time passes.
+When all views happen at creation this is the familiar
+log2(1 + views) + (created_at - RANK_EPOCH) / half_life.
+
+View times come from the hourly/daily view buckets (analytics.py). Views
+older than the bucket retention (or counted before buckets existed) are
+placed at created_at, the earliest they can have happened.
+
+The score is precomputed by a periodic job (flask recompute-ranks) and
+indexed together with the directory filters, which turns "popular"
+ordering into an index scan instead of a sort of the filtered set.
+"""
+import math
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import bindparam, event
+
+from models import db, BusinessListing, ProfessionalProfile, ViewBucket
+
+# Reference point for the recency term; keeps scores small
+RANK_EPOCH = datetime(2025, 1, 1)
+
+# Rows read and written per round trip by the recompute job
+BATCH_SIZE = 1000
+
+
+def _half_lives_since_epoch(moment, half_life_days):
+    return (moment - RANK_EPOCH).total_seconds() / (half_life_days * 86400)
+
+
+def compute_rank_score(view_count, created_at, half_life_days, bucketed_views=()):
+    """
+    Rank score for a listing with the given lifetime views and creation time
+    bucketed_views: (bucket start, views) of its views that are still bucketed
+    """
+    bucketed_views = list(bucketed_views)
+    untimed = max(0, (view_count or 0) - sum(views for _, views in bucketed_views))
+    terms = [(_half_lives_since_epoch(created_at, half_life_days), 1 + untimed)]
+    terms.extend((_half_lives_since_epoch(bucket_start, half_life_days), views)
+                 for bucket_start, views in bucketed_views if views > 0)
+    # log2 of a sum of powers of two, factored so that nothing overflows
+    top = max(exponent for exponent, _ in terms)
+    return top + math.log2(sum(weight * 2 ** (exponent - top) for exponent, weight in terms))
+
+
+@event.listens_for(BusinessListing, 'before_insert')
+@event.listens_for(ProfessionalProfile, 'before_insert')
+def _set_initial_rank_score(mapper, connection, target):
+    """New rows start with a score from their creation time alone"""
+    if target.rank_score is None:
+        target.rank_score = compute_rank_score(
+            target.view_count, target.created_at or datetime.utcnow(),
+            current_app.config['RANK_HALF_LIFE_DAYS'])
+
+
+def business_ordering():
+    """ORDER BY for the business directory, matching its composite indexes"""
+    if current_app.config['DIRECTORY_RANKING'] == 'rank_score':
+        return (BusinessListing.rank_score.desc(),)
+    return (BusinessListing.view_count.desc(), BusinessListing.created_at.desc())
+
+
+def professional_ordering():
+    """ORDER BY for the professional directory, matching its composite indexes"""
+    if current_app.config['DIRECTORY_RANKING'] == 'rank_score':
+        return (ProfessionalProfile.rank_score.desc(),)
+    return (ProfessionalProfile.view_count.desc(), ProfessionalProfile.created_at.desc())
+
+
+def _bucketed_views(entity_type, ids):
+    """{id: [(bucket start, views), ...]} of the given listings/profiles"""
+    buckets = ViewBucket.__table__
+    views = {}
+    for entity_id, bucket_start, count in db.session.execute(
+            buckets.select().with_only_columns(
+                buckets.c.entity_id, buckets.c.bucket_start, buckets.c.views
+            ).where(buckets.c.entity_type == entity_type, buckets.c.entity_id.in_(ids))):
+        views.setdefault(entity_id, []).append((bucket_start, count))
+    return views
+
+
+def _recompute(model, entity_type, half_life_days):
+    """Recompute rank_score for one table, writing only rows that moved"""
+    table = model.__table__
+    # rank_score isn't shown on cards; keeping updated_at keeps their cached markup
+    update = table.update().where(table.c.id == bindparam('row_id')).values(
+        rank_score=bindparam('score'), updated_at=table.c.updated_at)
+
+    updated = 0
+    last_id = 0
+    while True:
+        # Keyset pagination keeps each batch an index range scan
+        rows = db.session.query(
+            model.id, model.view_count, model.created_at, model.rank_score
+        ).filter(model.id > last_id).order_by(model.id).limit(BATCH_SIZE).all()
+        if not rows:
+            break
+
+        bucketed = _bucketed_views(entity_type, [row[0] for row in rows])
+        changes = []
+        for id, view_count, created_at, rank_score in rows:
+            score = compute_rank_score(view_count, created_at, half_life_days, bucketed.get(id, ()))
+            if rank_score is None or abs(score - rank_score) > 1e-9:
+                changes.append({'row_id': id, 'score': score})
+
+        if changes:
+            db.session.execute(update, changes)
+            db.session.commit()
+            updated += len(changes)
+        last_id = rows[-1][0]
+
+    return updated
+
+
+def recompute_rank_scores():
+    """
+    Refresh rank_score for every listing and profile in bounded batches
+    Returns: (businesses updated, profiles updated)
+    """
+    half_life_days = current_app.config['RANK_HALF_LIFE_DAYS']
+    return (_recompute(BusinessListing, 'business', half_life_days),
+            _recompute(ProfessionalProfile, 'professional', half_life_days))
@@ -0,0 +1,108 @@
+"""
+Read models for the directory pages
+
+Directory cards show a handful of fields, so the listing routes don't load
+entities: the filtered, ordered ORM query is projected to just the card
+columns (with_entities) and each row becomes a small __slots__ object. Rows
+are never added to the session's identity map, no attribute instrumentation
+is involved, and description/summary come back cut to a preview in SQL.
+
+The card objects expose the same attribute names the card partials read
+from entities (including profile.user and profile.get_skills()), so the
+templates take either.
+"""
+from sqlalchemy import func
+
+from models import BusinessListing, ProfessionalProfile, User
+from search_index import parse_skills
+from streaming import stream_rows
+
+# Characters shown on a card; one more is read so templates can tell it was cut
+BUSINESS_PREVIEW_LENGTH = 150
+PROFESSIONAL_PREVIEW_LENGTH = 120
+
+
+def _preview(column, length):
+    return func.substr(column, 1, length + 1)
+
+
+class BusinessCard:
+    """What a business directory card shows"""
+    __slots__ = ('id', 'business_name', 'category', 'location', 'logo_url',
+                 'description', 'view_count', 'created_at', 'updated_at')
+
+    def __init__(self, id, business_name, category, location, logo_url,
+                 description, view_count, created_at, updated_at):
+        self.id = id
+        self.business_name = business_name
+        self.category = category
+        self.location = location
+        self.logo_url = logo_url
+        self.description = description  # Preview, see BUSINESS_PREVIEW_LENGTH
+        self.view_count = view_count
+        self.created_at = created_at
+        self.updated_at = updated_at
+
+    def __repr__(self):
+        return f'<BusinessCard {self.business_name}>'
+
+
+class CardUser:
+    """The owner fields a professional card shows"""
+    __slots__ = ('id', 'name', 'profile_photo', 'updated_at')
+
+    def __init__(self, id, name, profile_photo, updated_at):
+        self.id = id
+        self.name = name
+        self.profile_photo = profile_photo
+        self.updated_at = updated_at
+
+
+class ProfessionalCard:
+    """What a professional directory card shows"""
+    __slots__ = ('id', 'job_title', 'summary', 'skills', 'view_count', 'updated_at', 'user')
+
+    def __init__(self, id, job_title, summary, skills, view_count, updated_at, user):
+        self.id = id
+        self.job_title = job_title
+        self.summary = summary  # Preview, see PROFESSIONAL_PREVIEW_LENGTH
+        self.skills = skills
+        self.view_count = view_count
+        self.updated_at = updated_at
+        self.user = user
+
+    def get_skills(self):
+        return self.skills
+
+    def __repr__(self):
+        return f'<ProfessionalCard {self.user.name}>'
+
+
+BUSINESS_CARD_COLUMNS = (
+    BusinessListing.id, BusinessListing.business_name, BusinessListing.category,
+    BusinessListing.location, BusinessListing.logo_url,
+    _preview(BusinessListing.description, BUSINESS_PREVIEW_LENGTH),
+    BusinessListing.view_count, BusinessListing.created_at, BusinessListing.updated_at,
+)
+
+PROFESSIONAL_CARD_COLUMNS = (
+    ProfessionalProfile.id, ProfessionalProfile.job_title,
+    _preview(ProfessionalProfile.summary, PROFESSIONAL_PREVIEW_LENGTH),
+    ProfessionalProfile.skills_json, ProfessionalProfile.view_count, ProfessionalProfile.updated_at,
+    User.id, User.name, User.profile_photo, User.updated_at,
+)
+
+
+def business_cards(query):
+    """Cards for a (filtered, ordered) BusinessListing query, streamed from the cursor"""
+    for row in stream_rows(query.with_entities(*BUSINESS_CARD_COLUMNS)):
+        yield BusinessCard(*row)
+
+
+def professional_cards(query):
+    """Cards for a (filtered, ordered) ProfessionalProfile query joined to User, streamed"""
+    for (id, job_title, summary, skills_json, view_count, updated_at,
+         user_id, name, profile_photo, user_updated_at) in stream_rows(
+            query.with_entities(*PROFESSIONAL_CARD_COLUMNS)):
+        yield ProfessionalCard(id, job_title, summary, parse_skills(skills_json), view_count,
+                               updated_at, CardUser(user_id, name, profile_photo, user_updated_at))
@@ -0,0 +1,407 @@
+"""
+"Similar professionals" and "related businesses" recommendations
+
+Every listing and visible profile is a sparse, L2-normalized feature vector:
+
+- professionals: their skills, plus job title words at half weight
+- businesses: their category, plus where they are - geohash cells (about
+  5 km and 150 km) when geocoded, otherwise the parts of the location text
+
+so the cosine similarity of two rows is one sparse dot product. The batch job
+(flask recompute-neighbors) multiplies blocks of rows by the whole matrix
+with SciPy and keeps the top RECOMMENDATION_COUNT neighbors of each row in
+the neighbors table; detail pages read them back in one indexed query. It
+also stores every normalized vector in the neighbor_features table.
+
+After an edit, refresh_neighbors() works from that table instead of the
+whole matrix: it rewrites the edited row's vector and scores the row against
+its candidates only - the rows sharing a feature with it, found through the
+(entity_type, feature, weight) index, at most
+RECOMMENDATION_CANDIDATES_PER_FEATURE per feature (of a common feature,
+the rows it weighs most in), so an edit's cost follows its number of
+features, not the size of its category or region; rows left out catch up
+in the nightly batch job. That gives the row's own top-k, and each
+candidate's list is patched with the new score (it can only push out the
+weakest entry). A row that listed the edited row and no longer surely keeps
+it is rescored the same way. Edits arrive as record_changed events (see
+changes.py); those touching a feature field are queued for a background
+thread, so the request never waits on the refresh.
+"""
+import math
+
+import numpy as np
+from flask import current_app
+from scipy import sparse
+from sqlalchemy import func, select
+from sqlalchemy.orm import aliased, joinedload
+
+from background import BackgroundQueue
+from changes import record_changed
+from models import db, BusinessListing, Neighbor, NeighborFeature, ProfessionalProfile
+from search_index import normalize, parse_skills, tokenize
+
+BUSINESS = 'business'
+PROFESSIONAL = 'professional'
+
+# Feature weights relative to a shared category or skill
+TITLE_WORD_WEIGHT = 0.5
+NEARBY_CELL_WEIGHT = 0.6    # geohash[:5], ~5 km
+REGION_CELL_WEIGHT = 0.4    # geohash[:3], ~150 km
+PLACE_WEIGHT = 0.5          # location text part, for listings without coordinates
+
+# Edited fields that change a row's features (geohash follows location)
+FEATURE_FIELDS = {
+    BUSINESS: frozenset({'category', 'location'}),
+    PROFESSIONAL: frozenset({'skills_json', 'job_title', 'consent_given'}),
+}
+
+# Ids per IN (...) when reading or replacing stored neighbors
+LOOKUP_BATCH_SIZE = 1000
+
+# Length of neighbor_features.feature; longer keys are cut
+FEATURE_KEY_LENGTH = 255
+
+
+def business_features(category, location, geohash):
+    """Feature -> weight for a business listing"""
+    features = {}
+    if category:
+        features[f'category:{normalize(category)}'] = 1.0
+    if geohash:
+        features[f'cell:{geohash[:5]}'] = NEARBY_CELL_WEIGHT
+        features[f'region:{geohash[:3]}'] = REGION_CELL_WEIGHT
+    elif location:
+        for part in location.split(','):
+            part = normalize(part)
+            if part:
+                features[f'place:{part}'] = PLACE_WEIGHT
+    return features
+
+
+def professional_features(skills, job_title):
+    """Feature -> weight for a professional profile"""
+    features = {f'title:{word}': TITLE_WORD_WEIGHT for word in tokenize(job_title)}
+    for skill in skills:
+        skill = normalize(skill)
+        if skill:
+            features[f'skill:{skill}'] = 1.0
+    return features
+
+
+def _feature_query(kind):
+    """(id, feature columns...) of the recommendable rows, via column projections"""
+    if kind == BUSINESS:
+        return db.session.query(BusinessListing.id, BusinessListing.category,
+                                BusinessListing.location, BusinessListing.geohash)
+    return db.session.query(ProfessionalProfile.id, ProfessionalProfile.skills_json,
+                            ProfessionalProfile.job_title).filter(
+        ProfessionalProfile.consent_given.is_(True))
+
+
+def _features(kind, columns):
+    """Feature -> weight for the feature columns of one row"""
+    if kind == BUSINESS:
+        features = business_features(*columns)
+    else:
+        skills_json, job_title = columns
+        features = professional_features(parse_skills(skills_json), job_title)
+    return {feature[:FEATURE_KEY_LENGTH]: weight for feature, weight in features.items()}
+
+
+def _feature_rows(kind):
+    """(id, features) of every recommendable row"""
+    for id, *columns in _feature_query(kind).yield_per(1000):
+        yield id, _features(kind, columns)
+
+
+def _current_vector(kind, id):
+    """L2-normalized features of one row, or None if it is gone or hidden"""
+    model = BusinessListing if kind == BUSINESS else ProfessionalProfile
+    row = _feature_query(kind).filter(model.id == id).first()
+    if row is None:
+        return None
+    features = _features(kind, row[1:])
+    norm = math.sqrt(sum(weight * weight for weight in features.values())) or 1
+    return {feature: weight / norm for feature, weight in features.items()}
+
+
+def feature_matrix(kind):
+    """
+    Sparse matrix with one L2-normalized row per recommendable entity
+    Returns: (CSR matrix, numpy array of entity ids in row order, feature of each column)
+    """
+    vocabulary = {}
+    ids, indptr, indices, data = [], [0], [], []
+    for id, features in _feature_rows(kind):
+        ids.append(id)
+        for feature, weight in features.items():
+            indices.append(vocabulary.setdefault(feature, len(vocabulary)))
+            data.append(weight)
+        indptr.append(len(indices))
+
+    matrix = sparse.csr_matrix(
+        (np.array(data, dtype=np.float32), np.array(indices, dtype=np.int32), np.array(indptr)),
+        shape=(len(ids), max(1, len(vocabulary))))
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return (matrix.multiply(1 / norms[:, None]).tocsr(), np.array(ids, dtype=np.int64),
+            list(vocabulary))
+
+
+def _top_k(similarities, row_positions, ids, k):
+    """
+    Best k other entities per row of a (block x all) similarity matrix
+    Returns: {entity id: [(neighbor id, score), ...] best first}
+    """
+    similarities = similarities.tocsr()
+    neighbors = {}
+    for block_row, position in enumerate(row_positions):
+        start, end = similarities.indptr[block_row], similarities.indptr[block_row + 1]
+        columns = similarities.indices[start:end]
+        scores = similarities.data[start:end]
+        keep = (columns != position) & (scores > 0)
+        columns, scores = columns[keep], scores[keep]
+        if len(scores) > k:
+            best = np.argpartition(-scores, k - 1)[:k]
+            columns, scores = columns[best], scores[best]
+        # Ties go to the older row, so results are stable between runs
+        order = np.lexsort((ids[columns], -scores))
+        neighbors[int(ids[position])] = [(int(ids[columns[i]]), float(scores[i])) for i in order]
+    return neighbors
+
+
+def _store(kind, neighbors):
+    """Replace the stored neighbors of the given entities"""
+    table = Neighbor.__table__
+    db.session.execute(table.delete().where(
+        table.c.entity_type == kind, table.c.entity_id.in_(list(neighbors))))
+    rows = [{'entity_type': kind, 'entity_id': entity_id, 'rank': rank,
+             'neighbor_id': neighbor_id, 'score': score}
+            for entity_id, ranked in neighbors.items()
+            for rank, (neighbor_id, score) in enumerate(ranked)]
+    if rows:
+        db.session.execute(table.insert(), rows)
+
+
+def _store_vectors(kind, vectors):
+    """Replace the stored feature vectors of the given entities"""
+    table = NeighborFeature.__table__
+    db.session.execute(table.delete().where(
+        table.c.entity_type == kind, table.c.entity_id.in_(list(vectors))))
+    rows = [{'entity_type': kind, 'entity_id': entity_id, 'feature': feature, 'weight': weight}
+            for entity_id, vector in vectors.items()
+            for feature, weight in vector.items()]
+    if rows:
+        db.session.execute(table.insert(), rows)
+
+
+def _block_vectors(matrix, ids, features, block):
+    """{entity id: {feature: weight}} of the matrix rows at block"""
+    vectors = {}
+    for position in block:
+        start, end = matrix.indptr[position], matrix.indptr[position + 1]
+        vectors[int(ids[position])] = {
+            features[column]: float(weight)
+            for column, weight in zip(matrix.indices[start:end], matrix.data[start:end])}
+    return vectors
+
+
+def _drop_unlisted(kind):
+    """Remove stored neighbors and vectors of every unlisted entity"""
+    model = BusinessListing if kind == BUSINESS else ProfessionalProfile
+    listed = select(model.id)
+    if kind == PROFESSIONAL:
+        listed = listed.where(model.consent_given.is_(True))
+    for table in (Neighbor.__table__, NeighborFeature.__table__):
+        db.session.execute(table.delete().where(
+            table.c.entity_type == kind, table.c.entity_id.not_in(listed)))
+
+
+def recompute_neighbors():
+    """
+    Recompute the nearest neighbors of every listing and visible profile
+    Returns: (businesses updated, profiles updated)
+    """
+    k = current_app.config['RECOMMENDATION_COUNT']
+    batch_size = current_app.config['RECOMMENDATION_BATCH_SIZE']
+    counts = []
+    for kind in (BUSINESS, PROFESSIONAL):
+        matrix, ids, features = feature_matrix(kind)
+        for start in range(0, len(ids), batch_size):
+            block = np.arange(start, min(start + batch_size, len(ids)))
+            _store(kind, _top_k(matrix[block] @ matrix.T, block, ids, k))
+            _store_vectors(kind, _block_vectors(matrix, ids, features, block))
+            db.session.commit()
+        _drop_unlisted(kind)
+        db.session.commit()
+        counts.append(len(ids))
+    return tuple(counts)
+
+
+def _candidates(kind, id, limit):
+    """
+    Rows sharing a stored feature with a row, at most `limit` per feature
+    Of a common feature (a big category, region or title word) only the rows
+    it weighs most in are taken: those it adds the most similarity to.
+    """
+    features = NeighborFeature.__table__
+    candidates = set()
+    shared = db.session.execute(select(features.c.feature).where(
+        features.c.entity_type == kind, features.c.entity_id == id)).scalars().all()
+    for feature in shared:
+        candidates.update(db.session.execute(
+            select(features.c.entity_id).where(
+                features.c.entity_type == kind, features.c.feature == feature
+            ).order_by(features.c.weight.desc(), features.c.entity_id).limit(limit)).scalars())
+    candidates.discard(id)
+    return candidates
+
+
+def _scores(kind, id, others=None):
+    """
+    Cosine similarity of a row to other rows, by default its candidates
+    Returns: {other id: score} of the rows it shares a feature with
+    """
+    if others is None:
+        others = _candidates(kind, id, current_app.config['RECOMMENDATION_CANDIDATES_PER_FEATURE'])
+    others = sorted(others)
+    mine, theirs = aliased(NeighborFeature), aliased(NeighborFeature)
+    scores = {}
+    for start in range(0, len(others), LOOKUP_BATCH_SIZE):
+        rows = db.session.execute(
+            select(theirs.entity_id, func.sum(mine.weight * theirs.weight))
+            .select_from(mine)
+            .join(theirs, (theirs.entity_type == mine.entity_type) & (theirs.feature == mine.feature))
+            .where(mine.entity_type == kind, mine.entity_id == id,
+                   theirs.entity_id.in_(others[start:start + LOOKUP_BATCH_SIZE]))
+            .group_by(theirs.entity_id))
+        scores.update((other, score) for other, score in rows if score > 0)
+    return scores
+
+
+def _ranked(scores, k):
+    """Best k (id, score) pairs; ties go to the older row, as in the batch job"""
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+
+
+def _stored_neighbors(kind, ids):
+    """{entity id: [(neighbor id, score), ...] best first} of the given ids"""
+    table = Neighbor.__table__
+    stored = {id: [] for id in ids}
+    for start in range(0, len(ids), LOOKUP_BATCH_SIZE):
+        rows = db.session.execute(
+            select(table.c.entity_id, table.c.neighbor_id, table.c.score).where(
+                table.c.entity_type == kind,
+                table.c.entity_id.in_(ids[start:start + LOOKUP_BATCH_SIZE])
+            ).order_by(table.c.entity_id, table.c.rank))
+        for entity_id, neighbor_id, score in rows:
+            stored[entity_id].append((neighbor_id, score))
+    return stored
+
+
+def _refresh_one(kind, id, k):
+    """Update the stored vector of one row and every neighbor list its change can affect"""
+    vector = _current_vector(kind, id)
+    _store_vectors(kind, {id: vector or {}})
+    table = Neighbor.__table__
+    listing = set(db.session.execute(select(table.c.entity_id).where(
+        table.c.entity_type == kind, table.c.neighbor_id == id)).scalars()) - {id}
+    scores = {}
+    if vector:
+        scores = _scores(kind, id)
+        # Rows listing this one that aren't among its candidates still need its new score
+        scores.update(_scores(kind, id, listing.difference(scores)))
+    updated = {id: _ranked(scores, k)}
+
+    others = sorted(listing.union(scores))
+    for other, ranked in _stored_neighbors(kind, others).items():
+        score = scores.get(other, 0)
+        listed = any(neighbor_id == id for neighbor_id, _ in ranked)
+        # A full list dropped its (k+1)th best, which may now beat this row: rescore it
+        if listed and len(ranked) >= k and (-score, id) > max((-s, n) for n, s in ranked):
+            new = _ranked(_scores(kind, other), k)
+        else:
+            merged = {neighbor_id: s for neighbor_id, s in ranked if neighbor_id != id}
+            if score > 0:
+                merged[id] = score
+            new = _ranked(merged, k)
+        if new != ranked:
+            updated[other] = new
+
+    entity_ids = list(updated)
+    for start in range(0, len(entity_ids), LOOKUP_BATCH_SIZE):
+        _store(kind, {entity_id: updated[entity_id]
+                      for entity_id in entity_ids[start:start + LOOKUP_BATCH_SIZE]})
+    return len(updated)
+
+
+def refresh_neighbors(kind, changed_ids):
+    """
+    Bring stored neighbors up to date after the given rows were created, edited or hidden
+    Each row is scored against its candidates only, and committed on its own.
+    Returns: number of neighbor lists rewritten
+    """
+    k = current_app.config['RECOMMENDATION_COUNT']
+    updated = 0
+    for id in sorted(set(changed_ids)):
+        updated += _refresh_one(kind, id, k)
+        db.session.commit()
+    return updated
+
+
+class NeighborRefreshQueue(BackgroundQueue):
+    """Background worker running refresh_neighbors() for edited rows"""
+    name = 'neighbor-refresh'
+
+    def put(self, kind, ids):
+        """Queue a refresh of the given rows"""
+        return self.enqueue((kind, id) for id in ids)
+
+    def process(self, items):
+        # Several edits of one row in a burst need one refresh
+        by_kind = {}
+        for kind, id in items:
+            by_kind.setdefault(kind, set()).add(id)
+        for kind, ids in by_kind.items():
+            try:
+                refresh_neighbors(kind, ids)
+            except Exception as e:
+                db.session.rollback()
+                current_app.logger.warning(f"Failed to refresh {kind} recommendations: {e}")
+
+
+neighbor_refresh = NeighborRefreshQueue()
+
+
+@record_changed.connect
+def _refresh_changed(kind, id, changes):
+    """Queue a recommendations refresh after an edit to a feature field"""
+    if FEATURE_FIELDS[kind].intersection(changes):
+        neighbor_refresh.put(kind, [id])
+
+
+def forget_neighbors(kind, ids):
+    """Drop stored neighbors of, and pointing at, rows deleted outside refresh_neighbors()"""
+    table = Neighbor.__table__
+    ids = list(ids)
+    db.session.execute(table.delete().where(table.c.entity_type == kind).where(
+        table.c.entity_id.in_(ids) | table.c.neighbor_id.in_(ids)))
+    features = NeighborFeature.__table__
+    db.session.execute(features.delete().where(
+        features.c.entity_type == kind, features.c.entity_id.in_(ids)))
+
+
+def related_businesses(business_id):
+    """Listings most similar to a listing, best first (one indexed query)"""
+    return BusinessListing.query.join(Neighbor, db.and_(
+        Neighbor.entity_type == BUSINESS, Neighbor.entity_id == business_id,
+        Neighbor.neighbor_id == BusinessListing.id)).order_by(Neighbor.rank).all()
+
+
+def similar_professionals(profile_id):
+    """Visible profiles most similar to a profile, best first (one indexed query)"""
+    return ProfessionalProfile.query.join(Neighbor, db.and_(
+        Neighbor.entity_type == PROFESSIONAL, Neighbor.entity_id == profile_id,
+        Neighbor.neighbor_id == ProfessionalProfile.id)).filter(
+        ProfessionalProfile.consent_given.is_(True)).options(
+        joinedload(ProfessionalProfile.user)).order_by(Neighbor.rank).all()
@@ -0,0 +1,639 @@
+"""
+In-memory search indexes for the business and professional directories
+
+The suggest index is a sorted array of normalized term keys searched with
+bisect, so a prefix lookup costs O(log n) no matter how big the directory gets.
+The trigram indexes give typo-tolerant search where pg_trgm is not available.
+Both are built once per worker and then kept current from committed writes.
+"""
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+
+from flask import current_app
+from flask_sqlalchemy.session import Session
+from sqlalchemy import case, event, false, func, inspect, literal, select, text
+
+from models import db, User, BusinessListing, ProfessionalProfile, record_corrupt_json
+
+# Term kinds returned by /api/suggest for each directory
+SUGGEST_SCOPES = {
+    'businesses': ('business', 'category', 'location'),
+    'professionals': ('name', 'job_title', 'skill'),
+    'locations': ('location',),
+}
+
+_SEP = '\x00'
+
+
+def normalize(text):
+    """Lowercase and collapse whitespace so lookups are case-insensitive"""
+    return ' '.join(str(text).casefold().split())
+
+
+def _word_suffixes(term):
+    """Every suffix of the term that starts at a word boundary"""
+    words = term.split(' ')
+    return [' '.join(words[i:]) for i in range(len(words))]
+
+
+class PrefixIndex:
+    """Prefix lookup over (kind, term) pairs backed by a sorted key array"""
+
+    # Upper bound on keys inspected per lookup, keeps short prefixes cheap
+    MAX_SCAN = 2000
+
+    def __init__(self):
+        self._keys = []      # sorted "<word suffix>\0<kind>\0<term>"
+        self._entries = {}   # key -> [display text, reference count]
+        self._docs = {}      # doc key -> [(kind, display text), ...]
+        self._lock = threading.RLock()
+        self.built_at = None
+
+    def __len__(self):
+        return len(self._keys)
+
+    @staticmethod
+    def _keys_for(kind, display):
+        term = normalize(display)
+        if not term:
+            return []
+        return [f'{suffix}{_SEP}{kind}{_SEP}{term}' for suffix in _word_suffixes(term)]
+
+    def build(self, docs):
+        """Replace the whole index with (doc key, terms) pairs in one pass"""
+        entries = {}
+        doc_terms = {}
+        for doc_key, terms in docs:
+            terms = list(terms)
+            doc_terms[doc_key] = terms
+            for kind, display in terms:
+                for key in self._keys_for(kind, display):
+                    entry = entries.get(key)
+                    if entry:
+                        entry[1] += 1
+                    else:
+                        entries[key] = [display, 1]
+
+        keys = sorted(entries)
+        with self._lock:
+            self._keys = keys
+            self._entries = entries
+            self._docs = doc_terms
+            self.built_at = time.monotonic()
+
+    def _add_terms(self, terms):
+        for kind, display in terms:
+            for key in self._keys_for(kind, display):
+                entry = self._entries.get(key)
+                if entry:
+                    entry[1] += 1
+                else:
+                    self._entries[key] = [display, 1]
+                    insort(self._keys, key)
+
+    def _remove_terms(self, terms):
+        for kind, display in terms:
+            for key in self._keys_for(kind, display):
+                entry = self._entries.get(key)
+                if not entry:
+                    continue
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    del self._entries[key]
+                    i = bisect_left(self._keys, key)
+                    if i < len(self._keys) and self._keys[i] == key:
+                        del self._keys[i]
+
+    def update(self, doc_key, terms):
+        """Insert or replace the terms of a single document"""
+        terms = [(kind, display) for kind, display in terms if display]
+        with self._lock:
+            old_terms = self._docs.pop(doc_key, None)
+            if old_terms:
+                self._remove_terms(old_terms)
+            if terms:
+                self._docs[doc_key] = terms
+                self._add_terms(terms)
+
+    def remove(self, doc_key):
+        """Drop a document from the index"""
+        self.update(doc_key, [])
+
+    def suggest(self, prefix, kinds=None, limit=8):
+        """
+        Find terms with a word starting with prefix
+        Returns: list of {'text', 'kind'} dicts, whole-term prefix matches first
+        """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+
+        matches = {}
+        with self._lock:
+            keys = self._keys
+            i = bisect_left(keys, prefix)
+            end = min(len(keys), i + self.MAX_SCAN)
+            while i < end and len(matches) < limit * 4:
+                key = keys[i]
+                if not key.startswith(prefix):
+                    break
+                _, kind, term = key.split(_SEP)
+                if (kinds is None or kind in kinds) and (kind, term) not in matches:
+                    matches[(kind, term)] = self._entries[key][0]
+                i += 1
+
+        ranked = sorted(matches.items(),
+                        key=lambda item: (not item[0][1].startswith(prefix), len(item[0][1]), item[0][1]))
+        return [{'text': display, 'kind': kind} for (kind, _), display in ranked[:limit]]
+
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def trigrams(word):
+    """pg_trgm-style trigrams of a single word, padded '  w...d '"""
+    padded = f'  {word} '
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def tokenize(text):
+    """Lowercased words of a text, ignoring single characters"""
+    if not text:
+        return []
+    return [w for w in _WORD_RE.findall(str(text).casefold()) if len(w) > 1]
+
+
+class TrigramIndex:
+    """
+    Typo-tolerant word search, an in-process stand-in for pg_trgm
+
+    Trigrams point at vocabulary words rather than documents, so a lookup
+    costs O(vocabulary hits) and stays flat as the number of rows grows.
+    """
+
+    # Closest vocabulary words considered per query word
+    MAX_EXPANSIONS = 20
+
+    def __init__(self, threshold=0.4, max_candidates=5000):
+        self.threshold = threshold
+        self.max_candidates = max_candidates
+        self._grams = defaultdict(set)       # trigram -> vocabulary words
+        self._word_grams = {}                # word -> its trigrams
+        self._postings = defaultdict(dict)   # word -> {doc key: field weight}
+        self._docs = {}                      # doc key -> {word: field weight}
+        self._lock = threading.RLock()
+        self.built_at = None
+
+    def __len__(self):
+        return len(self._docs)
+
+    @staticmethod
+    def _doc_words(fields):
+        words = {}
+        for text, weight in fields:
+            for word in tokenize(text):
+                if weight > words.get(word, 0):
+                    words[word] = weight
+        return words
+
+    def _add(self, doc_key, words):
+        self._docs[doc_key] = words
+        for word, weight in words.items():
+            if word not in self._word_grams:
+                grams = trigrams(word)
+                self._word_grams[word] = grams
+                for gram in grams:
+                    self._grams[gram].add(word)
+            self._postings[word][doc_key] = weight
+
+    def _remove(self, doc_key):
+        words = self._docs.pop(doc_key, None)
+        if not words:
+            return
+        for word in words:
+            postings = self._postings.get(word)
+            if postings is None:
+                continue
+            postings.pop(doc_key, None)
+            if not postings:
+                del self._postings[word]
+                for gram in self._word_grams.pop(word, ()):
+                    vocab = self._grams.get(gram)
+                    if vocab is not None:
+                        vocab.discard(word)
+                        if not vocab:
+                            del self._grams[gram]
+
+    def build(self, docs):
+        """Replace the whole index with (doc key, [(text, weight), ...]) pairs"""
+        # Built aside and swapped in, so searches use the old index meanwhile
+        fresh = TrigramIndex(self.threshold, self.max_candidates)
+        for doc_key, fields in docs:
+            words = self._doc_words(fields)
+            if words:
+                fresh._add(doc_key, words)
+        with self._lock:
+            self._grams = fresh._grams
+            self._word_grams = fresh._word_grams
+            self._postings = fresh._postings
+            self._docs = fresh._docs
+            self.built_at = time.monotonic()
+
+    def update(self, doc_key, fields):
+        """Insert or replace a single document"""
+        words = self._doc_words(fields)
+        with self._lock:
+            self._remove(doc_key)
+            if words:
+                self._add(doc_key, words)
+
+    def remove(self, doc_key):
+        """Drop a document from the index"""
+        with self._lock:
+            self._remove(doc_key)
+
+    def _similar_words(self, word):
+        """Vocabulary words resembling word, as (word, similarity) best first"""
+        query_grams = trigrams(word)
+        shared = Counter()
+        for gram in query_grams:
+            shared.update(self._grams.get(gram, ()))
+
+        scored = []
+        for candidate, count in shared.items():
+            # Same measure as pg_trgm word_similarity: how much of the query
+            # word is found; Jaccard breaks ties towards closer lengths
+            similarity = count / len(query_grams)
+            if similarity >= self.threshold:
+                jaccard = count / (len(query_grams) + len(self._word_grams[candidate]) - count)
+                scored.append((similarity, jaccard, candidate))
+        scored.sort(reverse=True)
+        return [(candidate, similarity) for similarity, _, candidate in scored[:self.MAX_EXPANSIONS]]
+
+    def search(self, query, limit=200):
+        """
+        Rank documents by fuzzy similarity to the query words
+        Returns: list of (doc key, score) pairs, best first
+        """
+        query_words = list(dict.fromkeys(tokenize(query)))[:8]
+        if not query_words:
+            return []
+
+        best = defaultdict(float)
+        with self._lock:
+            for word in query_words:
+                word_best = {}
+                for candidate, similarity in self._similar_words(word):
+                    for doc_key, weight in self._postings[candidate].items():
+                        if doc_key not in best and len(best) >= self.max_candidates:
+                            continue
+                        score = similarity * weight
+                        if score > word_best.get(doc_key, 0):
+                            word_best[doc_key] = score
+                        best.setdefault(doc_key, 0.0)
+                for doc_key, score in word_best.items():
+                    best[doc_key] += score
+
+        ranked = [(doc_key, total / len(query_words)) for doc_key, total in best.items()]
+        ranked = [item for item in ranked if item[1] >= self.threshold]
+        ranked.sort(key=lambda item: item[1], reverse=True)
+        return ranked[:limit]
+
+
+suggest_index = PrefixIndex()
+fuzzy_business_index = TrigramIndex()
+fuzzy_professional_index = TrigramIndex()
+
+# Field weights for fuzzy ranking: a hit in a name or title beats one in a body
+TITLE_WEIGHT = 1.0
+BODY_WEIGHT = 0.7
+
+
+def parse_skills(skills_json):
+    """Skills from a (decoded) skills_json column value without loading the entity"""
+    if skills_json is None:
+        return []
+    if not isinstance(skills_json, list):
+        record_corrupt_json('professional_profiles.skills_json', skills_json)
+        return []
+    return skills_json
+
+
+def business_snapshot(business):
+    """Indexed fields of a business listing"""
+    return {
+        'business_name': business.business_name,
+        'category': business.category,
+        'location': business.location,
+        'description': business.description,
+    }
+
+
+def professional_snapshot(profile, name=None):
+    """Indexed fields of a professional profile (None unless consented)"""
+    if not profile.consent_given:
+        return None
+    if name is None:
+        name = profile.user.name if profile.user else None
+    return {
+        'name': name,
+        'job_title': profile.job_title,
+        'summary': profile.summary,
+        'skills': profile.get_skills(),
+    }
+
+
+def _suggest_terms(kind, snapshot):
+    if kind == 'business':
+        terms = [('business', snapshot['business_name']),
+                 ('category', snapshot['category']),
+                 ('location', snapshot['location'])]
+    else:
+        terms = [('name', snapshot['name']), ('job_title', snapshot['job_title'])]
+        terms.extend(('skill', skill) for skill in snapshot['skills'])
+    return [(term_kind, display) for term_kind, display in terms if display]
+
+
+def _fuzzy_fields(kind, snapshot):
+    if kind == 'business':
+        return [(snapshot['business_name'], TITLE_WEIGHT),
+                (snapshot['description'], BODY_WEIGHT)]
+    return [(snapshot['name'], TITLE_WEIGHT),
+            (snapshot['job_title'], TITLE_WEIGHT),
+            (snapshot['summary'], BODY_WEIGHT)]
+
+
+def _fuzzy_index_for(kind):
+    return fuzzy_business_index if kind == 'business' else fuzzy_professional_index
+
+
+_pg_trgm_available = None
+
+
+def use_pg_trgm():
+    """Check whether fuzzy search can run in PostgreSQL via pg_trgm"""
+    global _pg_trgm_available
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    if _pg_trgm_available is None:
+        _pg_trgm_available = db.session.execute(
+            text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first() is not None
+    return _pg_trgm_available
+
+
+def _snapshots():
+    """Indexed fields of every listing and visible profile, via column projections"""
+    businesses = db.session.query(
+        BusinessListing.id, BusinessListing.business_name, BusinessListing.category,
+        BusinessListing.location, BusinessListing.description)
+    for id, business_name, category, location, description in businesses.yield_per(1000):
+        yield ('business', id), {
+            'business_name': business_name,
+            'category': category,
+            'location': location,
+            'description': description,
+        }
+
+    profiles = db.session.query(
+        ProfessionalProfile.id, User.name, ProfessionalProfile.job_title,
+        ProfessionalProfile.summary, ProfessionalProfile.skills_json
+    ).join(User).filter(ProfessionalProfile.consent_given.is_(True))
+    for id, name, job_title, summary, skills_json in profiles.yield_per(1000):
+        yield ('professional', id), {
+            'name': name,
+            'job_title': job_title,
+            'summary': summary,
+            'skills': parse_skills(skills_json),
+        }
+
+
+# Held while the indexes are (re)built, so only one build runs at a time
+_build_lock = threading.Lock()
+# Guards _rebuild_backlog and the application of committed changes
+_changes_lock = threading.Lock()
+# Changes committed while a rebuild runs, applied again once it is swapped in
+_rebuild_backlog = None
+
+
+def rebuild_search_indexes():
+    """
+    Rebuild the in-memory indexes from the database in a single pass
+    The current indexes keep serving until the new ones are swapped in;
+    changes committed in this worker meanwhile are then applied on top.
+    """
+    global _rebuild_backlog
+    with _changes_lock:
+        _rebuild_backlog = []
+    try:
+        _build_indexes()
+    finally:
+        with _changes_lock:
+            backlog, _rebuild_backlog = _rebuild_backlog, None
+            _apply_documents(backlog)
+
+
+def _build_indexes():
+    snapshots = list(_snapshots())
+    suggest_index.build(
+        (doc_key, _suggest_terms(doc_key[0], snapshot)) for doc_key, snapshot in snapshots)
+
+    # On PostgreSQL with pg_trgm the fuzzy search runs in the database
+    if not use_pg_trgm():
+        threshold = current_app.config['FUZZY_SEARCH_THRESHOLD']
+        for kind, index in (('business', fuzzy_business_index),
+                            ('professional', fuzzy_professional_index)):
+            index.threshold = threshold
+            index.build((doc_key, _fuzzy_fields(kind, snapshot))
+                        for doc_key, snapshot in snapshots if doc_key[0] == kind)
+
+
+def _rebuild_in_background():
+    """Start a rebuild in a background thread, unless one is already running"""
+    if not _build_lock.acquire(blocking=False):
+        return
+    app = current_app._get_current_object()
+
+    def run():
+        try:
+            with app.app_context():
+                try:
+                    rebuild_search_indexes()
+                except Exception as e:
+                    app.logger.warning(f"Search index rebuild failed: {e}")
+                finally:
+                    db.session.remove()
+        finally:
+            _build_lock.release()
+
+    threading.Thread(target=run, name='search-index-rebuild', daemon=True).start()
+
+
+def ensure_search_indexes():
+    """
+    Build the indexes on first use, and rebuild them once they are too old
+    Writes are applied incrementally in the worker that commits them; the
+    periodic rebuild picks up writes made through other workers. The first
+    build runs once while concurrent requests wait for it; later rebuilds
+    run in the background and requests keep using the current indexes.
+    """
+    max_age = current_app.config['SEARCH_INDEX_MAX_AGE']
+    built_at = suggest_index.built_at
+    if built_at is None:
+        with _build_lock:
+            if suggest_index.built_at is None:
+                rebuild_search_indexes()
+    elif max_age and time.monotonic() - built_at > max_age:
+        _rebuild_in_background()
+
+
+def ensure_suggest_index():
+    """Return the suggest index, building it if needed"""
+    ensure_search_indexes()
+    return suggest_index
+
+
+def _order_by_rank(column, ids):
+    """ORDER BY clause keeping the rows in the given id order"""
+    return case({id: position for position, id in enumerate(ids)}, value=column)
+
+
+def _set_word_similarity_threshold(model):
+    """
+    Set the <% threshold for this transaction on the connection the fuzzy query will use
+    A bare text() statement would go to the primary, while the query itself
+    may be served by a read replica (see db_routing.py).
+    """
+    bind = db.session.get_bind(clause=select(model.id))
+    db.session.execute(
+        text("SELECT set_config('pg_trgm.word_similarity_threshold', :t, true)"),
+        {'t': str(current_app.config['FUZZY_SEARCH_THRESHOLD'])},
+        bind_arguments={'bind': bind})
+
+
+def fuzzy_search_businesses(query, search):
+    """Restrict a BusinessListing query to fuzzy matches, best first"""
+    if use_pg_trgm():
+        # <% is pg_trgm's word-similarity operator, served by the GIN indexes
+        _set_word_similarity_threshold(BusinessListing)
+        term = literal(search)
+        score = func.greatest(
+            func.word_similarity(term, BusinessListing.business_name),
+            func.word_similarity(term, func.coalesce(BusinessListing.description, '')) * BODY_WEIGHT)
+        return query.filter(
+            term.op('<%')(BusinessListing.business_name) |
+            term.op('<%')(BusinessListing.description)
+        ).order_by(score.desc())
+
+    ensure_search_indexes()
+    ids = [doc_key[1] for doc_key, _ in fuzzy_business_index.search(
+        search, current_app.config['FUZZY_SEARCH_LIMIT'])]
+    if not ids:
+        return query.filter(false())
+    return query.filter(BusinessListing.id.in_(ids)).order_by(
+        _order_by_rank(BusinessListing.id, ids))
+
+
+def fuzzy_search_professionals(query, search):
+    """Restrict a ProfessionalProfile query (joined to User) to fuzzy matches, best first"""
+    if use_pg_trgm():
+        _set_word_similarity_threshold(ProfessionalProfile)
+        term = literal(search)
+        score = func.greatest(
+            func.word_similarity(term, User.name),
+            func.word_similarity(term, ProfessionalProfile.job_title),
+            func.word_similarity(term, func.coalesce(ProfessionalProfile.summary, '')) * BODY_WEIGHT)
+        return query.filter(
+            term.op('<%')(User.name) |
+            term.op('<%')(ProfessionalProfile.job_title) |
+            term.op('<%')(ProfessionalProfile.summary)
+        ).order_by(score.desc())
+
+    ensure_search_indexes()
+    ids = [doc_key[1] for doc_key, _ in fuzzy_professional_index.search(
+        search, current_app.config['FUZZY_SEARCH_LIMIT'])]
+    if not ids:
+        return query.filter(false())
+    return query.filter(ProfessionalProfile.id.in_(ids)).order_by(
+        _order_by_rank(ProfessionalProfile.id, ids))
+
+
+# Keep the indexes in step with committed writes. Fields are captured in
+# after_flush, while attributes are still loaded, and applied after commit.
+
+def _pending(session):
+    return session.info.setdefault('search_index_pending', {})
+
+
+def _changed(obj, *attrs):
+    """Check whether any of the indexed attributes were modified"""
+    state = inspect(obj)
+    return any(state.attrs[attr].history.has_changes() for attr in attrs)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_index_changes(session, flush_context):
+    pending = _pending(session)
+    for obj in session.new:
+        if isinstance(obj, BusinessListing):
+            pending[('business', obj.id)] = business_snapshot(obj)
+        elif isinstance(obj, ProfessionalProfile):
+            pending[('professional', obj.id)] = professional_snapshot(obj)
+
+    # View counter bumps and theme changes don't touch any indexed column
+    for obj in session.dirty:
+        if isinstance(obj, BusinessListing):
+            if _changed(obj, 'business_name', 'category', 'location', 'description'):
+                pending[('business', obj.id)] = business_snapshot(obj)
+        elif isinstance(obj, ProfessionalProfile):
+            if _changed(obj, 'job_title', 'summary', 'skills_json', 'consent_given'):
+                pending[('professional', obj.id)] = professional_snapshot(obj)
+        elif isinstance(obj, User) and _changed(obj, 'name') and obj.professional_profile:
+            profile = obj.professional_profile
+            pending[('professional', profile.id)] = professional_snapshot(profile, name=obj.name)
+
+    for obj in session.deleted:
+        if isinstance(obj, BusinessListing):
+            pending[('business', obj.id)] = None
+        elif isinstance(obj, ProfessionalProfile):
+            pending[('professional', obj.id)] = None
+
+
+def forget_documents(session, kind, ids):
+    """Drop rows deleted outside the unit of work (bulk/cascading deletes) at commit"""
+    pending = _pending(session)
+    for id in ids:
+        pending[(kind, id)] = None
+
+
+def _apply_documents(changes):
+    """Apply (doc key, snapshot or None) changes to built indexes"""
+    if suggest_index.built_at is None:
+        return
+    for doc_key, snapshot in changes:
+        fuzzy_index = _fuzzy_index_for(doc_key[0])
+        if snapshot is None:
+            suggest_index.remove(doc_key)
+            fuzzy_index.remove(doc_key)
+        else:
+            suggest_index.update(doc_key, _suggest_terms(doc_key[0], snapshot))
+            if fuzzy_index.built_at is not None:
+                fuzzy_index.update(doc_key, _fuzzy_fields(doc_key[0], snapshot))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_index_changes(session):
+    pending = session.info.pop('search_index_pending', None)
+    if not pending:
+        return
+    with _changes_lock:
+        if _rebuild_backlog is not None:
+            _rebuild_backlog.extend(pending.items())
+        _apply_documents(pending.items())
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_index_changes(session):
+    session.info.pop('search_index_pending', None)
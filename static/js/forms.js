@@ -304,8 +304,8 @@ document.addEventListener('DOMContentLoaded', function() {
 });
 
 // Keyframe for slide up animation
-const style = document.createElement('style');
-style.textContent = `
+const slideUpStyle = document.createElement('style');
+slideUpStyle.textContent = `
     @keyframes slideUp {
         from {
             opacity: 1;
@@ -317,4 +317,4 @@ style.textContent = `
         }
     }
 `;
-document.head.appendChild(style);
+document.head.appendChild(slideUpStyle);
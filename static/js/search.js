@@ -1,12 +1,13 @@
 // Search and Filter functionality for Business and Professional Directories
+// Filtering happens on the server; typing only asks /api/suggest for completions.
 
 class DirectorySearch {
-    constructor(containerSelector, resultsSelector, searchInputSelector, filterSelectors) {
+    constructor(containerSelector, formSelector, searchInputSelector, filterSelectors) {
         this.container = document.querySelector(containerSelector);
-        this.resultsContainer = document.querySelector(resultsSelector);
+        this.form = document.querySelector(formSelector);
         this.searchInput = document.querySelector(searchInputSelector);
         this.filters = {};
-        
+
         // Initialize filter elements
         filterSelectors.forEach(selector => {
             const element = document.querySelector(selector);
@@ -15,216 +16,184 @@ class DirectorySearch {
                 this.filters[filterName] = element;
             }
         });
-        
-        this.debounceTimer = null;
+
         this.init();
     }
-    
+
     init() {
-        if (!this.container) return;
-        
-        // Add event listeners
-        if (this.searchInput) {
-            this.searchInput.addEventListener('input', () => this.handleSearchInput());
-        }
-        
+        if (!this.container || !this.form) return;
+
+        // Dropdown filters apply immediately; text inputs on Enter / suggestion pick
         Object.values(this.filters).forEach(filter => {
-            filter.addEventListener('change', () => this.handleFilterChange());
-        });
-        
-        // Store original results for filtering
-        this.storeOriginalResults();
-    }
-    
-    storeOriginalResults() {
-        const items = this.resultsContainer.querySelectorAll('.business-card, .professional-card');
-        this.originalResults = Array.from(items).map(item => ({
-            element: item,
-            text: item.textContent.toLowerCase(),
-            category: item.dataset.category?.toLowerCase() || '',
-            location: item.dataset.location?.toLowerCase() || '',
-            skills: item.dataset.skills?.toLowerCase() || '',
-            role: item.dataset.role?.toLowerCase() || ''
-        }));
-    }
-    
-    handleSearchInput() {
-        clearTimeout(this.debounceTimer);
-        this.debounceTimer = setTimeout(() => {
-            this.filterResults();
-        }, 300); // Debounce for 300ms
-    }
-    
-    handleFilterChange() {
-        this.filterResults();
-    }
-    
-    filterResults() {
-        const searchTerm = this.searchInput?.value.toLowerCase() || '';
-        const filterValues = {};
-        
-        Object.entries(this.filters).forEach(([name, element]) => {
-            filterValues[name] = element.value.toLowerCase();
-        });
-        
-        let visibleCount = 0;
-        
-        this.originalResults.forEach(result => {
-            let visible = true;
-            
-            // Search term filter
-            if (searchTerm && !result.text.includes(searchTerm)) {
-                visible = false;
-            }
-            
-            // Category filter (for businesses)
-            if (filterValues.category && filterValues.category !== '' && 
-                result.category !== filterValues.category) {
-                visible = false;
-            }
-            
-            // Location filter (for businesses)
-            if (filterValues.location && filterValues.location !== '' && 
-                !result.location.includes(filterValues.location)) {
-                visible = false;
-            }
-            
-            // Skill filter (for professionals)
-            if (filterValues.skill && filterValues.skill !== '' && 
-                !result.skills.includes(filterValues.skill)) {
-                visible = false;
-            }
-            
-            // Show/hide element
-            if (visible) {
-                result.element.style.display = '';
-                visibleCount++;
-            } else {
-                result.element.style.display = 'none';
+            if (filter.tagName === 'SELECT') {
+                filter.addEventListener('change', () => this.submit());
             }
         });
-        
-        // Update results count
-        this.updateResultsCount(visibleCount);
-        
-        // Show/hide no results message
-        this.toggleNoResults(visibleCount === 0);
     }
-    
-    updateResultsCount(count) {
-        const resultsInfo = document.querySelector('.results-info');
-        if (resultsInfo) {
-            const plural = count !== 1 ? 's' : '';
-            const type = this.container.classList.contains('professionals-page') ? 
-                'professional' : 'business';
-            resultsInfo.querySelector('p').textContent = 
-                `Found ${count} ${type}${count !== 1 ? 'es' : ''}`;
-        }
-    }
-    
-    toggleNoResults(show) {
-        let noResults = this.resultsContainer.querySelector('.no-results-instant');
-        
-        if (show) {
-            if (!noResults) {
-                noResults = document.createElement('div');
-                noResults.className = 'no-results no-results-instant';
-                noResults.innerHTML = `
-                    <h3>No results found</h3>
-                    <p>Try adjusting your search criteria</p>
-                `;
-                this.resultsContainer.appendChild(noResults);
-            }
-            noResults.style.display = 'block';
-        } else if (noResults) {
-            noResults.style.display = 'none';
+
+    submit() {
+        if (typeof this.form.requestSubmit === 'function') {
+            this.form.requestSubmit();
+        } else {
+            this.form.submit();
         }
     }
-    
+
     clearFilters() {
         if (this.searchInput) {
             this.searchInput.value = '';
         }
-        
+
         Object.values(this.filters).forEach(filter => {
             filter.value = '';
         });
-        
-        this.filterResults();
+
+        this.submit();
     }
 }
 
-// Auto-complete functionality for search inputs
+// Auto-complete backed by the server-side prefix index.
+// options.fields maps a suggestion kind to the filter input it belongs in
+// (e.g. { category: '#category-filter' }); other picks fill the input itself.
 class SearchAutocomplete {
-    constructor(inputSelector, suggestionsData) {
+    constructor(inputSelector, options = {}) {
         this.input = document.querySelector(inputSelector);
-        this.suggestions = suggestionsData;
+        this.endpoint = options.endpoint || '/api/suggest';
+        this.scope = options.scope || '';
+        this.limit = options.limit || 8;
+        this.minLength = options.minLength || 2;
+        this.onSelect = options.onSelect || null;
+        this.fields = options.fields || {};
         this.suggestionsList = null;
+        this.debounceTimer = null;
+        this.controller = null;
+        this.cache = new Map();
         this.init();
     }
-    
+
     init() {
         if (!this.input) return;
-        
+
         // Create suggestions container
         this.suggestionsList = document.createElement('div');
         this.suggestionsList.className = 'search-suggestions';
         this.input.parentElement.appendChild(this.suggestionsList);
-        
+
         // Add event listeners
-        this.input.addEventListener('input', (e) => this.handleInput(e));
+        this.input.addEventListener('input', () => this.handleInput());
         this.input.addEventListener('blur', () => {
             setTimeout(() => this.hideSuggestions(), 200);
         });
-        
+
         document.addEventListener('click', (e) => {
             if (!this.input.contains(e.target)) {
                 this.hideSuggestions();
             }
         });
     }
-    
-    handleInput(e) {
-        const value = e.target.value.toLowerCase();
-        
-        if (value.length < 2) {
+
+    handleInput() {
+        clearTimeout(this.debounceTimer);
+        this.debounceTimer = setTimeout(() => this.fetchSuggestions(), 150); // Debounce for 150ms
+    }
+
+    async fetchSuggestions() {
+        const value = this.input.value.trim().toLowerCase();
+
+        if (value.length < this.minLength) {
             this.hideSuggestions();
             return;
         }
-        
-        const matches = this.suggestions.filter(item => 
-            item.toLowerCase().includes(value)
-        ).slice(0, 5);
-        
+
+        if (this.cache.has(value)) {
+            this.render(this.cache.get(value));
+            return;
+        }
+
+        // Drop the response of any keystroke we have already typed past
+        if (this.controller) {
+            this.controller.abort();
+        }
+        this.controller = new AbortController();
+
+        const params = new URLSearchParams({ q: value, limit: this.limit });
+        if (this.scope) params.set('scope', this.scope);
+
+        try {
+            const response = await fetch(`${this.endpoint}?${params}`, {
+                signal: this.controller.signal,
+                headers: { 'Accept': 'application/json' }
+            });
+            if (!response.ok) return;
+
+            const data = await response.json();
+            const matches = data.suggestions;
+            this.cache.set(value, matches);
+            this.render(matches);
+        } catch (error) {
+            if (error.name !== 'AbortError') {
+                console.error('Suggest request failed:', error);
+            }
+        }
+    }
+
+    render(matches) {
         if (matches.length > 0) {
             this.showSuggestions(matches);
         } else {
             this.hideSuggestions();
         }
     }
-    
+
     showSuggestions(matches) {
-        this.suggestionsList.innerHTML = matches.map(match => 
-            `<div class="suggestion-item">${this.highlightMatch(match, this.input.value)}</div>`
+        this.suggestionsList.innerHTML = matches.map(match =>
+            `<div class="suggestion-item">${this.highlightMatch(match.text, this.input.value)}</div>`
         ).join('');
-        
+
         this.suggestionsList.style.display = 'block';
-        
+
         // Add click handlers
         this.suggestionsList.querySelectorAll('.suggestion-item').forEach((item, index) => {
-            item.addEventListener('click', () => {
-                this.input.value = matches[index];
-                this.hideSuggestions();
-                this.input.dispatchEvent(new Event('input'));
-            });
+            item.addEventListener('click', () => this.select(matches[index]));
         });
     }
-    
+
+    select(match) {
+        // A category/location/skill pick goes to its filter, not the text search
+        const field = this.fields[match.kind] ? document.querySelector(this.fields[match.kind]) : null;
+        if (field && field !== this.input) {
+            this.setFieldValue(field, match.text);
+            this.input.value = '';
+        } else {
+            this.input.value = match.text;
+        }
+        this.hideSuggestions();
+        if (this.onSelect) {
+            this.onSelect(match);
+        }
+    }
+
+    setFieldValue(field, value) {
+        if (field.tagName === 'SELECT' && !Array.from(field.options).some(option => option.value === value)) {
+            field.add(new Option(value, value));
+        }
+        field.value = value;
+    }
+
+    escapeHtml(text) {
+        const div = document.createElement('div');
+        div.textContent = text;
+        return div.innerHTML;
+    }
+
     highlightMatch(text, query) {
-        const regex = new RegExp(`(${query})`, 'gi');
-        return text.replace(regex, '<strong>$1</strong>');
+        const safeText = this.escapeHtml(text);
+        const pattern = query.trim().replace(/[.*+?^${}()|[\]\\]/g, '\\$&');
+        if (!pattern) return safeText;
+        const regex = new RegExp(`(${this.escapeHtml(pattern)})`, 'gi');
+        return safeText.replace(regex, '<strong>$1</strong>');
     }
-    
+
     hideSuggestions() {
         this.suggestionsList.style.display = 'none';
     }
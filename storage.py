@@ -0,0 +1,410 @@
+"""
+Image uploads that survive a slow or failing Cloudinary
+
+upload_image() gives every Cloudinary call a deadline (UPLOAD_DEADLINE
+seconds for connect + send + response) and runs it behind a circuit breaker.
+After UPLOAD_BREAKER_THRESHOLD consecutive failures the breaker opens and
+uploads skip Cloudinary entirely for UPLOAD_BREAKER_RESET seconds; then a
+single trial upload decides whether it closes again. An upload that fails,
+or arrives while the breaker is open, is stored in the database
+(pending_uploads, committed with the listing that uses it) and served by the
+app at /uploads/, so saving a listing never waits on an outage and every
+instance can serve the image.
+
+Once Cloudinary accepts uploads again, a background thread on any instance
+re-uploads the pending images, points their listings at the Cloudinary URLs
+and deletes the pending rows (flask resync-uploads does the same on demand).
+
+For local testing, run_cloudinary_stub() (flask cloudinary-stub) stands in
+for the upload API with configurable latency and error rate; point
+CLOUDINARY_UPLOAD_PREFIX at it.
+"""
+import io
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cloudinary.exceptions
+from flask import Response, abort, current_app
+from sqlalchemy import select
+from urllib3 import Timeout
+
+from models import db, BusinessListing, PendingUpload
+from utils import (cloudinary_upload, delete_image_from_cloudinary, extract_public_id_from_url,
+                   validate_image)
+
+LOCAL_URL_PREFIX = '/uploads/'
+
+# Client error statuses that mean the service (not the image) is the problem:
+# rate limiting; any 5xx, or no reply at all, counts as an outage too
+TRANSIENT_CLIENT_ERRORS = (420, 429)
+
+# Content type served for each allowed image extension; the client's claimed
+# type is never stored, so nothing but an image is served from our origin
+IMAGE_TYPES = {
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'gif': 'image/gif',
+    'webp': 'image/webp',
+}
+
+# Browser cache lifetime of a pending upload; resync then gives the listing a new URL
+LOCAL_MAX_AGE = 3600
+
+# Seconds between checks for pending uploads (from any host) after successful uploads
+RESYNC_CHECK_INTERVAL = 60
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker:
+    """Stops calling a failing service after consecutive failures, retrying after a pause"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Check whether a call may go out now (at most one trial while half-open)"""
+        with self._lock:
+            if self.state == OPEN and self.clock() - self._opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        """A call succeeded; returns True if this closed the breaker"""
+        with self._lock:
+            recovered = self.state != CLOSED
+            self.state = CLOSED
+            self.failures = 0
+            self._trial_running = False
+            return recovered
+
+    def record_failure(self):
+        """A call failed; returns True if this opened the breaker"""
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                opened = self.state != OPEN
+                self.state = OPEN
+                self._opened_at = self.clock()
+                return opened
+            return False
+
+
+def image_type(filename):
+    """Image content type for a file name's extension, or None if it is not an image we serve"""
+    extension = os.path.splitext(filename or '')[1].lower().lstrip('.')
+    if extension not in current_app.config['ALLOWED_EXTENSIONS']:
+        return None
+    return IMAGE_TYPES.get(extension)
+
+
+class PendingUploadStore:
+    """Images kept in the database (PendingUpload) while Cloudinary is unavailable"""
+
+    def save(self, file, folder):
+        """
+        Store an uploaded file in the request's transaction
+        The row commits (or rolls back) together with the listing that uses it.
+        Returns: its URL under /uploads/, or None if the file is not an image type we serve
+        """
+        content_type = image_type(file.filename)
+        if content_type is None:
+            return None
+        extension = os.path.splitext(file.filename)[1].lower()
+        path = f'{folder}/{uuid.uuid4().hex}{extension}'
+        file.seek(0)
+        db.session.add(PendingUpload(path=path, content_type=content_type, data=file.read()))
+        return LOCAL_URL_PREFIX + path
+
+    @staticmethod
+    def path_for(url):
+        """Stored path behind a pending upload URL, or None for any other URL"""
+        if not url or not url.startswith(LOCAL_URL_PREFIX):
+            return None
+        return url[len(LOCAL_URL_PREFIX):]
+
+    def load(self, path):
+        """(stored content type, bytes) of a pending upload, or None"""
+        table = PendingUpload.__table__
+        return db.session.execute(select(table.c.content_type, table.c.data).where(
+            table.c.path == path)).first()
+
+    def discard(self, urls):
+        """Delete the pending uploads behind these URLs in the current transaction"""
+        paths = [path for path in map(self.path_for, urls) if path]
+        if paths:
+            table = PendingUpload.__table__
+            db.session.execute(table.delete().where(table.c.path.in_(paths)))
+        return len(paths)
+
+
+def _is_transient(error):
+    """Whether an upload failed because of the service rather than the image"""
+    status = getattr(error, 'http_code', None)
+    if not isinstance(error, cloudinary.exceptions.Error) or status is None:
+        return True
+    return not 400 <= status < 500 or status in TRANSIENT_CLIENT_ERRORS
+
+
+class ImageStorage:
+    """Cloudinary uploads with a deadline and a circuit breaker, falling back to the database"""
+
+    def __init__(self):
+        self.breaker = CircuitBreaker()
+        self.pending = PendingUploadStore()
+        self._app = None
+        self._resync_thread = None
+        self._last_resync = None  # When this process last looked for pending uploads
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        config = app.config
+        self._app = app
+        self.breaker = CircuitBreaker(config['UPLOAD_BREAKER_THRESHOLD'], config['UPLOAD_BREAKER_RESET'])
+        app.add_url_rule(LOCAL_URL_PREFIX + '<path:filename>', 'local_upload', self.serve)
+
+    def _deadline(self):
+        config = current_app.config
+        deadline = config['UPLOAD_DEADLINE']
+        return Timeout(total=deadline, connect=min(config['HTTP_CONNECT_TIMEOUT'], deadline), read=deadline)
+
+    def _to_cloudinary(self, file, folder):
+        """
+        One guarded Cloudinary upload
+        Returns: (url or None, error message or None); url and error are both
+        None when the breaker is open or the service failed
+        """
+        if not self.breaker.allow():
+            return None, None
+        try:
+            url = cloudinary_upload(file, folder, timeout=self._deadline())
+        except Exception as e:
+            if not _is_transient(e):
+                # Cloudinary answered: it's the image, not the service
+                self.breaker.record_success()
+                return None, f"Cloudinary error: {str(e)}"
+            if self.breaker.record_failure():
+                current_app.logger.warning(f"Cloudinary upload circuit opened: {e}")
+            return None, None
+        if self.breaker.record_success():
+            current_app.logger.info('Cloudinary upload circuit closed')
+        return url, None
+
+    def upload_image(self, file, folder='business_logos'):
+        """
+        Upload an image, into the database if Cloudinary is failing
+        Returns: (success, url_or_error)
+        """
+        is_valid, error = validate_image(file)
+        if not is_valid:
+            return False, error
+
+        url, error = self._to_cloudinary(file, folder)
+        if error:
+            return False, error
+        if url:
+            # Any host may have stored uploads during the outage; look now and then
+            if self._last_resync is None or time.monotonic() - self._last_resync > RESYNC_CHECK_INTERVAL:
+                self.start_resync()
+            return True, url
+
+        url = self.pending.save(file, folder)
+        if url is None:
+            return False, "Invalid file type"
+        return True, url
+
+    def serve(self, filename):
+        # The type comes from the extension, whatever was stored
+        content_type = image_type(filename)
+        stored = self.pending.load(filename) if content_type else None
+        if stored is None:
+            abort(404)
+        response = Response(stored.data, mimetype=content_type)
+        # User-supplied bytes on our origin: never sniffed, scripted or rendered as a page
+        response.headers['X-Content-Type-Options'] = 'nosniff'
+        response.headers['Content-Security-Policy'] = "default-src 'none'"
+        response.headers['Content-Disposition'] = f'inline; filename="{os.path.basename(filename)}"'
+        response.cache_control.public = True
+        response.cache_control.max_age = LOCAL_MAX_AGE
+        return response
+
+    def start_resync(self):
+        """Move pending uploads to Cloudinary in the background (one run at a time)"""
+        with self._lock:
+            if self._resync_thread is not None and self._resync_thread.is_alive():
+                return
+            self._last_resync = time.monotonic()
+            self._resync_thread = threading.Thread(target=self._resync_in_app, name='upload-resync',
+                                                   daemon=True)
+            self._resync_thread.start()
+
+    def _resync_in_app(self):
+        with self._app.app_context():
+            try:
+                self.resync()
+            except Exception as e:
+                db.session.rollback()
+                current_app.logger.warning(f"Upload resync failed: {e}")
+            finally:
+                db.session.remove()
+
+    def resync(self):
+        """
+        Move pending uploads to Cloudinary while it accepts them
+        Returns: (images moved, images still pending)
+        """
+        uploads = PendingUpload.__table__
+        listings = BusinessListing.__table__
+        paths = db.session.execute(select(uploads.c.path).order_by(uploads.c.created_at)).scalars().all()
+        moved = 0
+        for position, path in enumerate(paths):
+            pending_url = LOCAL_URL_PREFIX + path
+            in_use = db.session.execute(select(listings.c.id).where(
+                listings.c.logo_url == pending_url).limit(1)).first()
+            stored = self.pending.load(path)
+            if stored is None or not in_use:
+                # Moved by another host, or replaced/deleted before it was moved
+                self.pending.discard([pending_url])
+                db.session.commit()
+                continue
+
+            image = io.BytesIO(stored.data)
+            image.name = os.path.basename(path)
+            url, error = self._to_cloudinary(image, os.path.dirname(path) or 'business_logos')
+            if error:
+                # Cloudinary rejects this image; it stays pending
+                current_app.logger.warning(f"Not re-syncing {pending_url}: {error}")
+                continue
+            if not url:
+                return moved, len(paths) - position
+
+            # Only listings that still use this image; updated_at re-renders cached cards
+            result = db.session.execute(listings.update().where(
+                listings.c.logo_url == pending_url).values(logo_url=url, updated_at=datetime.utcnow()))
+            self.pending.discard([pending_url])
+            db.session.commit()
+            if result.rowcount:
+                moved += 1
+            else:
+                # The listing changed its logo (or another host moved it) meanwhile
+                public_id = extract_public_id_from_url(url)
+                if public_id:
+                    delete_image_from_cloudinary(public_id)
+        return moved, 0
+
+
+image_storage = ImageStorage()
+
+
+def init_storage(app):
+    """Serve pending uploads and size the upload circuit breaker"""
+    image_storage.init_app(app)
+
+
+def upload_image(file, folder='business_logos'):
+    """Upload an image through the shared ImageStorage; returns (success, url_or_error)"""
+    return image_storage.upload_image(file, folder)
+
+
+# Local stand-in for the Cloudinary upload API
+
+class _StubHandler(BaseHTTPRequestHandler):
+    server_version = 'CloudinaryStub/1.0'
+
+    def _reply(self, status, body, content_type='application/json'):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        try:
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client gave up (its deadline passed)
+
+    def do_POST(self):
+        stub = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        stub.calls += 1
+        time.sleep(stub.latency * random.uniform(0.5, 1.5))
+        if stub.down or random.random() < stub.error_rate:
+            if stub.json_errors:
+                # What Cloudinary itself returns (e.g. 500 General Error, 420 rate limited)
+                self._reply(stub.error_status, {'error': {'message': 'General Error'}})
+            else:
+                # What a gateway in front of a failing service returns
+                self._reply(stub.error_status, b'Service Unavailable', 'text/plain')
+            return
+        if self.path.endswith('/destroy'):
+            self._reply(200, {'result': 'ok'})
+            return
+        public_id = f'stub/{uuid.uuid4().hex}'
+        stub.images[public_id] = body
+        self._reply(200, {
+            'public_id': public_id,
+            'version': 1,
+            'secure_url': f'http://{self.headers["Host"]}/stub/image/upload/v1/{public_id}.png',
+        })
+
+    def do_GET(self):
+        public_id = self.path.rsplit('/v1/', 1)[-1].rsplit('.', 1)[0]
+        if public_id in self.server.images:
+            self._reply(200, self.server.images[public_id], 'application/octet-stream')
+        else:
+            self._reply(404, {'error': {'message': 'Not found'}})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_cloudinary_stub(port=8765, latency=0.0, error_rate=0.0, down=False,
+                         error_status=503, json_errors=False):
+    """
+    Fake upload API on 127.0.0.1:port (0 picks a free port); call serve_forever()
+    Every call takes about `latency` seconds; a share `error_rate` of them
+    (all of them if `down`) fail with `error_status`: a plain-text gateway
+    page, or a Cloudinary-style JSON error if `json_errors`. The attributes of
+    the returned server can be changed while it runs.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), _StubHandler)
+    server.latency = latency
+    server.error_rate = error_rate
+    server.down = down
+    server.error_status = error_status
+    server.json_errors = json_errors
+    server.images = {}
+    server.calls = 0  # Upload API requests received
+    server.daemon_threads = True
+    return server
+
+
+def run_cloudinary_stub(port=8765, latency=0.0, error_rate=0.0, down=False,
+                        error_status=503, json_errors=False):
+    """Serve a fake upload API (see make_cloudinary_stub) until interrupted"""
+    server = make_cloudinary_stub(port, latency, error_rate, down, error_status, json_errors)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
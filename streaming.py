@@ -0,0 +1,142 @@
+"""
+Streamed HTML pages and on-the-fly response compression
+
+stream_page() renders a template incrementally: the page header and filter
+UI go out while the cards are still being read from the database cursor,
+so time-to-first-byte and per-request memory no longer grow with the
+number of listings. Jinja's per-statement output is coalesced into
+STREAM_BUFFER_SIZE chunks so each network write carries a useful amount.
+
+init_compression() gzip/brotli-compresses text responses after the view
+has run. Streamed bodies are compressed chunk by chunk with a sync flush,
+so compression never holds back a chunk that is ready to send. A strong
+ETag stays strong: each encoding gets its own ("<etag>-br", "<etag>-gz"),
+so If-None-Match and If-Range keep working on compressed responses.
+"""
+import gzip
+import zlib
+
+from flask import Response, current_app, request, stream_template
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/javascript',
+    'application/javascript', 'application/json', 'image/svg+xml',
+}
+
+# Appended to a strong ETag for each encoded representation
+ETAG_SUFFIXES = {'br': 'br', 'gzip': 'gz'}
+
+
+def stream_rows(query):
+    """
+    Iterate a query's results in batches from a server-side cursor
+    Rows already rendered are not kept alive, so memory stays flat.
+    """
+    return query.yield_per(current_app.config['STREAM_BATCH_SIZE'])
+
+
+def _coalesce(chunks, size):
+    """Join small template chunks into writes of at least `size` characters"""
+    buffer = []
+    buffered = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered += len(chunk)
+        if buffered >= size:
+            yield ''.join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def stream_page(template_name, **context):
+    """Render a template as a streamed (chunked) HTML response"""
+    chunks = stream_template(template_name, **context)
+    return Response(_coalesce(chunks, current_app.config['STREAM_BUFFER_SIZE']),
+                    mimetype='text/html')
+
+
+def _negotiate_encoding():
+    """Best encoding the client accepts: br, then gzip, else None"""
+    if brotli is not None and request.accept_encodings['br']:
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def _compressor(encoding):
+    """
+    Incremental compressor for one response
+    Returns: (compress_chunk, finish) callables producing bytes
+    """
+    config = current_app.config
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=config['COMPRESS_BROTLI_QUALITY'])
+        return (lambda chunk: compressor.process(chunk) + compressor.flush(),
+                compressor.finish)
+    compressor = zlib.compressobj(config['COMPRESS_GZIP_LEVEL'], zlib.DEFLATED, 31)
+    return (lambda chunk: compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH),
+            compressor.flush)
+
+
+def _compress_stream(body, encoding):
+    """Compress a streamed body chunk by chunk"""
+    compress_chunk, finish = _compressor(encoding)
+    try:
+        for chunk in body:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            if chunk:
+                yield compress_chunk(chunk)
+        yield finish()
+    finally:
+        # Ends the streamed request context even if the client went away
+        if hasattr(body, 'close'):
+            body.close()
+
+
+def compress_response(response):
+    """after_request hook: gzip/brotli-encode text responses"""
+    if (response.mimetype not in COMPRESSIBLE_MIMETYPES or response.direct_passthrough
+            or response.status_code != 200 or 'Content-Encoding' in response.headers):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = _negotiate_encoding()
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < current_app.config['COMPRESS_MIN_SIZE']:
+            return response
+        if encoding == 'br':
+            data = brotli.compress(data, quality=current_app.config['COMPRESS_BROTLI_QUALITY'])
+        else:
+            data = gzip.compress(data, compresslevel=current_app.config['COMPRESS_GZIP_LEVEL'])
+        response.set_data(data)
+
+    response.headers['Content-Encoding'] = encoding
+    # The encoded bytes differ from the identity representation
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f'{etag}-{ETAG_SUFFIXES[encoding]}', weak=weak)
+        if request.if_none_match:
+            # The view compared it with the identity ETag; a cached encoding still matches
+            response = response.make_conditional(request)
+    return response
+
+
+def init_compression(app):
+    """Compress text responses for clients that accept it"""
+    app.after_request(compress_response)
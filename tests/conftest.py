@@ -0,0 +1,56 @@
+"""
+Shared fixtures: the app on a throwaway SQLite database and a local Cloudinary stub
+"""
+import os
+import sys
+import tempfile
+import threading
+
+import pytest
+
+_db_file = os.path.join(tempfile.mkdtemp(), 'test.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{_db_file}'
+os.environ['DATABASE_REPLICA_URLS'] = ''
+# Cloudinary refuses to sign calls without credentials; the stub ignores them
+os.environ['CLOUDINARY_CLOUD_NAME'] = 'test-cloud'
+os.environ['CLOUDINARY_API_KEY'] = 'test-key'
+os.environ['CLOUDINARY_API_SECRET'] = 'test-secret'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cloudinary  # noqa: E402
+
+from main import app as flask_app, db  # noqa: E402
+from storage import make_cloudinary_stub  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    """The app on empty tables; requests get their own app context (and g)"""
+    flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+    return flask_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def serve_in_thread(server):
+    """Run an HTTP server in a daemon thread; returns its base URL"""
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_address[1]}'
+
+
+@pytest.fixture
+def cloudinary_stub():
+    """The fake upload API on a free port, with Cloudinary pointed at it"""
+    server = make_cloudinary_stub(port=0)
+    previous = cloudinary.config().upload_prefix
+    cloudinary.config(upload_prefix=serve_in_thread(server))
+    yield server
+    cloudinary.config(upload_prefix=previous)
+    server.shutdown()
+    server.server_close()
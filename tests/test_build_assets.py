@@ -0,0 +1,16 @@
+from build_assets import minify_css
+
+
+def test_minify_css_keeps_descendant_pseudo_class_selectors():
+    assert minify_css('div :hover { color: red; }') == 'div :hover{color:red}'
+    assert minify_css('a:hover, p > :first-child { margin: 0 auto }') == 'a:hover,p>:first-child{margin:0 auto}'
+
+
+def test_minify_css_leaves_strings_alone():
+    css = 'a[title="x: y"] :focus { content: "a: b"; }'
+    assert minify_css(css) == 'a[title="x: y"] :focus{content:"a: b"}'
+
+
+def test_minify_css_compacts_nested_declarations():
+    css = '@media (max-width: 600px) {\n  .card :is(h2, h3) {\n    font-size: 1rem;\n  }\n}'
+    assert minify_css(css) == '@media (max-width: 600px){.card :is(h2,h3){font-size:1rem}}'
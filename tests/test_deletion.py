@@ -0,0 +1,61 @@
+from deletion import delete_business_listings, image_cleanup
+from models import db, User, BusinessListing
+
+OWN_LOGO = 'https://res.cloudinary.com/test-cloud/image/upload/v1/business_logos/cafe.png'
+PASTED_LOGO = 'https://res.cloudinary.com/someone-else/image/upload/v1/business_logos/cafe.png'
+
+
+def test_deleted_listings_queue_only_their_own_logos(app, cloudinary_stub):
+    with app.app_context():
+        user = User(name='Owner', email='owner@example.com', oauth_provider='local')
+        db.session.add(user)
+        db.session.flush()
+        listings = [BusinessListing(user_id=user.id, business_name=name, category='Food', logo_url=logo)
+                    for name, logo in [('Cafe', OWN_LOGO), ('Copy', PASTED_LOGO), ('Keep', None)]]
+        db.session.add_all(listings)
+        db.session.commit()
+
+        assert delete_business_listings([listings[0].id, listings[1].id]) == 2
+        assert image_cleanup.wait(5)
+
+    assert cloudinary_stub.calls == 1
+
+
+def login(client, user_id):
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+
+
+def create_user(app):
+    with app.app_context():
+        user = User(name='Owner', email='owner@example.com', oauth_provider='local')
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+
+def test_account_deletion_logs_out_after_the_delete(app, client):
+    user_id = create_user(app)
+    login(client, user_id)
+
+    response = client.post('/dashboard/account/delete')
+
+    assert response.headers['Location'].endswith('/')
+    with client.session_transaction() as session:
+        assert '_user_id' not in session
+    with app.app_context():
+        assert db.session.get(User, user_id) is None
+
+
+def test_failed_account_deletion_keeps_the_user_logged_in(app, client, monkeypatch):
+    user_id = create_user(app)
+    login(client, user_id)
+
+    def fail(user_id):
+        raise TimeoutError('statement timeout')
+    monkeypatch.setattr('main.remove_account', fail)
+    response = client.post('/dashboard/account/delete')
+
+    assert response.headers['Location'].endswith('/dashboard')
+    with client.session_transaction() as session:
+        assert session['_user_id'] == str(user_id)
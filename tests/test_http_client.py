@@ -0,0 +1,87 @@
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from authlib.jose import JsonWebKey, jwt
+
+from conftest import serve_in_thread
+from http_client import DocumentCache, get_document_cache, get_session
+from main import oauth
+
+
+class _IdentityProviderHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        idp = self.server
+        idp.fetches[self.path] = idp.fetches.get(self.path, 0) + 1
+        if self.path == '/.well-known/openid-configuration':
+            body = {'issuer': idp.url, 'jwks_uri': f'{idp.url}/certs'}
+        elif self.path == '/certs':
+            body = {'keys': [key.as_dict() for key in idp.keys]}
+        else:
+            self.send_error(404)
+            return
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def signing_key(kid):
+    return JsonWebKey.generate_key('RSA', 2048, is_private=True, options={'kid': kid})
+
+
+@pytest.fixture
+def idp(app):
+    """Identity provider serving metadata and a JWKS without Cache-Control"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _IdentityProviderHandler)
+    server.fetches = {}
+    server.keys = [signing_key('k1')]
+    server.url = serve_in_thread(server)
+    get_document_cache().clear()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def id_token(idp, key, client_id='test-client'):
+    now = int(time.time())
+    claims = {'iss': idp.url, 'aud': client_id, 'sub': '1', 'iat': now, 'exp': now + 300,
+              'nonce': 'n'}
+    return jwt.encode({'alg': 'RS256', 'kid': key.kid}, claims, key).decode()
+
+
+def test_documents_without_max_age_are_kept_for_the_default_ttl(idp):
+    now = [0.0]
+    cache = DocumentCache(get_session(), clock=lambda: now[0], default_ttl=3600)
+
+    cache.get_json(f'{idp.url}/certs')
+    cache.get_json(f'{idp.url}/certs')
+    assert idp.fetches['/certs'] == 1
+
+    now[0] += 3601
+    cache.get_json(f'{idp.url}/certs')
+    assert idp.fetches['/certs'] == 2
+
+
+def test_jwks_is_refetched_only_for_an_unknown_kid(idp):
+    client = oauth.register(name=f'idp{id(idp)}', client_id='test-client', client_secret='secret',
+                            server_metadata_url=f'{idp.url}/.well-known/openid-configuration')
+    first = idp.keys[0]
+
+    for _ in range(3):
+        client.parse_id_token({'id_token': id_token(idp, first)}, nonce='n')
+    assert idp.fetches['/certs'] == 1
+    assert idp.fetches['/.well-known/openid-configuration'] == 1
+
+    # Key rotation: a token signed with a key the cached set doesn't have
+    rotated = signing_key('k2')
+    idp.keys.append(rotated)
+    client.parse_id_token({'id_token': id_token(idp, rotated)}, nonce='n')
+    client.parse_id_token({'id_token': id_token(idp, first)}, nonce='n')
+    assert idp.fetches['/certs'] == 2
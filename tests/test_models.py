@@ -0,0 +1,25 @@
+import logging
+
+from sqlalchemy import text
+
+from models import db, User, ProfessionalProfile, json_decode_errors
+
+
+def test_corrupt_json_loads_as_none_and_is_logged_once(app, caplog):
+    with app.app_context():
+        user = User(name='Ada', email='ada@example.com', oauth_provider='local')
+        db.session.add(user)
+        db.session.flush()
+        db.session.add(ProfessionalProfile(user_id=user.id, job_title='Dev'))
+        db.session.commit()
+        db.session.execute(text("UPDATE professional_profiles SET skills_json = '[\"python\"'"))
+        db.session.commit()
+        json_decode_errors.clear()
+
+        with caplog.at_level(logging.WARNING, logger='models'):
+            for _ in range(3):
+                db.session.expire_all()
+                assert ProfessionalProfile.query.one().skills_json is None
+
+    assert json_decode_errors['professional_profiles.skills_json'] == 3
+    assert len([r for r in caplog.records if 'Corrupt JSON' in r.message]) == 1
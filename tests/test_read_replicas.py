@@ -0,0 +1,77 @@
+import re
+
+import pytest
+from sqlalchemy import create_engine
+
+from db_routing import simulate_replication
+from main import google
+from models import db, User, BusinessListing
+
+
+@pytest.fixture
+def replica(app, tmp_path):
+    """A SQLite replica of the primary, refreshed by calling replicate()"""
+    with app.app_context():
+        primary = db.engine.url.database
+        engines = db.engines
+    path = str(tmp_path / 'replica.db')
+    engine = create_engine(f'sqlite:///{path}')
+    engines['replica_0'] = engine
+    # Replication lag longer than the read-your-writes window
+    app.config['READ_YOUR_WRITES_WINDOW'] = 0
+
+    def replicate():
+        simulate_replication(primary, [path], lag=0, rounds=1)
+
+    yield replicate
+    del engines['replica_0']
+    engine.dispose()
+    app.config['READ_YOUR_WRITES_WINDOW'] = 5
+
+
+def login(client, user_id):
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+
+
+def rendered_version(response):
+    return int(re.search(r'name="version" value="(\d+)"', response.get_data(as_text=True)).group(1))
+
+
+def test_edit_form_renders_the_primary_version(app, client, replica):
+    with app.app_context():
+        user = User(name='Owner', email='owner@example.com', oauth_provider='local')
+        db.session.add(user)
+        db.session.flush()
+        listing = BusinessListing(user_id=user.id, business_name='Cafe', category='Food')
+        db.session.add(listing)
+        db.session.commit()
+        user_id, listing_id = user.id, listing.id
+    replica()
+    login(client, user_id)
+    form = {'business_name': 'Cafe', 'category': 'Food', 'description': 'First edit'}
+
+    client.post(f'/dashboard/business/edit/{listing_id}', data=dict(form, version=1))
+    response = client.get(f'/dashboard/business/edit/{listing_id}')
+    assert rendered_version(response) == 2
+
+    form['description'] = 'Second edit'
+    client.post(f'/dashboard/business/edit/{listing_id}',
+                data=dict(form, version=rendered_version(response)))
+    with app.app_context():
+        assert db.session.get(BusinessListing, listing_id).description == 'Second edit'
+
+
+def test_oauth_callback_finds_users_the_replica_lacks(app, client, replica, monkeypatch):
+    replica()
+    with app.app_context():
+        db.session.add(User(name='Ada', email='ada@example.com', oauth_provider='google'))
+        db.session.commit()
+    monkeypatch.setattr(google, 'authorize_access_token', lambda: {
+        'userinfo': {'email': 'ada@example.com', 'name': 'Ada', 'picture': None}})
+
+    response = client.get('/auth/google/callback')
+
+    assert response.headers['Location'].endswith('/dashboard')
+    with app.app_context():
+        assert User.query.filter_by(email='ada@example.com').count() == 1
@@ -0,0 +1,55 @@
+import random
+
+from models import db, User, BusinessListing, Neighbor
+from recommendations import BUSINESS, _candidates, recompute_neighbors, refresh_neighbors
+
+CATEGORIES = ['Food', 'Retail', 'Tech']
+LOCATIONS = ['London', 'Leeds, UK', 'Paris', 'York', '']
+
+
+def stored_scores():
+    lists = {}
+    for neighbor in Neighbor.query.filter_by(entity_type=BUSINESS).order_by(
+            Neighbor.entity_id, Neighbor.rank):
+        lists.setdefault(neighbor.entity_id, []).append(round(neighbor.score, 4))
+    return lists
+
+
+def seed_listings(count, rng):
+    user = User(name='Owner', email='owner@example.com', oauth_provider='local')
+    db.session.add(user)
+    db.session.flush()
+    db.session.add_all(BusinessListing(user_id=user.id, business_name=f'Listing {i}',
+                                       category=rng.choice(CATEGORIES), location=rng.choice(LOCATIONS))
+                       for i in range(count))
+    db.session.commit()
+
+
+def test_incremental_refresh_matches_a_full_recompute(app):
+    rng = random.Random(7)
+    app.config.update(RECOMMENDATION_COUNT=4, RECOMMENDATION_CANDIDATES_PER_FEATURE=500)
+    with app.app_context():
+        seed_listings(40, rng)
+        recompute_neighbors()
+        listings = BusinessListing.query.all()
+        for _ in range(25):
+            listing = rng.choice(listings)
+            listing.category = rng.choice(CATEGORIES)
+            listing.location = rng.choice(LOCATIONS)
+            db.session.commit()
+            refresh_neighbors(BUSINESS, [listing.id])
+
+        incremental = stored_scores()
+        recompute_neighbors()
+        assert incremental == stored_scores()
+
+
+def test_candidates_are_capped_per_feature(app):
+    with app.app_context():
+        seed_listings(60, random.Random(3))
+        recompute_neighbors()
+        listing = BusinessListing.query.filter(BusinessListing.location == 'London').first()
+
+        # Two features: its category and place:london
+        assert len(_candidates(BUSINESS, listing.id, limit=5)) <= 2 * 5
+        assert len(_candidates(BUSINESS, listing.id, limit=1000)) > 15
@@ -0,0 +1,147 @@
+import io
+import time
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from models import db, User, BusinessListing, PendingUpload
+from storage import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, LOCAL_URL_PREFIX, image_storage
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\0' * 64
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(app):
+    clock = FakeClock()
+    image_storage.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=clock)
+    # Keep successful uploads from starting a background resync mid-test
+    image_storage._last_resync = time.monotonic()
+    return clock
+
+
+def image(filename='logo.png', content_type='image/png', data=PNG):
+    return FileStorage(io.BytesIO(data), filename=filename, content_type=content_type)
+
+
+def upload(app, file):
+    with app.test_request_context():
+        result = image_storage.upload_image(file)
+        db.session.commit()
+        return result
+
+
+def pending(app, url):
+    """The stored row behind a pending upload URL"""
+    with app.app_context():
+        return db.session.get(PendingUpload, url[len(LOCAL_URL_PREFIX):])
+
+
+def pending_count(app):
+    with app.app_context():
+        return PendingUpload.query.count()
+
+
+def test_breaker_opens_after_threshold_and_half_opens_after_reset(app, clock, cloudinary_stub):
+    cloudinary_stub.down = True
+    upload(app, image())
+    assert image_storage.breaker.state == CLOSED
+    upload(app, image())
+    assert image_storage.breaker.state == OPEN
+
+    # Open: uploads skip Cloudinary
+    upload(app, image())
+    assert cloudinary_stub.calls == 2
+
+    clock.now += 30
+    assert image_storage.breaker.allow()
+    assert image_storage.breaker.state == HALF_OPEN
+    # Only one trial call while half-open
+    assert not image_storage.breaker.allow()
+    image_storage.breaker.record_failure()
+    assert image_storage.breaker.state == OPEN
+
+    clock.now += 30
+    cloudinary_stub.down = False
+    success, url = upload(app, image())
+    assert success and url.startswith('http://')
+    assert image_storage.breaker.state == CLOSED
+
+
+@pytest.mark.parametrize('status,json_errors', [(503, False), (500, True), (420, True), (429, True)])
+def test_outages_fall_back_to_the_database(app, clock, cloudinary_stub, status, json_errors):
+    cloudinary_stub.down = True
+    cloudinary_stub.error_status = status
+    cloudinary_stub.json_errors = json_errors
+
+    success, url = upload(app, image())
+
+    assert success and url.startswith(LOCAL_URL_PREFIX)
+    assert image_storage.breaker.failures == 1
+    assert pending(app, url).data == PNG
+    response = app.test_client().get(url)
+    assert response.status_code == 200
+    assert response.data == PNG
+
+
+def test_rejected_images_do_not_count_as_failures(app, clock, cloudinary_stub):
+    cloudinary_stub.down = True
+    cloudinary_stub.error_status = 400
+    cloudinary_stub.json_errors = True
+
+    success, error = upload(app, image())
+
+    assert not success and error.startswith('Cloudinary error')
+    assert image_storage.breaker.failures == 0
+    assert pending_count(app) == 0
+
+
+def test_resync_moves_pending_uploads_to_cloudinary(app, clock, cloudinary_stub):
+    cloudinary_stub.down = True
+    success, url = upload(app, image())
+    assert url.startswith(LOCAL_URL_PREFIX)
+    with app.app_context():
+        user = User(name='Owner', email='owner@example.com', oauth_provider='local')
+        db.session.add(user)
+        db.session.flush()
+        db.session.add(BusinessListing(user_id=user.id, business_name='Cafe', category='Food',
+                                       logo_url=url))
+        db.session.commit()
+
+    cloudinary_stub.down = False
+    clock.now += 30
+    with app.app_context():
+        assert image_storage.resync() == (1, 0)
+        logo_url = BusinessListing.query.one().logo_url
+
+    assert logo_url.startswith('http://') and '/stub/image/upload/' in logo_url
+    assert pending_count(app) == 0
+    assert any(PNG in body for body in cloudinary_stub.images.values())
+
+
+def test_served_type_comes_from_the_extension(app, clock, cloudinary_stub):
+    cloudinary_stub.down = True
+    html = b'<script>alert(1)</script>'
+
+    success, url = upload(app, image('logo.jpg', 'text/html', html))
+
+    assert success and url.endswith('.jpg')
+    assert pending(app, url).content_type == 'image/jpeg'
+    response = app.test_client().get(url)
+    assert response.mimetype == 'image/jpeg'
+    assert response.headers['X-Content-Type-Options'] == 'nosniff'
+    assert response.headers['Content-Security-Policy'] == "default-src 'none'"
+
+
+def test_non_image_extensions_are_refused(app, clock, cloudinary_stub):
+    cloudinary_stub.down = True
+    success, error = upload(app, image('logo.html', 'text/html', b'<html></html>'))
+    assert not success
+    assert pending_count(app) == 0
@@ -0,0 +1,32 @@
+import pytest
+
+from models import db, User
+
+
+@pytest.fixture
+def avatar_url(app):
+    app.config['COMPRESS_MIN_SIZE'] = 0
+    with app.app_context():
+        user = User(name='Ada Lovelace', email='ada@example.com', oauth_provider='local')
+        db.session.add(user)
+        db.session.commit()
+        url = f'/avatar/{user.id}.svg'
+    yield url
+    app.config['COMPRESS_MIN_SIZE'] = 500
+
+
+@pytest.mark.parametrize('encoding,suffix', [('gzip', '-gz'), ('br', '-br')])
+def test_compressed_responses_keep_a_strong_etag_per_encoding(client, avatar_url, encoding, suffix):
+    identity = client.get(avatar_url)
+    etag, weak = identity.get_etag()
+    assert etag and not weak
+
+    response = client.get(avatar_url, headers={'Accept-Encoding': encoding})
+    assert response.headers['Content-Encoding'] == encoding
+    assert response.get_etag() == (etag + suffix, False)
+    assert 'Accept-Encoding' in response.vary
+
+    revalidated = client.get(avatar_url, headers={
+        'Accept-Encoding': encoding, 'If-None-Match': response.headers['ETag']})
+    assert revalidated.status_code == 304
+    assert client.get(avatar_url, headers={'If-None-Match': f'"{etag}"'}).status_code == 304
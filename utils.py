@@ -1,9 +1,11 @@
 import cloudinary
+import cloudinary.exceptions
 import cloudinary.uploader
 from flask import current_app
-from werkzeug.utils import secure_filename
 import os
 
+from http_client import last_response_status, reset_response_status
+
 def init_cloudinary():
     """Initialize Cloudinary with configuration"""
     cloudinary.config(
@@ -11,6 +13,9 @@ def init_cloudinary():
         api_key=current_app.config['CLOUDINARY_API_KEY'],
         api_secret=current_app.config['CLOUDINARY_API_SECRET']
     )
+    # e.g. http://127.0.0.1:8765 for the local stub (flask cloudinary-stub)
+    if current_app.config['CLOUDINARY_UPLOAD_PREFIX']:
+        cloudinary.config(upload_prefix=current_app.config['CLOUDINARY_UPLOAD_PREFIX'])
 
 def allowed_file(filename):
     """Check if file extension is allowed"""
@@ -45,39 +50,37 @@ def validate_image(file):
     
     return True, None
 
-def upload_image_to_cloudinary(file, folder="business_logos"):
+def cloudinary_upload(file, folder="business_logos", timeout=None):
     """
-    Upload image to Cloudinary
-    Returns: (success, url_or_error)
+    Upload an (already validated) image to Cloudinary
+    timeout: seconds or a urllib3 Timeout for the whole call
+    Returns: the secure URL; raises cloudinary.exceptions.Error on failure, whose
+    http_code is the status Cloudinary replied with (None if no reply came)
     """
+    reset_response_status()
     try:
-        # Validate file
-        is_valid, error = validate_image(file)
-        if not is_valid:
-            return False, error
-        
-        # Secure the filename
-        filename = secure_filename(file.filename)
-        
-        # Upload to Cloudinary
         result = cloudinary.uploader.upload(
             file,
             folder=folder,
             resource_type="image",
+            timeout=timeout,
+            return_error=True,
             transformation=[
                 {'width': 800, 'height': 800, 'crop': 'limit'},
                 {'quality': 'auto:good'},
                 {'fetch_format': 'auto'}
             ]
         )
-        
-        # Return the secure URL
-        return True, result['secure_url']
-    
     except cloudinary.exceptions.Error as e:
-        return False, f"Cloudinary error: {str(e)}"
-    except Exception as e:
-        return False, f"Upload error: {str(e)}"
+        # Timeouts, connection errors and non-JSON error pages
+        e.http_code = last_response_status()
+        raise
+    if 'error' in result:
+        error = cloudinary.exceptions.Error(result['error']['message'])
+        # Cloudinary reports 400-404 and 500 all as http_code 200
+        error.http_code = last_response_status() or result['error']['http_code']
+        raise error
+    return result['secure_url']
 
 def delete_image_from_cloudinary(public_id):
     """
@@ -92,6 +95,17 @@ def delete_image_from_cloudinary(public_id):
     except Exception as e:
         return False, f"Delete error: {str(e)}"
 
+def is_own_upload(cloudinary_url, folder="business_logos"):
+    """
+    Check whether a URL is an image this app uploaded (our cloud, our upload folder)
+    Anything else may belong to someone else, e.g. a logo URL pasted from elsewhere
+    """
+    cloud_name = current_app.config['CLOUDINARY_CLOUD_NAME']
+    public_id = extract_public_id_from_url(cloudinary_url)
+    return bool(cloud_name and public_id and
+                f'/{cloud_name}/image/upload/' in cloudinary_url and
+                public_id.startswith(f'{folder}/'))
+
 def extract_public_id_from_url(cloudinary_url):
     """
     Extract public_id from Cloudinary URL
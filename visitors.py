@@ -0,0 +1,154 @@
+"""
+Visitor identification and fixed-memory sketches for view deduplication
+
+RotatingBloomFilter answers "has this visitor already viewed this listing
+in the current window?" in constant memory however many visitors there are.
+HyperLogLog estimates how many distinct visitors a listing had, in 1 KB per
+sketch, and sketches merge losslessly so per-day sketches add up to any range.
+
+Each worker keeps its own Bloom filter, so a visitor whose requests land on
+different workers can be counted once per worker within a window.
+"""
+import hashlib
+import math
+import re
+import threading
+import time
+
+from flask import request, session
+from flask_login import current_user
+
+# Crawlers, link unfurlers, uptime monitors and scripted clients
+BOT_USER_AGENT = re.compile(
+    r'bot|crawl|spider|slurp|archiver|fetch|scrape|monitor|uptime|pingdom|'
+    r'preview|facebookexternalhit|embedly|whatsapp|telegram|discord|skype|'
+    r'headless|phantom|selenium|puppeteer|playwright|lighthouse|'
+    r'curl|wget|httpie|python-requests|python-urllib|aiohttp|go-http-client|'
+    r'java/|okhttp|libwww|axios|node-fetch|postman',
+    re.IGNORECASE)
+
+
+def is_bot(user_agent):
+    """Heuristic crawler check on the User-Agent header (missing counts as a bot)"""
+    if not user_agent or len(user_agent) < 10:
+        return True
+    return BOT_USER_AGENT.search(user_agent) is not None
+
+
+def visitor_id():
+    """
+    Stable identifier for the current visitor
+    Logged-in users are identified by account. Anonymous visitors get an id
+    derived from client address + User-Agent, which is then kept in their
+    session so it survives address changes; clients that drop cookies keep
+    getting the same derived id.
+    """
+    if current_user.is_authenticated:
+        return f'u:{current_user.id}'
+
+    vid = session.get('visitor_id')
+    if not vid:
+        client = request.access_route[0] if request.access_route else request.remote_addr
+        fingerprint = f"{client}|{request.headers.get('User-Agent', '')}"
+        vid = hashlib.blake2b(fingerprint.encode(), digest_size=8).hexdigest()
+        session['visitor_id'] = vid
+    return f'a:{vid}'
+
+
+def _hash64(value):
+    """Two independent 64-bit hashes of a string"""
+    digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little')
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter sized for a capacity and false-positive rate"""
+
+    def __init__(self, capacity, error_rate):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        h1, h2 = _hash64(item)
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(item))
+
+
+class RotatingBloomFilter:
+    """
+    Two Bloom filter generations, each covering one window
+    An item is "seen" if either generation has it, so a repeat is suppressed
+    for at least one window and at most two. Memory stays at two filters.
+    """
+
+    def __init__(self, window, capacity, error_rate, clock=time.monotonic):
+        self.window = window
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.clock = clock
+        self._current = BloomFilter(capacity, error_rate)
+        self._previous = BloomFilter(capacity, error_rate)
+        self._rotated_at = clock()
+        self._lock = threading.Lock()
+
+    def _rotate_if_needed(self):
+        now = self.clock()
+        if now - self._rotated_at >= self.window:
+            # After two idle windows nothing in the old generation is relevant
+            stale = now - self._rotated_at >= 2 * self.window
+            self._previous = BloomFilter(self.capacity, self.error_rate) if stale else self._current
+            self._current = BloomFilter(self.capacity, self.error_rate)
+            self._rotated_at = now
+
+    def check_and_add(self, item):
+        """Return True if the item was already seen in the window, recording it either way"""
+        with self._lock:
+            self._rotate_if_needed()
+            if item in self._current:
+                return True
+            seen = item in self._previous
+            self._current.add(item)
+            return seen
+
+
+class HyperLogLog:
+    """Distinct-count sketch with 2**precision one-byte registers"""
+
+    def __init__(self, precision=10, registers=None):
+        self.precision = precision
+        self.count = 1 << precision
+        self.registers = bytearray(registers) if registers else bytearray(self.count)
+
+    def add(self, item):
+        h, _ = _hash64(item)
+        index = h & (self.count - 1)
+        rest = h >> self.precision
+        # Position of the lowest set bit in the remaining 64 - p bits
+        rank = (rest & -rest).bit_length() if rest else 64 - self.precision + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """Fold another sketch of the same precision into this one"""
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self):
+        m = self.count
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            return round(m * math.log(m / zeros))
+        return round(raw)
+
+    def to_bytes(self):
+        return bytes(self.registers)